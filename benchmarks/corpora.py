@@ -0,0 +1,143 @@
+"""
+Inputs for the controller benchmarks.
+
+Macro frames are zero length so that every tick plays a new frame,
+which is the most work a tick can do. Direct input streams are lists of
+packets sent one per tick, as the webapp does while input is held.
+Switch traffic is a list of reports (or None) received one per tick.
+"""
+
+import math
+from copy import deepcopy
+
+from nxbt.controller.input import DIRECT_INPUT_IDLE_PACKET
+from nxbt.controller.simulator import COMMANDS, RUMBLE_ONLY, SET_PLAYER_LIGHTS
+
+
+def _sweep(stick, steps):
+
+    lines = []
+    for i in range(steps):
+        angle = 2 * math.pi * i / steps
+        x = round(100 * math.cos(angle))
+        y = round(100 * math.sin(angle))
+        lines.append(f"{stick}@{x:+04d}{y:+04d} 0.0s")
+    return lines
+
+
+MACROS = {
+    # Single button taps, the most common macro
+    "short_taps": """
+A 0.0s
+0.0s
+B 0.0s
+0.0s
+DPAD_UP 0.0s
+0.0s
+""",
+    # Deeply repeated button mashing
+    "huge_loop": """
+LOOP 100000
+    A B 0.0s
+    0.0s
+    LOOP 10
+        X Y 0.0s
+        0.0s
+""",
+    # Both sticks swept around their full range
+    "analog_sweep": "\n".join(
+        _sweep("L_STICK", 360) + _sweep("R_STICK", 360)),
+    # A long, mixed macro (see demo.py)
+    "mixed": """
+LOOP 12
+    B 0.0s
+    0.0s
+DPAD_RIGHT 0.0s
+0.0s
+A 0.0s
+DPAD_DOWN 0.0s
+A 0.0s
+L_STICK_PRESS 0.0s
+L_STICK@-100+000 0.0s
+L_STICK@+000+100 0.0s
+L_STICK@+100+000 0.0s
+L_STICK@+000-100 0.0s
+B 0.0s
+R_STICK_PRESS 0.0s
+R_STICK@-100+000 0.0s
+R_STICK@+000+100 0.0s
+R_STICK@+100+000 0.0s
+R_STICK@+000-100 0.0s
+LOOP 4
+    B 0.0s
+    0.0s
+ZL ZR L R 0.0s
+0.0s
+""" * 20,
+}
+
+
+def _packet(**buttons):
+
+    packet = deepcopy(DIRECT_INPUT_IDLE_PACKET)
+    packet.update(buttons)
+    return packet
+
+
+def _stick_packet(left_x, left_y, right_x, right_y):
+
+    packet = deepcopy(DIRECT_INPUT_IDLE_PACKET)
+    packet["L_STICK"]["X_VALUE"] = left_x
+    packet["L_STICK"]["Y_VALUE"] = left_y
+    packet["R_STICK"]["X_VALUE"] = right_x
+    packet["R_STICK"]["Y_VALUE"] = right_y
+    return packet
+
+
+# Unchanged packets are resent every tick while input is held
+_held = _packet(A=True, DPAD_LEFT=True)
+# Packets changing every tick, as with a gamepad's analog sticks
+_sweep_packets = []
+for _i in range(360):
+    _angle = 2 * math.pi * _i / 360
+    _sweep_packets.append(_stick_packet(
+        round(100 * math.cos(_angle)), round(100 * math.sin(_angle)),
+        round(-100 * math.sin(_angle)), round(100 * math.cos(_angle))))
+
+DIRECT_INPUT = {
+    "held_buttons": [_held] * 2,
+    "button_mash": [_packet(A=True), _packet(B=True), _packet()],
+    "analog_sweep": _sweep_packets,
+}
+
+
+def switch_traffic(ticks=132):
+    """Builds a second of Switch traffic at a given tick rate. The
+    Switch sends rumble at ~60Hz and a subcommand every quarter second.
+
+    :param ticks: The number of ticks in a second, defaults to 132
+    :type ticks: int, optional
+    :return: The report received on each tick (or None)
+    :rtype: list
+    """
+
+    commands = COMMANDS + [SET_PLAYER_LIGHTS]
+    traffic = []
+    sent = 0
+    for tick in range(ticks):
+        if tick % (ticks // 4) == 0:
+            traffic.append(commands[sent % len(commands)])
+            sent += 1
+        elif tick * 60 // ticks != (tick + 1) * 60 // ticks:
+            traffic.append(RUMBLE_ONLY)
+        else:
+            traffic.append(None)
+    return traffic
+
+
+SWITCH_TRAFFIC = {
+    "idle": [None],
+    "rumble": [RUMBLE_ONLY],
+    "pairing": COMMANDS,
+    "connected": switch_traffic(),
+}
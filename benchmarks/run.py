@@ -0,0 +1,377 @@
+"""
+Benchmarks the controller hot path: the work done on each of the
+132 ticks a second, as well as macro and direct input parsing.
+
+Each benchmark reports the mean time per tick (or call), the 99th
+percentile, the max jitter (slowest tick less the median tick) and the
+memory allocated and retained per tick. Results are compared against
+the stored baseline, and the run fails if a benchmark's time or
+allocations regress past the given tolerance.
+
+Usage: python3 benchmarks/run.py [--filter TEXT] [--ticks N]
+                                 [--simulate] [--save]
+                                 [--baseline PATH] [--tolerance RATIO]
+"""
+
+import os
+import sys
+import gc
+import json
+import argparse
+import platform
+import tracemalloc
+from time import perf_counter_ns
+
+from nxbt.controller import ControllerTypes
+from nxbt.controller.protocol import ControllerProtocol
+from nxbt.controller.input import InputParser
+from nxbt.controller.simulator import COMMANDS, INPUT_MODE
+
+from corpora import MACROS, DIRECT_INPUT, SWITCH_TRAFFIC
+
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "baseline.json")
+
+# Fields compared against the baseline. Jitter is reported
+# but too noisy to fail a run on.
+COMPARED_FIELDS = ("ns_per_tick", "alloc_bytes_per_tick")
+# Allocation changes smaller than this are ignored
+ALLOC_SLACK = 64
+
+
+def connected_protocol(controller_type=ControllerTypes.PRO_CONTROLLER):
+    """Creates a protocol that has been through the pairing handshake,
+    so that it sends standard input reports.
+    """
+
+    protocol = ControllerProtocol(controller_type, "7C:BB:8A:00:00:01")
+    for command in COMMANDS + [INPUT_MODE]:
+        protocol.process_commands(command)
+        protocol.get_report()
+    return protocol
+
+
+def connected_parser():
+
+    protocol = connected_protocol()
+    parser = InputParser(protocol)
+    # Input is only reported once the Switch has asked for device info
+    parser.exited_grip_order_menu = True
+    return protocol, parser
+
+
+def cycle(items):
+    """Returns a function returning the next item of a list on
+    each call, wrapping around at the end.
+    """
+
+    count = len(items)
+    position = [0]
+
+    def next_item():
+        item = items[position[0]]
+        position[0] = (position[0] + 1) % count
+        return item
+
+    return next_item
+
+
+def bench_get_report(_):
+
+    protocol = connected_protocol()
+
+    def tick():
+        protocol.set_full_input_report()
+        protocol.get_report()
+
+    return tick
+
+
+def bench_process_commands(traffic):
+
+    protocol = connected_protocol()
+    next_report = cycle(traffic)
+
+    def tick():
+        protocol.process_commands(next_report())
+        protocol.get_report()
+
+    return tick
+
+
+def bench_macro_input(macro):
+
+    protocol, parser = connected_parser()
+    compiled = parser.compile_macro(macro)
+
+    def tick():
+        if not parser.commands_queued():
+            parser.buffer_compiled_macro(compiled, "benchmark")
+        parser.set_protocol_input()
+
+    return tick
+
+
+def bench_direct_input(packets):
+
+    protocol, parser = connected_parser()
+    next_packet = cycle(packets)
+
+    def tick():
+        parser.set_controller_input(next_packet())
+        parser.set_protocol_input()
+
+    return tick
+
+
+def bench_parse_controller_input(packets):
+
+    protocol, parser = connected_parser()
+    next_packet = cycle(packets)
+
+    def tick():
+        parser.parse_controller_input(next_packet())
+
+    return tick
+
+
+def bench_parse_macro(macro):
+
+    parser = InputParser(None)
+
+    def call():
+        parser.parse_macro(macro)
+
+    return call
+
+
+def bench_compile_macro(macro):
+
+    parser = InputParser(None)
+
+    def call():
+        parser.compile_macro(macro)
+
+    return call
+
+
+def bench_tick(traffic):
+    """A full controller tick (see ControllerServer.step), less the
+    socket calls, playing the mixed macro against Switch traffic.
+    """
+
+    protocol, parser = connected_parser()
+    compiled = parser.compile_macro(MACROS["mixed"])
+    next_report = cycle(traffic)
+
+    def tick():
+        if not parser.commands_queued():
+            parser.buffer_compiled_macro(compiled, "benchmark")
+        protocol.process_commands(next_report())
+        parser.set_protocol_input()
+        protocol.get_report()
+
+    return tick
+
+
+# Benchmark name, setup function, corpus and whether it runs per
+# call (True) rather than per tick. Per call benchmarks are slow
+# and run a hundredth as many times.
+BENCHMARKS = (
+    [("get_report", bench_get_report, None, False)] +
+    [(f"process_commands/{name}", bench_process_commands, traffic, False)
+     for name, traffic in SWITCH_TRAFFIC.items()] +
+    [(f"set_protocol_input/macro/{name}", bench_macro_input, macro, False)
+     for name, macro in MACROS.items()] +
+    [(f"set_protocol_input/direct/{name}", bench_direct_input, packets, False)
+     for name, packets in DIRECT_INPUT.items()] +
+    [(f"parse_controller_input/{name}", bench_parse_controller_input,
+      packets, False)
+     for name, packets in DIRECT_INPUT.items()] +
+    [(f"parse_macro/{name}", bench_parse_macro, macro, True)
+     for name, macro in MACROS.items()] +
+    [(f"compile_macro/{name}", bench_compile_macro, macro, True)
+     for name, macro in MACROS.items()] +
+    [(f"tick/{name}", bench_tick, traffic, False)
+     for name, traffic in SWITCH_TRAFFIC.items()]
+)
+
+
+def measure(tick, ticks):
+    """Times and traces the allocations of a tick function.
+
+    :param tick: The function run on each tick
+    :type tick: function
+    :param ticks: The number of ticks to time
+    :type ticks: int
+    :return: The benchmark's results
+    :rtype: dict
+    """
+
+    # Warm up any caches
+    for _ in range(max(ticks // 10, 1)):
+        tick()
+
+    # Timing. GC pauses are left in, since they land on ticks too.
+    times = [0] * ticks
+    for i in range(ticks):
+        start = perf_counter_ns()
+        tick()
+        times[i] = perf_counter_ns() - start
+    times.sort()
+    median = times[ticks // 2]
+
+    # Allocations are traced separately since tracing slows ticks down
+    traced_ticks = max(ticks // 10, 1)
+    gc.collect()
+    tracemalloc.start()
+    try:
+        start_memory = tracemalloc.get_traced_memory()[0]
+        allocated = 0
+        for _ in range(traced_ticks):
+            before = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            tick()
+            allocated += tracemalloc.get_traced_memory()[1] - before
+        retained = tracemalloc.get_traced_memory()[0] - start_memory
+    finally:
+        tracemalloc.stop()
+
+    return {
+        "ns_per_tick": sum(times) / ticks,
+        "p99_ns": times[int(ticks * 0.99)],
+        "max_jitter_ns": times[-1] - median,
+        "alloc_bytes_per_tick": allocated / traced_ticks,
+        "retained_bytes_per_tick": retained / traced_ticks,
+    }
+
+
+def simulate_switch(duration):
+    """Runs a controller against a simulated Switch, measuring its tick
+    loop end to end (see nxbt.controller.simulator).
+
+    :param duration: The time to run for in seconds
+    :type duration: float
+    :return: The benchmark's results
+    :rtype: dict
+    """
+
+    from nxbt.controller.simulator import simulate
+
+    result = simulate(duration=duration)[0]
+    # CPU time spent per report sent by the controller
+    cpu_seconds = result["cpu_percent"] / 100 * duration
+    return {
+        "ns_per_tick": cpu_seconds / max(result["reports"], 1) * 1e9,
+        "p99_ns": None,
+        "max_jitter_ns": (result["report_interval_max"] -
+                          result["report_interval_mean"]) * 1e9,
+        "alloc_bytes_per_tick": None,
+        "retained_bytes_per_tick": None,
+        "report_rate": result["report_rate"],
+        "subcommand_latency_ns": result["subcommand_latency_mean"] * 1e9,
+    }
+
+
+def compare(name, result, baseline, tolerance):
+    """Compares a result against its baseline.
+
+    :return: A description of each regressed field
+    :rtype: list of str
+    """
+
+    regressions = []
+    for field in COMPARED_FIELDS:
+        old = baseline.get(field)
+        new = result.get(field)
+        if old is None or new is None:
+            continue
+        limit = old * tolerance
+        if field.startswith("alloc"):
+            limit = max(limit, old + ALLOC_SLACK)
+        if new > limit:
+            regressions.append(f"{name}: {field} {old:.0f} -> {new:.0f}")
+    return regressions
+
+
+def format_change(new, old):
+
+    if new is None:
+        return "-"
+    if not old:
+        return f"{new:.0f}"
+    return f"{new:.0f} ({(new - old) / old * 100:+.0f}%)"
+
+
+def main():
+
+    parser = argparse.ArgumentParser(
+        description="Benchmarks the controller hot path")
+    parser.add_argument("--filter", default="",
+                        help="Only run benchmarks containing this text")
+    parser.add_argument("--ticks", type=int, default=20000,
+                        help="The number of ticks to time per benchmark")
+    parser.add_argument("--simulate", action="store_true",
+                        help="Also run a controller against a simulated Switch")
+    parser.add_argument("--duration", type=float, default=5,
+                        help="The simulated Switch run time in seconds")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--tolerance", type=float, default=1.25,
+                        help="The slowdown ratio counted as a regression")
+    parser.add_argument("--save", action="store_true",
+                        help="Save the results as the new baseline")
+    args = parser.parse_args()
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, "r") as f:
+            baseline = json.load(f)["results"]
+
+    results = {}
+    print(f"{'benchmark':44} {'ns/tick':>16} {'p99 ns':>9} "
+          f"{'jitter ns':>10} {'alloc B/tick':>16} {'kept B':>7}")
+    for name, setup, corpus, per_call in BENCHMARKS:
+        if args.filter not in name:
+            continue
+        ticks = max(args.ticks // 100, 1) if per_call else args.ticks
+        results[name] = measure(setup(corpus), ticks)
+
+    if args.simulate and args.filter in "switch/simulated":
+        results["switch/simulated"] = simulate_switch(args.duration)
+
+    regressions = []
+    for name, result in results.items():
+        old = baseline.get(name, {})
+        alloc = format_change(
+            result['alloc_bytes_per_tick'], old.get('alloc_bytes_per_tick'))
+        print(f"{name:44} "
+              f"{format_change(result['ns_per_tick'], old.get('ns_per_tick')):>16} "
+              f"{format_change(result['p99_ns'], None):>9} "
+              f"{format_change(result['max_jitter_ns'], None):>10} "
+              f"{alloc:>16} "
+              f"{format_change(result['retained_bytes_per_tick'], None):>7}")
+        if old:
+            regressions += compare(name, result, old, args.tolerance)
+
+    if args.save:
+        if os.path.exists(args.baseline):
+            # Keep the baselines of benchmarks that weren't run
+            baseline.update(results)
+            results = baseline
+        with open(args.baseline, "w") as f:
+            json.dump({
+                "python": platform.python_version(),
+                "machine": platform.machine(),
+                "results": results,
+            }, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"Saved baseline to {args.baseline}")
+    elif regressions:
+        print("\nRegressions:")
+        for regression in regressions:
+            print(f"  {regression}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -3,8 +3,10 @@ from .controller import ControllerProtocol
 from .controller import SwitchReportParser
 from .controller import SwitchResponses
 from .controller import Controller
+from .controller import TickScheduler
 from .bluez import *
 from .nxbt import Nxbt
+from .aio import AsyncNxbt
 from .nxbt import Buttons
 from .nxbt import Sticks
 from .nxbt import JOYCON_L
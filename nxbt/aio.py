@@ -0,0 +1,246 @@
+import asyncio
+import functools
+
+from .nxbt import Nxbt
+from .nxbt import _button_press_macro, _stick_tilt_macro
+
+
+class AsyncNxbt():
+    """An asyncio front-end for Nxbt.
+
+    Blocking Nxbt calls are replaced with coroutines that await
+    futures resolved by Nxbt's event listener thread, so a single
+    event loop can drive many controllers and macro submissions
+    without dedicating a thread to each caller.
+
+    Calls that only submit work (setting direct input, clearing macros,
+    removing controllers) don't block and are passed straight through.
+    """
+
+    def __init__(self, nxbt=None, **kwargs):
+        """Initializes the asyncio front-end.
+
+        :param nxbt: An existing Nxbt instance to wrap. If not
+        specified, a new instance is created with the given keyword
+        arguments, defaults to None
+        :type nxbt: Nxbt, optional
+        """
+
+        if nxbt is None:
+            nxbt = Nxbt(**kwargs)
+        self.nxbt = nxbt
+
+        # Serializes controller creation within this event loop
+        self._create_lock = None
+
+    async def macro(self, controller_index, macro, block=True):
+        """Inputs a given macro on a specified controller.
+
+        :param controller_index: The index of a given controller
+        :type controller_index: int
+        :param macro: The series of button presses and timings
+        to be passed to the controller
+        :type macro: string
+        :param block: A boolean variable indicating whether or not
+        to wait until the macro completes, defaults to True
+        :type block: bool, optional
+        :raises ValueError: If the controller_index does not exist
+        :return: The generated ID of the passed macro
+        :rtype: str
+        """
+
+        if not block:
+            return self.nxbt._submit_macro(controller_index, macro)
+
+        future = self.nxbt.submit_macro(controller_index, macro)
+        return await asyncio.wrap_future(future)
+
+    async def press_buttons(self, controller_index, buttons,
+                            down=0.1, up=0.1, block=True):
+        """Presses a given set of buttons on the controller for a
+        specified up and down duration.
+
+        :param controller_index: The index of the controller
+        :type controller_index: int
+        :param buttons: A list of nxbt.Buttons
+        :type buttons: list
+        :param down: How long to hold the buttons down for
+        in seconds, defaults to 0.1
+        :type down: float, optional
+        :param up: How long to release the button for
+        in seconds, defaults to 0.1
+        :type up: float, optional
+        :param block: A boolean variable indicating whether or not
+        to wait until the macro completes, defaults to True
+        :type block: bool, optional
+        :return: The generated ID of the passed macro
+        :rtype: str
+        """
+
+        macro = _button_press_macro(buttons, down, up)
+        return await self.macro(controller_index, macro, block=block)
+
+    async def tilt_stick(self, controller_index, stick, x, y,
+                         tilted=0.1, released=0.1, block=True):
+        """Tilts a given stick on the controller for a specified
+        tilted and released duration.
+
+        :param controller_index: The index of the controller
+        :type controller_index: int
+        :param stick: The right or left nxbt.Stick
+        :type stick: nxbt.Stick
+        :param x: The X-Axis of the stick on a -100 to 100 scale
+        :type x: int
+        :param y: The Y-Axis of the stick on a -100 to 100 scale
+        :type y: int
+        :param tilted: The time the stick should remain tilted
+        for, defaults to 0.1
+        :type tilted: float, optional
+        :param released: The time the stick should remain
+        released for, defaults to 0.1
+        :type released: float, optional
+        :param block: A boolean variable indicating whether or not
+        to wait until the macro completes, defaults to True
+        :type block: bool, optional
+        :return: The generated ID of the passed macro
+        :rtype: str
+        """
+
+        macro = _stick_tilt_macro(stick, x, y, tilted, released)
+        return await self.macro(controller_index, macro, block=block)
+
+    async def stop_macro(self, controller_index, macro_id, block=True):
+        """Stops a given macro by its macro ID.
+
+        :param controller_index: The index of a given controller
+        :type controller_index: int
+        :param macro_id: The ID of a given macro (queued or running)
+        :type macro_id: str
+        :param block: A boolean variable indicating whether or not
+        to wait until the macro is stopped, defaults to True
+        :type block: bool, optional
+        :raises ValueError: If the controller_index does not exist
+        """
+
+        future = self.nxbt.submit_stop_macro(controller_index, macro_id)
+        if block:
+            await asyncio.wrap_future(future)
+
+    async def create_controller(self, controller_type, adapter_path=None,
+                                colour_body=None, colour_buttons=None,
+                                reconnect_address=None):
+        """Creates a Nintendo Switch controller of a given type and
+        colour on an (optionally) specified Bluetooth adapter.
+        See Nxbt.create_controller for details.
+
+        :param controller_type: The type of controller to create
+        :type controller_type: ControllerTypes
+        :param adapter_path: The DBus path to a given Bluetooth
+        adapter, defaults to None
+        :type adapter_path: str, optional
+        :param colour_body: The body colour of the controller,
+        defaults to None
+        :type colour_body: list, optional
+        :param colour_buttons: The button colour of the controller,
+        defaults to None
+        :type colour_buttons: list, optional
+        :param reconnect_address: A previously connected to
+        Switch's Bluetooth MAC address, defaults to None
+        :type reconnect_address: str or list, optional
+        :raises ValueError: If specified adapter is unavailable
+        :raises ValueError: If specified adapter is in use
+        :return: The index of the created controller
+        :rtype: int
+        """
+
+        if self._create_lock is None:
+            self._create_lock = asyncio.Lock()
+
+        async with self._create_lock:
+            # get_running_loop needs Python 3.7. Inside a coroutine,
+            # get_event_loop returns the running loop.
+            loop = asyncio.get_event_loop()
+            # Adapter selection makes blocking D-Bus calls and the
+            # controller lock is shared with synchronous callers, so
+            # the whole creation runs off the event loop. The lock is
+            # released on the executor thread, even if this coroutine
+            # is cancelled while waiting.
+            controller_index = await loop.run_in_executor(
+                None, functools.partial(
+                    self.nxbt.create_controller, controller_type,
+                    adapter_path=adapter_path, colour_body=colour_body,
+                    colour_buttons=colour_buttons,
+                    reconnect_address=reconnect_address))
+
+        return controller_index
+
+    async def wait_for_connection(self, controller_index):
+        """Waits until a given controller is connected
+        to a Nintendo Switch.
+
+        :param controller_index: The index of a given controller
+        :type controller_index: int
+        :raises ValueError: If the controller_index does not exist
+        :raises OSError: If the controller crashes
+        """
+
+        future = self.nxbt.submit_wait_for_connection(controller_index)
+        state = await asyncio.wrap_future(future)
+        if state == "crashed":
+            raise OSError("The watched controller has crashed with error",
+                          self.nxbt.state[controller_index]["errors"])
+
+    def set_controller_input(self, controller_index, input_packet):
+        """Sets the direct input of a given controller.
+        See Nxbt.set_controller_input.
+        """
+
+        self.nxbt.set_controller_input(controller_index, input_packet)
+
+    def create_input_packet(self):
+        """Creates an input packet for use with set_controller_input.
+
+        :return: An input packet dictionary
+        :rtype: dict
+        """
+
+        return self.nxbt.create_input_packet()
+
+    def clear_macros(self, controller_index):
+        """Clears all running and queued macros on a given controller.
+
+        :param controller_index: The index of a given controller
+        :type controller_index: int
+        """
+
+        self.nxbt.clear_macros(controller_index)
+
+    def clear_all_macros(self):
+        """Clears all running and queued macros on all controllers.
+        """
+
+        self.nxbt.clear_all_macros()
+
+    def remove_controller(self, controller_index):
+        """Terminates and removes a given controller.
+
+        :param controller_index: The index of a given controller
+        :type controller_index: int
+        """
+
+        self.nxbt.remove_controller(controller_index)
+
+    def macro_finished(self, controller_index, macro_id):
+        """Checks whether a given macro has recently finished.
+        See Nxbt.macro_finished.
+        """
+
+        return self.nxbt.macro_finished(controller_index, macro_id)
+
+    @property
+    def state(self):
+        """The state of all created and running controllers.
+        See Nxbt.state.
+        """
+
+        return self.nxbt.state
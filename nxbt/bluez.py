@@ -6,22 +6,227 @@ import logging
 from shutil import which
 import random
 from pathlib import Path
+from threading import Thread, Lock
 
 import dbus
 
+try:
+    from gi.repository import GLib
+    from dbus.mainloop.glib import DBusGMainLoop
+except ImportError:
+    # Without a GLib main loop, D-Bus signals can't be received
+    # and the object cache is refetched on every lookup.
+    GLib = None
+
 
 SERVICE_NAME = "org.bluez"
 BLUEZ_OBJECT_PATH = "/org/bluez"
 ADAPTER_INTERFACE = SERVICE_NAME + ".Adapter1"
 PROFILEMANAGER_INTERFACE = SERVICE_NAME + ".ProfileManager1"
 DEVICE_INTERFACE = SERVICE_NAME + ".Device1"
+OBJECT_MANAGER_INTERFACE = "org.freedesktop.DBus.ObjectManager"
+PROPERTIES_INTERFACE = "org.freedesktop.DBus.Properties"
+
+
+class BlueZObjectCache():
+    """A cache of BlueZ's D-Bus object tree.
+
+    The tree is fetched with a single GetManagedObjects call and kept
+    current with the InterfacesAdded, InterfacesRemoved and
+    PropertiesChanged signals, so lookups are dictionary reads rather
+    than a scan of every object's properties over the system bus.
+    Signals are received on a GLib main loop run on a daemon thread.
+    If GLib (PyGObject) isn't available, the cache can't be kept
+    current and every lookup refetches the tree instead.
+
+    Use get_object_cache() rather than creating a cache directly,
+    as caches can't be shared across processes.
+    """
+
+    def __init__(self):
+
+        self.logger = logging.getLogger('nxbt')
+        self.pid = os.getpid()
+        self.lock = Lock()
+
+        # Object paths mapped to their interfaces, mapped to the
+        # interface's properties. None until the tree is fetched.
+        self.objects = None
+        # The unique bus name of the running BlueZ service
+        self.owner = None
+
+        # The tree is fetched on its own connection, so fetches never
+        # wait on the main loop that's dispatching signals.
+        self.bus = dbus.SystemBus(private=True)
+        self.manager = dbus.Interface(
+            self.bus.get_object(SERVICE_NAME, "/", introspect=False),
+            OBJECT_MANAGER_INTERFACE)
+
+        self.watching = False
+        self.loop = None
+        self.signal_bus = None
+        if GLib is not None:
+            try:
+                self._watch()
+            except dbus.exceptions.DBusException as e:
+                self.logger.debug(f"Unable to watch BlueZ signals: {e}")
+
+    def _watch(self):
+
+        self.signal_bus = dbus.SystemBus(
+            private=True, mainloop=DBusGMainLoop())
+        self.signal_bus.add_signal_receiver(
+            self._interfaces_added,
+            signal_name="InterfacesAdded",
+            dbus_interface=OBJECT_MANAGER_INTERFACE,
+            bus_name=SERVICE_NAME,
+            path="/")
+        self.signal_bus.add_signal_receiver(
+            self._interfaces_removed,
+            signal_name="InterfacesRemoved",
+            dbus_interface=OBJECT_MANAGER_INTERFACE,
+            bus_name=SERVICE_NAME,
+            path="/")
+        self.signal_bus.add_signal_receiver(
+            self._properties_changed,
+            signal_name="PropertiesChanged",
+            dbus_interface=PROPERTIES_INTERFACE,
+            bus_name=SERVICE_NAME,
+            path_keyword="path")
+        self.signal_bus.watch_name_owner(SERVICE_NAME, self._owner_changed)
+
+        self.loop = GLib.MainLoop()
+        Thread(target=self.loop.run, daemon=True).start()
+        self.watching = True
+
+    def _fetch(self):
+
+        objects = {}
+        for path, interfaces in self.manager.GetManagedObjects().items():
+            objects[str(path)] = {
+                str(name): dict(props) for name, props in interfaces.items()}
+
+        return objects
+
+    def _tree(self):
+
+        # Must be called with the lock held
+        if not self.watching:
+            return self._fetch()
+        if self.objects is None:
+            self.objects = self._fetch()
+        return self.objects
+
+    def _interfaces_added(self, path, interfaces):
+
+        with self.lock:
+            if self.objects is None:
+                return
+            obj = self.objects.setdefault(str(path), {})
+            for name, props in interfaces.items():
+                obj[str(name)] = dict(props)
+
+    def _interfaces_removed(self, path, interfaces):
+
+        with self.lock:
+            if self.objects is None:
+                return
+            obj = self.objects.get(str(path))
+            if obj is None:
+                return
+            for name in interfaces:
+                obj.pop(str(name), None)
+            if not obj:
+                del self.objects[str(path)]
+
+    def _properties_changed(self, interface, changed, invalidated, path=None):
+
+        with self.lock:
+            if self.objects is None:
+                return
+            props = self.objects.get(str(path), {}).get(str(interface))
+            if props is None:
+                return
+            props.update(changed)
+            for name in invalidated:
+                props.pop(name, None)
+
+    def _owner_changed(self, owner):
+
+        # BlueZ was restarted (or stopped), so the tree is refetched
+        # on the next lookup.
+        with self.lock:
+            if self.owner is not None and owner != self.owner:
+                self.objects = None
+            self.owner = owner
+
+    def find(self, interface_name):
+        """Finds all objects that implement an interface.
+
+        :param interface_name: The name of a D-Bus interface
+        :type interface_name: string
+        :return: The object paths mapped to a copy of
+        the interface's properties
+        :rtype: dict
+        """
+
+        with self.lock:
+            return {path: dict(interfaces[interface_name])
+                    for path, interfaces in self._tree().items()
+                    if interface_name in interfaces}
+
+    def close(self):
+        """Stops watching signals and closes the cache's connections.
+        """
+
+        if self.loop:
+            self.loop.quit()
+        for bus in (self.signal_bus, self.bus):
+            if bus is not None:
+                bus.close()
+
+
+_object_cache = None
+_object_cache_lock = Lock()
+
+
+def get_object_cache():
+    """Gets the BlueZ object cache of the current process,
+    creating it on first use.
+
+    :return: The object cache
+    :rtype: BlueZObjectCache
+    """
+
+    global _object_cache
+    with _object_cache_lock:
+        # Forked processes don't inherit the parent's main loop
+        # thread, so each process gets its own cache.
+        if _object_cache is None or _object_cache.pid != os.getpid():
+            _object_cache = BlueZObjectCache()
+        return _object_cache
+
+
+def _find_managed_objects(bus, service_name, interface_name):
+
+    if service_name == SERVICE_NAME:
+        return get_object_cache().find(interface_name)
+
+    manager = dbus.Interface(
+        bus.get_object(service_name, "/"),
+        OBJECT_MANAGER_INTERFACE)
+
+    return {str(path): ifaces[interface_name]
+            for path, ifaces in manager.GetManagedObjects().items()
+            if interface_name in ifaces}
 
 
 def find_object_path(bus, service_name, interface_name, object_name=None):
     """Searches for a D-Bus object path that contains a specified interface
     under a specified service.
 
-    :param bus: A DBus object used to access the DBus.
+    :param bus: A DBus object used to access the DBus. BlueZ objects
+    are found through the object cache (see get_object_cache) instead.
     :type bus: DBus
     :param service_name: The name of a D-Bus service to search for the
     object path under.
@@ -37,23 +242,16 @@ def find_object_path(bus, service_name, interface_name, object_name=None):
     :rtype: string
     """
 
-    manager = dbus.Interface(
-        bus.get_object(service_name, "/"),
-        "org.freedesktop.DBus.ObjectManager")
-
     # Iterating over objects under the specified service
-    # and searching for the specified interface
-    for path, ifaces in manager.GetManagedObjects().items():
-        managed_interface = ifaces.get(interface_name)
-        if managed_interface is None:
-            continue
+    # that implement the specified interface
+    objects = _find_managed_objects(bus, service_name, interface_name)
+    for path, managed_interface in objects.items():
         # If the object name wasn't specified or it matches
         # the interface address or the path ending
-        elif (not object_name or
-                object_name == managed_interface["Address"] or
+        if (not object_name or
+                object_name == managed_interface.get("Address") or
                 path.endswith(object_name)):
-            obj = bus.get_object(service_name, path)
-            return dbus.Interface(obj, interface_name).object_path
+            return path
 
     return None
 
@@ -62,7 +260,8 @@ def find_objects(bus, service_name, interface_name):
     """Searches for D-Bus objects that contain a specified interface
     under a specified service.
 
-    :param bus: A DBus object used to access the DBus.
+    :param bus: A DBus object used to access the DBus. BlueZ objects
+    are found through the object cache (see get_object_cache) instead.
     :type bus: DBus
     :param service_name: The name of a D-Bus service to search for the
     object path under.
@@ -74,23 +273,7 @@ def find_objects(bus, service_name, interface_name):
     :rtype: array
     """
 
-    manager = dbus.Interface(
-        bus.get_object(service_name, "/"),
-        "org.freedesktop.DBus.ObjectManager")
-    paths = []
-
-    # Iterating over objects under the specified service
-    # and searching for the specified interface within them
-    for path, ifaces in manager.GetManagedObjects().items():
-        managed_interface = ifaces.get(interface_name)
-        if managed_interface is None:
-            continue
-        else:
-            obj = bus.get_object(service_name, path)
-            path = str(dbus.Interface(obj, interface_name).object_path)
-            paths.append(path)
-
-    return paths
+    return list(_find_managed_objects(bus, service_name, interface_name))
 
 
 def toggle_clean_bluez(toggle):
@@ -277,39 +460,16 @@ def find_devices_by_alias(alias, return_path=False, created_bus=None):
     :rtype: string or None
     """
 
-    if created_bus is not None:
-        bus = created_bus
-    else:
-        bus = dbus.SystemBus()
-    # Find all connected/paired/discovered devices
-    devices = find_objects(
-        bus,
-        SERVICE_NAME,
-        DEVICE_INTERFACE)
-
     addresses = []
     matching_paths = []
-    for path in devices:
-        # Get the device's address and paired status
-        device_props = dbus.Interface(
-            bus.get_object(SERVICE_NAME, path),
-            "org.freedesktop.DBus.Properties")
-        device_alias = device_props.Get(
-            DEVICE_INTERFACE,
-            "Alias").upper()
-        device_addr = device_props.Get(
-            DEVICE_INTERFACE,
-            "Address").upper()
-
-        # Check for an address match
-        if device_alias.upper() == alias.upper():
-            addresses.append(device_addr)
+    # Find all connected/paired/discovered devices
+    devices = get_object_cache().find(DEVICE_INTERFACE)
+    for path, device in devices.items():
+        # Check for an alias match
+        if device.get("Alias", "").upper() == alias.upper():
+            addresses.append(device["Address"].upper())
             matching_paths.append(path)
 
-    # Close the dbus connection if we created one
-    if created_bus is None:
-        bus.close()
-
     if return_path:
         return addresses, matching_paths
     else:
@@ -323,36 +483,27 @@ def disconnect_devices_by_alias(alias, created_bus=None):
     :type alias: string
     """
 
+    # Find all connected/paired/discovered devices
+    devices = get_object_cache().find(DEVICE_INTERFACE)
+    matching_paths = [
+        path for path, device in devices.items()
+        if device.get("Alias", "").upper() == alias.upper()]
+    if not matching_paths:
+        return
+
     if created_bus is not None:
         bus = created_bus
     else:
         bus = dbus.SystemBus()
-    # Find all connected/paired/discovered devices
-    devices = find_objects(
-        bus,
-        SERVICE_NAME,
-        DEVICE_INTERFACE)
 
-    addresses = []
-    matching_paths = []
-    for path in devices:
-        # Get the device's address and paired status
-        device_props = dbus.Interface(
+    for path in matching_paths:
+        device = dbus.Interface(
             bus.get_object(SERVICE_NAME, path),
-            "org.freedesktop.DBus.Properties")
-        device_alias = device_props.Get(
-            DEVICE_INTERFACE,
-            "Alias").upper()
-
-        # Check for an alias match
-        if device_alias.upper() == alias.upper():
-            device = dbus.Interface(
-                bus.get_object(SERVICE_NAME, path),
-                DEVICE_INTERFACE)
-            try:
-                device.Disconnect()
-            except Exception as e:
-                print(e)
+            DEVICE_INTERFACE)
+        try:
+            device.Disconnect()
+        except Exception as e:
+            print(e)
 
     # Close the dbus connection if we created one
     if created_bus is None:
@@ -728,15 +879,7 @@ class BlueZ():
         :rtype: dictionary
         """
 
-        bluez_objects = dbus.Interface(
-            self.bus.get_object(SERVICE_NAME, "/"),
-            "org.freedesktop.DBus.ObjectManager")
-
-        devices = {}
-        objects = bluez_objects.GetManagedObjects()
-        for path, interfaces in list(objects.items()):
-            if DEVICE_INTERFACE in interfaces:
-                devices[str(path)] = interfaces[DEVICE_INTERFACE]
+        devices = get_object_cache().find(DEVICE_INTERFACE)
 
         return devices
 
@@ -863,23 +1006,11 @@ class BlueZ():
         """
 
         # Find all connected/paired/discovered devices
-        devices = find_objects(
-            self.bus,
-            SERVICE_NAME,
-            DEVICE_INTERFACE)
-        for path in devices:
-            # Get the device's address and paired status
-            device_props = dbus.Interface(
-                self.bus.get_object(SERVICE_NAME, path),
-                "org.freedesktop.DBus.Properties")
-            device_addr = device_props.Get(
-                DEVICE_INTERFACE,
-                "Address").upper()
-
+        devices = get_object_cache().find(DEVICE_INTERFACE)
+        for path, device in devices.items():
             # Check for an address match
-            if device_addr != address.upper():
-                continue
-            return path
+            if device["Address"].upper() == address.upper():
+                return path
 
         return None
     
@@ -893,24 +1024,12 @@ class BlueZ():
         :rtype: string or None
         """
 
-        devices = find_objects(
-            self.bus,
-            SERVICE_NAME,
-            DEVICE_INTERFACE)
+        devices = get_object_cache().find(DEVICE_INTERFACE)
         conn_devices = []
-        for path in devices:
-            # Get the device's connection status
-            device_props = dbus.Interface(
-                self.bus.get_object(SERVICE_NAME, path),
-                "org.freedesktop.DBus.Properties")
-            device_conn_status = device_props.Get(
-                DEVICE_INTERFACE,
-                "Connected")
-            device_alias = device_props.Get(
-                DEVICE_INTERFACE,
-                "Alias").upper()
-
-            if device_conn_status:
+        for path, device in devices.items():
+            device_alias = device.get("Alias", "").upper()
+
+            if device.get("Connected"):
                 if alias_filter and device_alias == alias_filter.upper():
                     conn_devices.append(path)
                 else:
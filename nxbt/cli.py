@@ -52,6 +52,9 @@ parser.add_argument('--certpath', required=False, default=None, type=str,
                     help="""Specifies the folder location for SSL certificates used
                     in the webapp. Certificates in this folder should be in the form of
                     a 'cert.pem' and 'key.pem' pair.""")                
+parser.add_argument('--tracelatency', required=False, default=False, action='store_true',
+                    help="""Traces the latency of webapp input and macros through to
+                    the Switch. Latencies are exported from the webapp's /metrics page.""")
 args = parser.parse_args()
 
 
@@ -165,7 +168,7 @@ def demo():
     # Run a macro on the last controller
     print("Running Demo...")
     macro_id = nx.macro(controller_idxs[-1], MACRO, block=False)
-    while macro_id not in nx.state[controller_idxs[-1]]["finished_macros"]:
+    while not nx.macro_finished(controller_idxs[-1], macro_id):
         state = nx.state[controller_idxs[-1]]
         if state['state'] == 'crashed':
             print("An error occurred while running the demo:")
@@ -292,7 +295,7 @@ def macro():
             print("Controller crashed while running macro")
             print(nx.state[index]["errors"])
             break
-        if macro_id in nx.state[index]["finished_macros"]:
+        if nx.macro_finished(index, macro_id):
             print("Finished running macro. Exiting...")
             break
         sleep(1/30)
@@ -320,7 +323,8 @@ def main():
     if args.command == 'webapp':
         from .web import start_web_app
         start_web_app(ip=args.ip, port=args.port,
-            usessl=args.usessl, cert_path=args.certpath)
+            usessl=args.usessl, cert_path=args.certpath,
+            trace_latency=args.tracelatency)
     elif args.command == 'demo':
         demo()
     elif args.command == 'macro':
@@ -1,5 +1,7 @@
 from .server import ControllerServer
 from .controller import ControllerTypes
+from .scheduler import TickScheduler
+from .metrics import ControllerMetrics
 from .controller import Controller
 from .protocol import ControllerProtocol
 from .protocol import SwitchReportParser
@@ -0,0 +1,199 @@
+import os
+import struct
+from threading import Lock
+
+try:
+    from multiprocessing import shared_memory, resource_tracker
+except ImportError:
+    # Shared memory is only available on Python 3.8+
+    shared_memory = None
+
+from .input import DirectInput, DIRECT_INPUT_IDLE
+
+
+def shared_memory_available():
+    """Checks if shared memory channels can be used on this platform.
+
+    :return: True if multiprocessing.shared_memory is available
+    :rtype: bool
+    """
+
+    return shared_memory is not None
+
+
+class DirectInputChannel():
+    """A single-writer shared memory slot holding the latest direct
+    input of a controller.
+
+    The slot is guarded with a sequence lock. The writer makes the
+    sequence number odd before writing the payload and even again
+    afterwards. Readers retry if the sequence is odd or changed while
+    they were reading. Neither side needs to take a lock or talk to
+    another process, so the controller can read the slot every tick.
+
+    Writes can optionally carry a latency trace (see LatencyTracer).
+    Untraced writes have a trace ID of 0.
+
+    Layout (little endian):
+        uint32  sequence number
+        uint32  button mask (see DirectInput)
+        double  left stick X
+        double  left stick Y
+        double  right stick X
+        double  right stick Y
+        uint32  trace ID
+        double  trace origin time
+        double  trace write time
+    """
+
+    SEQUENCE = struct.Struct("<I")
+    PAYLOAD = struct.Struct("<I4dIdd")
+    PAYLOAD_OFFSET = SEQUENCE.size
+    SIZE = SEQUENCE.size + PAYLOAD.size
+
+    _NO_TRACE = (0, 0.0, 0.0)
+
+    # How many times a reader retries on a torn read before
+    # falling back to the last good value.
+    MAX_READ_RETRIES = 100
+
+    def __init__(self, shm, owner=False):
+        """Wraps a shared memory block as a direct input channel.
+        Use DirectInputChannel.create or DirectInputChannel.attach
+        rather than calling this directly.
+
+        :param shm: The shared memory block
+        :type shm: multiprocessing.shared_memory.SharedMemory
+        :param owner: Whether this channel created the block and is
+        responsible for unlinking it, defaults to False
+        :type owner: bool, optional
+        """
+
+        self.shm = shm
+        self.buf = shm.buf
+        self.owner = owner
+        self.name = shm.name
+
+        # Writer state
+        self.write_lock = Lock()
+        self.sequence = self.SEQUENCE.unpack_from(self.buf, 0)[0]
+
+        # Reader state
+        self.last_sequence = None
+        self.last_input = DIRECT_INPUT_IDLE
+        # The trace of the last input read, or None if untraced
+        self.last_trace = None
+
+    @classmethod
+    def create(cls):
+        """Creates a new, idle direct input channel.
+
+        :raises OSError: If shared memory is unavailable
+        :return: The created channel
+        :rtype: DirectInputChannel
+        """
+
+        if shared_memory is None:
+            raise OSError("Shared memory is unavailable on this platform")
+
+        name = "nxbt_" + os.urandom(8).hex()
+        shm = shared_memory.SharedMemory(name=name, create=True, size=cls.SIZE)
+        shm.buf[:cls.SIZE] = bytes(cls.SIZE)
+
+        return cls(shm, owner=True)
+
+    @classmethod
+    def attach(cls, name):
+        """Attaches to an existing direct input channel.
+
+        :param name: The name of the channel
+        :type name: str
+        :raises OSError: If shared memory is unavailable
+        :return: The attached channel
+        :rtype: DirectInputChannel
+        """
+
+        if shared_memory is None:
+            raise OSError("Shared memory is unavailable on this platform")
+
+        try:
+            shm = shared_memory.SharedMemory(name=name, track=False)
+        except TypeError:
+            # Python < 3.13 always registers attached blocks with the
+            # resource tracker, which would unlink the block when this
+            # process exits. Only the creator should unlink it, so
+            # registration is skipped while attaching.
+            register = resource_tracker.register
+            resource_tracker.register = lambda name, rtype: None
+            try:
+                shm = shared_memory.SharedMemory(name=name)
+            finally:
+                resource_tracker.register = register
+
+        return cls(shm)
+
+    def write(self, direct_input, trace=None):
+        """Publishes a new direct input to the channel.
+
+        :param direct_input: The encoded direct input
+        :type direct_input: DirectInput
+        :param trace: A latency trace of the trace ID, origin time
+        and write time, defaults to None
+        :type trace: tuple, optional
+        """
+
+        if trace is None:
+            trace = self._NO_TRACE
+
+        buf = self.buf
+        with self.write_lock:
+            sequence = (self.sequence + 1) & 0xFFFFFFFF
+            # Odd sequence numbers mark a write in progress
+            if not sequence & 1:
+                sequence = (sequence + 1) & 0xFFFFFFFF
+            self.SEQUENCE.pack_into(buf, 0, sequence)
+            self.PAYLOAD.pack_into(
+                buf, self.PAYLOAD_OFFSET, *direct_input, *trace)
+            sequence = (sequence + 1) & 0xFFFFFFFF
+            self.SEQUENCE.pack_into(buf, 0, sequence)
+            self.sequence = sequence
+
+    def read(self):
+        """Reads the latest direct input from the channel.
+
+        :return: The latest direct input
+        :rtype: DirectInput
+        """
+
+        buf = self.buf
+        unpack_sequence = self.SEQUENCE.unpack_from
+        for _ in range(self.MAX_READ_RETRIES):
+            sequence = unpack_sequence(buf, 0)[0]
+            # Nothing new has been written
+            if sequence == self.last_sequence:
+                return self.last_input
+            # A write is in progress
+            if sequence & 1:
+                continue
+
+            payload = self.PAYLOAD.unpack_from(buf, self.PAYLOAD_OFFSET)
+            if unpack_sequence(buf, 0)[0] == sequence:
+                self.last_sequence = sequence
+                self.last_input = DirectInput(*payload[:5])
+                self.last_trace = payload[5:] if payload[5] else None
+                break
+
+        return self.last_input
+
+    def close(self):
+        """Closes the channel, unlinking the shared memory block
+        if this channel created it.
+        """
+
+        self.buf = None
+        self.shm.close()
+        if self.owner:
+            try:
+                self.shm.unlink()
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,274 @@
+import socket
+import selectors
+import logging
+import traceback
+from collections import deque
+from threading import Thread, Lock
+
+from .scheduler import TickScheduler
+
+
+class ControllerEngine():
+    """Runs many controller servers on a single thread.
+
+    Rather than each controller running its own process and tick loop,
+    the engine ticks every connected controller from one loop paced by
+    a shared TickScheduler. While waiting for the next tick, the engine
+    blocks in a selector over the controllers' non-blocking interrupt
+    sockets, answering subcommands from the Switch as soon as they arrive.
+
+    Connecting, pairing and reconnecting are blocking and slow, so
+    they're run on short-lived threads. Controllers join the tick loop
+    once connected.
+    """
+
+    def __init__(self, scheduler=None):
+        """Initializes the engine.
+
+        :param scheduler: The scheduler that paces the tick loop,
+        defaults to a 132Hz TickScheduler
+        :type scheduler: TickScheduler, optional
+        """
+
+        self.logger = logging.getLogger('nxbt')
+
+        if scheduler:
+            self.scheduler = scheduler
+        else:
+            self.scheduler = TickScheduler(rate=132)
+
+        self.selector = selectors.DefaultSelector()
+
+        # Controllers that finished connecting on another thread
+        # and are waiting to join the tick loop.
+        self.connected = deque()
+        self.connected_lock = Lock()
+        # Wakes the selector when a controller connects
+        self.wakeup_receiver, self.wakeup_sender = socket.socketpair()
+        self.wakeup_receiver.setblocking(False)
+        self.wakeup_sender.setblocking(False)
+        self.selector.register(self.wakeup_receiver, selectors.EVENT_READ)
+
+        # Connected controllers, mapped to their interrupt
+        # and control sockets.
+        self.sessions = {}
+        self.removed = set()
+
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        """Starts the tick loop on a daemon thread.
+        """
+
+        self.running = True
+        self.thread = Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """Stops the tick loop and closes all connections.
+        """
+
+        self.running = False
+        self._wake()
+        if self.thread:
+            self.thread.join()
+
+        for server in list(self.sessions.keys()):
+            self._close_session(server)
+
+        self.selector.close()
+        self.wakeup_receiver.close()
+        self.wakeup_sender.close()
+
+    def add(self, server, reconnect_address=None):
+        """Adds a controller server to the engine. The server connects
+        to a Switch on a separate thread and joins the tick loop
+        once connected.
+
+        :param server: The controller server
+        :type server: ControllerServer
+        :param reconnect_address: The Bluetooth MAC address of a
+        previously connected to Nintendo Switch, defaults to None
+        :type reconnect_address: string or list, optional
+        """
+
+        self._connect(server, server.establish_connection, reconnect_address)
+
+    def remove(self, server):
+        """Removes a controller server from the engine,
+        closing its connection and command socket.
+
+        :param server: The controller server
+        :type server: ControllerServer
+        """
+
+        with self.connected_lock:
+            self.removed.add(server)
+        self._wake()
+
+    def run(self):
+        """Runs the tick loop until the engine is stopped.
+        """
+
+        scheduler = self.scheduler
+        scheduler.start()
+        while self.running:
+            self._wait_for_tick()
+
+            sessions = list(self.sessions.items())
+            for server, session in sessions:
+                self._step(server, session)
+
+            scheduler.wait()
+
+            for server, _ in sessions:
+                if server not in self.sessions:
+                    # The controller disconnected or crashed this tick
+                    continue
+                server.metrics.record_tick(scheduler.last_interval)
+                # The server's own scheduler is idle in the engine
+                server.publish_metrics(scheduler)
+
+    def _wait_for_tick(self):
+
+        # Block in the selector until the tick is due (or
+        # until it's time to spin it out, if spinning is enabled)
+        scheduler = self.scheduler
+        while self.running:
+            timeout = scheduler.time_until_deadline() - scheduler.spin_threshold
+            if timeout <= 0:
+                break
+
+            for key, _ in self.selector.select(timeout):
+                if key.data is None:
+                    self._drain_wakeups()
+                else:
+                    self._receive(key.data)
+
+    def _receive(self, server):
+
+        session = self.sessions.get(server)
+        if session is None:
+            return
+
+        try:
+            reply = server.receive(session[0])
+            # An empty read on a readable socket means the Switch
+            # closed the connection.
+            if reply == b"":
+                raise ConnectionResetError("The Switch closed the connection")
+        except OSError as e:
+            self._disconnected(server, e)
+            return
+        except Exception:
+            self._crashed(server)
+            return
+
+        if server.protocol.is_subcommand(reply):
+            # Answer subcommands right away rather than on the next tick
+            self._step(server, session, reply)
+
+    def _step(self, server, session, reply=None):
+
+        try:
+            # Reports that can't be sent without blocking are
+            # retried on the next tick.
+            if server.step(session[0], reply) and reply is None:
+                server.tick += 1
+        except OSError as e:
+            self._disconnected(server, e)
+        except Exception:
+            self._crashed(server)
+
+    def _crashed(self, server):
+
+        # As with a controller process, an error only crashes the
+        # controller that raised it. Must be called from an
+        # exception handler.
+        server.report_crash()
+        self._close_session(server)
+        self._close_commands(server)
+
+    def _disconnected(self, server, error):
+
+        server.metrics.os_errors += 1
+        self._close_session(server)
+        # Attempt to reconnect to the Switch
+        self._connect(server, server.save_connection, error)
+
+    def _connect(self, server, connect, *args):
+
+        def connect_server():
+            try:
+                itr, ctrl = connect(*args)
+            except Exception:
+                server.report_crash()
+                return
+
+            with self.connected_lock:
+                self.connected.append((server, itr, ctrl))
+            self._wake()
+
+        Thread(target=connect_server, daemon=True).start()
+
+    def _drain_wakeups(self):
+
+        try:
+            while self.wakeup_receiver.recv(4096):
+                pass
+        except BlockingIOError:
+            pass
+
+        with self.connected_lock:
+            connected = list(self.connected)
+            self.connected.clear()
+
+            for server, itr, ctrl in connected:
+                # Drop controllers removed while they were connecting
+                if server in self.removed:
+                    self.removed.discard(server)
+                    itr.close()
+                    ctrl.close()
+                    self._close_commands(server)
+                    continue
+                self.sessions[server] = (itr, ctrl)
+                self.selector.register(itr, selectors.EVENT_READ, server)
+
+            for server in list(self.removed):
+                if server in self.sessions:
+                    self.removed.discard(server)
+                    self._close_session(server)
+                    self._close_commands(server)
+
+    def _close_session(self, server):
+
+        session = self.sessions.pop(server, None)
+        if session is None:
+            return
+
+        try:
+            self.selector.unregister(session[0])
+        except (KeyError, ValueError):
+            pass
+
+        for sock in session:
+            try:
+                sock.close()
+            except OSError:
+                self.logger.debug(traceback.format_exc())
+
+    def _close_commands(self, server):
+
+        # Removed controllers no longer accept direct commands
+        if server.command_socket:
+            server.command_socket.close()
+            server.command_socket = None
+
+    def _wake(self):
+
+        try:
+            self.wakeup_sender.send(b"\0")
+        except BlockingIOError:
+            # The selector already has a pending wakeup
+            pass
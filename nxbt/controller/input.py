@@ -1,5 +1,11 @@
 from time import perf_counter
-from json import dumps
+from collections import namedtuple, deque
+
+try:
+    import numpy
+except ImportError:
+    # NumPy is only needed for batch stick conversion
+    numpy = None
 
 
 DIRECT_INPUT_IDLE_PACKET = {
@@ -52,6 +58,309 @@ DIRECT_INPUT_IDLE_PACKET = {
 }
 
 
+# Button bitmasks for macro input. The 24 bits are laid out as the
+# upper, shared and lower button bytes of the standard input report.
+MACRO_BUTTONS = {
+    # Upper byte
+    "Y": 0x010000,
+    "X": 0x020000,
+    "B": 0x040000,
+    "A": 0x080000,
+    "JCL_SR": 0x100000,
+    "JCL_SL": 0x200000,
+    "R": 0x400000,
+    "ZR": 0x800000,
+    # Shared byte
+    "MINUS": 0x000100,
+    "PLUS": 0x000200,
+    "R_STICK_PRESS": 0x000400,
+    "L_STICK_PRESS": 0x000800,
+    "HOME": 0x001000,
+    "CAPTURE": 0x002000,
+    # Lower byte
+    "DPAD_DOWN": 0x000001,
+    "DPAD_UP": 0x000002,
+    "DPAD_RIGHT": 0x000004,
+    "DPAD_LEFT": 0x000008,
+    "JCR_SR": 0x000010,
+    "JCR_SL": 0x000020,
+    "L": 0x000040,
+    "ZL": 0x000080,
+}
+
+# Button bitmasks for direct input packets, using the same layout as
+# MACRO_BUTTONS. Direct input has always reported MINUS and PLUS on the
+# opposite bits to macros, which is kept here for compatibility.
+DIRECT_INPUT_BUTTONS = (
+    ("Y", 0x010000),
+    ("X", 0x020000),
+    ("B", 0x040000),
+    ("A", 0x080000),
+    ("JCL_SR", 0x100000),
+    ("JCL_SL", 0x200000),
+    ("R", 0x400000),
+    ("ZR", 0x800000),
+    ("PLUS", 0x000100),
+    ("MINUS", 0x000200),
+    ("HOME", 0x001000),
+    ("CAPTURE", 0x002000),
+    ("DPAD_DOWN", 0x000001),
+    ("DPAD_UP", 0x000002),
+    ("DPAD_RIGHT", 0x000004),
+    ("DPAD_LEFT", 0x000008),
+    ("JCR_SR", 0x000010),
+    ("JCR_SL", 0x000020),
+    ("L", 0x000040),
+    ("ZL", 0x000080),
+)
+DIRECT_INPUT_R_STICK_PRESS = 0x000400
+DIRECT_INPUT_L_STICK_PRESS = 0x000800
+
+# Buttons that close the "Change Grip/Order" menu
+GRIP_ORDER_EXIT_BUTTONS = (
+    MACRO_BUTTONS["A"] | MACRO_BUTTONS["B"] | MACRO_BUTTONS["HOME"])
+
+
+# A single precompiled macro line.
+# buttons: A bitmask of MACRO_BUTTONS
+# left_stick/right_stick: Calibrated 3-byte stick positions or None
+# duration: How long the frame is held for in seconds
+# wait: Whether the frame is a wait (no input) line
+MacroFrame = namedtuple(
+    "MacroFrame",
+    ["buttons", "left_stick", "right_stick", "duration", "wait"])
+
+# A LOOP block within a compiled macro.
+# count: The number of times the body is repeated
+# body: A list of MacroFrame and MacroLoop items
+MacroLoop = namedtuple("MacroLoop", ["count", "body"])
+
+
+# A compact direct input packet.
+# buttons: A 24-bit mask laid out as the report's three button bytes
+# left_x/left_y/right_x/right_y: Stick positions on a -100 to 100 scale
+DirectInput = namedtuple(
+    "DirectInput",
+    ["buttons", "left_x", "left_y", "right_x", "right_y"])
+
+DIRECT_INPUT_IDLE = DirectInput(0, 0, 0, 0, 0)
+
+
+def encode_direct_input(packet):
+    """Encodes a direct input packet dict (see DIRECT_INPUT_IDLE_PACKET)
+    into its compact DirectInput form.
+
+    :param packet: The direct input packet
+    :type packet: dict
+    :return: The encoded direct input
+    :rtype: DirectInput
+    """
+
+    buttons = 0
+    for button, mask in DIRECT_INPUT_BUTTONS:
+        if packet[button]:
+            buttons |= mask
+
+    left = packet["L_STICK"]
+    right = packet["R_STICK"]
+    if left["PRESSED"]:
+        buttons |= DIRECT_INPUT_L_STICK_PRESS
+    if right["PRESSED"]:
+        buttons |= DIRECT_INPUT_R_STICK_PRESS
+
+    return DirectInput(
+        buttons,
+        left["X_VALUE"], left["Y_VALUE"],
+        right["X_VALUE"], right["Y_VALUE"])
+
+
+# Stick lookup tables cover integer positions on a -100 to 100 scale
+STICK_TABLE_RANGE = 100
+
+# Stick lookup tables, keyed by stick calibration
+_stick_tables = {}
+
+
+def calibrate_stick_axis(ratio, minimum, maximum, centre):
+    """Converts a stick axis ratio to a calibrated 12-bit value.
+
+    :param ratio: The axis ratio on a -1 to 1 scale
+    :type ratio: float
+    :param minimum: The zeroed minimum of the axis
+    :type minimum: int
+    :param maximum: The zeroed maximum of the axis
+    :type maximum: int
+    :param centre: The centre of the axis
+    :type centre: int
+    :return: The calibrated value
+    :rtype: int
+    """
+
+    if ratio < 0:
+        converted = abs(ratio) * minimum + centre
+    else:
+        converted = abs(ratio) * maximum + centre
+    return int(round(converted))
+
+
+def get_stick_tables(calibration):
+    """Gets lookup tables mapping integer stick positions to their
+    share of the packed 3-byte stick payload. Tables are built
+    once per calibration.
+
+    The X table holds (byte 0, byte 1) and the Y table holds
+    (byte 1, byte 2) contributions, indexed by position + 100.
+    The payload is (x0, x1 + y1, y2).
+
+    :param calibration: The stick's calibration values
+    :type calibration: dict
+    :return: The X and Y tables
+    :rtype: tuple
+    """
+
+    key = tuple(sorted(calibration.items()))
+    tables = _stick_tables.get(key)
+    if tables is None:
+        x_table = []
+        y_table = []
+        for position in range(-STICK_TABLE_RANGE, STICK_TABLE_RANGE + 1):
+            ratio = position / 100
+            x = calibrate_stick_axis(
+                ratio, calibration["min_x"], calibration["max_x"],
+                calibration["center_x"])
+            y = calibrate_stick_axis(
+                ratio, calibration["min_y"], calibration["max_y"],
+                calibration["center_y"])
+            x_table.append((x & 0xFF, x >> 8))
+            y_table.append(((y & 0xF) << 4, y >> 4))
+        tables = (tuple(x_table), tuple(y_table))
+        _stick_tables[key] = tables
+
+    return tables
+
+
+class MacroPlayer():
+    """Plays back a compiled macro one frame at a time.
+
+    Loops are expanded lazily with a stack of
+    [block, next index, remaining repetitions] entries, so memory
+    use stays constant regardless of loop counts.
+    """
+
+    def __init__(self, frames):
+
+        self.stack = [[frames, 0, 1]]
+        # The frame after the current one, looked up in advance
+        # so that the end of the macro is known on its last frame.
+        self.upcoming = self.advance()
+
+    def advance(self):
+
+        stack = self.stack
+        while stack:
+            top = stack[-1]
+            block = top[0]
+            index = top[1]
+
+            # End of the current block
+            if index >= len(block):
+                top[2] -= 1
+                if top[2] > 0:
+                    top[1] = 0
+                else:
+                    stack.pop()
+                continue
+
+            item = block[index]
+            top[1] = index + 1
+            if type(item) is MacroLoop:
+                stack.append([item.body, 0, item.count])
+                continue
+
+            return item
+
+        return None
+
+    def next_frame(self):
+        """Gets the next frame of the macro.
+
+        :return: The next frame or None if the macro is finished
+        :rtype: MacroFrame or None
+        """
+
+        frame = self.upcoming
+        if frame is not None:
+            self.upcoming = self.advance()
+        return frame
+
+    @property
+    def finished(self):
+
+        return self.upcoming is None
+
+
+# The default number of finished macro IDs kept per controller
+FINISHED_MACRO_RETENTION = 256
+
+
+class FinishedMacros():
+    """A bounded record of finished macro IDs.
+
+    The most recent IDs are kept in a ring buffer with a set index,
+    so adding an ID and checking membership are both O(1). Once the
+    retention is reached, the oldest IDs are forgotten.
+    """
+
+    def __init__(self, retention=FINISHED_MACRO_RETENTION):
+        """Initializes the finished macro record.
+
+        :param retention: The number of IDs to keep, or None to keep
+        every ID, defaults to FINISHED_MACRO_RETENTION
+        :type retention: int, optional
+        :raises ValueError: If the retention is less than 1
+        """
+
+        if retention is not None and retention < 1:
+            raise ValueError("Finished macro retention must be at least 1")
+
+        self.ring = deque(maxlen=retention)
+        self.index = set()
+
+    def add(self, macro_id):
+        """Records a macro ID as finished.
+
+        :param macro_id: The ID of the finished macro
+        :type macro_id: str
+        """
+
+        if macro_id in self.index:
+            return
+
+        # Forget the oldest ID before the ring drops it
+        if len(self.ring) == self.ring.maxlen:
+            self.index.discard(self.ring[0])
+
+        self.ring.append(macro_id)
+        self.index.add(macro_id)
+
+    def __contains__(self, macro_id):
+
+        return macro_id in self.index
+
+    def __len__(self):
+
+        return len(self.ring)
+
+    def to_list(self):
+        """Gets the retained IDs, oldest first.
+
+        :return: The finished macro IDs
+        :rtype: list
+        """
+
+        return list(self.ring)
+
+
 class InputParser():
 
     # Left Stick calibration values
@@ -75,20 +384,39 @@ class InputParser():
         "max_y": 1510,
     }
 
-    def __init__(self, protocol):
+    def __init__(self, protocol, finished_callback=None,
+                 finished_retention=FINISHED_MACRO_RETENTION):
+        """Initializes the input parser.
+
+        :param protocol: The protocol to set input on
+        :type protocol: ControllerProtocol
+        :param finished_callback: A function called with the ID of each
+        macro that finishes or is stopped, defaults to None
+        :type finished_callback: function, optional
+        :param finished_retention: The number of finished macro IDs to
+        keep, defaults to FINISHED_MACRO_RETENTION
+        :type finished_retention: int, optional
+        """
 
         self.protocol = protocol
+        self.finished_callback = finished_callback
+
+        # Stick position lookup tables
+        self.left_stick_tables = get_stick_tables(self.LEFT_STICK_CALIBRATION)
+        self.right_stick_tables = get_stick_tables(self.RIGHT_STICK_CALIBRATION)
 
-        # Buffers a list of unparsed macros
+        # The most recently finished macros
+        self.finished_macros = FinishedMacros(finished_retention)
+
+        # Buffers a list of compiled macros
         self.macro_buffer = []
 
-        # Keeps track of the entire current
-        # list of macro commands.
+        # Plays back the frames of the current macro
         self.current_macro = None
         self.current_macro_id = None
-        # Keeps track of the macro commands being
+        # Keeps track of the macro frame being
         # input over a period of time.
-        self.current_macro_commands = None
+        self.current_frame = None
 
         # The time length of the current macro
         self.macro_timer_length = 0
@@ -96,7 +424,11 @@ class InputParser():
         # The start time for the current macro commands
         self.macro_timer_start = 0
 
-        self.controller_input = None
+        self.controller_input = DIRECT_INPUT_IDLE
+        # The last encoded direct input. Clients resend the same packet
+        # every tick while input is held, so unchanged input keeps
+        # this object instead of holding a new one each tick.
+        self.last_input_encoded = DIRECT_INPUT_IDLE
 
         # Whether or not input has been entered
         # that would close the "Change Grip/Order" menu
@@ -108,7 +440,21 @@ class InputParser():
         if len(macro) < 4:
             return
 
-        self.macro_buffer.append([macro, macro_id])
+        # Compile the macro once on submission so that
+        # playback only needs to step through frames.
+        self.macro_buffer.append([self.compile_macro(macro), macro_id])
+
+    def buffer_compiled_macro(self, compiled, macro_id):
+        """Buffers a macro that has already been compiled,
+        for example by a client (see compile_macro).
+
+        :param compiled: The compiled macro
+        :type compiled: list of MacroFrame and MacroLoop
+        :param macro_id: The ID of the macro
+        :type macro_id: str
+        """
+
+        self.macro_buffer.append([compiled, macro_id])
 
     def stop_macro(self, macro_id, state=None):
 
@@ -117,22 +463,18 @@ class InputParser():
             # If so, reset the current macro
             self.current_macro = None
             self.current_macro_id = None
-            self.current_macro_commands = None
+            self.current_frame = None
             self.macro_timer_length = 0
             self.macro_timer_start = 0
         else:
-            # Check if the macro is still in the buffer
-            for i in range(0, len(self.macro_buffer)):
-                if macro_id == self.macro_buffer[i][1]:
-                    del self.macro_buffer[i]
+            # Remove the macro if it's still in the buffer
+            self.macro_buffer = [
+                m for m in self.macro_buffer if m[1] != macro_id]
 
         # Ensure the stopped macro is added to the finished
         # macros so that any blocking parties listening can
         # continue.
-        if state:
-            finished = state["finished_macros"]
-            finished.append(macro_id)
-            state["finished_macros"] = finished
+        self.report_finished(macro_id, state)
 
         return
 
@@ -140,7 +482,7 @@ class InputParser():
 
         self.current_macro = None
         self.current_macro_id = None
-        self.current_macro_commands = None
+        self.current_frame = None
         self.macro_timer_length = 0
         self.macro_timer_start = 0
         self.macro_buffer = []
@@ -148,14 +490,30 @@ class InputParser():
         return
 
     def set_controller_input(self, controller_input):
+        """Sets the direct input for the next tick.
+
+        :param controller_input: A direct input packet dict or
+        an encoded DirectInput. None is treated as idle input.
+        :type controller_input: dict or DirectInput
+        """
+
+        if type(controller_input) == dict:
+            # The packet itself isn't cached, since callers may change
+            # and resend the same dict. Its encoding is cheap to compare.
+            encoded = encode_direct_input(controller_input)
+            if encoded != self.last_input_encoded:
+                self.last_input_encoded = encoded
+            controller_input = self.last_input_encoded
+        elif type(controller_input) != DirectInput:
+            controller_input = DIRECT_INPUT_IDLE
 
         self.controller_input = controller_input
-    
+
     def commands_queued(self):
-        check = dumps(self.controller_input) != dumps(DIRECT_INPUT_IDLE_PACKET)
+        check = self.controller_input != DIRECT_INPUT_IDLE
         check = check or self.macro_buffer
         check = check or self.current_macro
-        check = check or self.current_macro_commands
+        check = check or self.current_frame
         return check
 
     def active_input_queued(self):
@@ -165,12 +523,9 @@ class InputParser():
         :return: True (on an active button) or False (no active buttons)
         :rtype: bool
         """
-        if (self.current_macro_commands is not None):
-            if len(self.current_macro_commands) < 2:
-                return False
-            else:
-                return True
-        elif dumps(self.controller_input) != dumps(DIRECT_INPUT_IDLE_PACKET):
+        if (self.current_frame is not None):
+            return not self.current_frame.wait
+        elif self.controller_input != DIRECT_INPUT_IDLE:
             return True
         else:
             return False
@@ -178,126 +533,94 @@ class InputParser():
     def set_protocol_input(self, state=None):
 
         # Act on direct input if we're not getting idle packets
-        if dumps(self.controller_input) != dumps(DIRECT_INPUT_IDLE_PACKET):
+        if self.controller_input != DIRECT_INPUT_IDLE:
             self.parse_controller_input(self.controller_input)
-            self.controller_input = None
+            self.controller_input = DIRECT_INPUT_IDLE
 
         elif (self.macro_buffer or self.current_macro or
-              self.current_macro_commands):
+              self.current_frame):
             # Check if we can start on a new macro.
-            if not self.current_macro and self.macro_buffer:
-                # Preprocess command lines of current macro
-                macro = self.macro_buffer.pop(0)
-                self.current_macro = self.parse_macro(macro[0])
-                self.current_macro_id = macro[1]
-
-            # Check if we can load the next set of commands
-            if not self.current_macro_commands and self.current_macro:
-                self.current_macro_commands = (
-                    self.current_macro.pop(0).strip(" ").split(" "))
-
-                # Timing metadata extraction
-                timer_length = self.current_macro_commands[-1]
-                timer_length = timer_length[0:len(timer_length)-1]
-                self.macro_timer_length = float(timer_length)
+            if (not self.current_macro and not self.current_frame and
+                    self.macro_buffer):
+                compiled, macro_id = self.macro_buffer.pop(0)
+                self.current_macro = MacroPlayer(compiled)
+                self.current_macro_id = macro_id
+
+            # Check if we can load the next frame
+            if not self.current_frame and self.current_macro:
+                self.current_frame = self.current_macro.next_frame()
+                # Nothing to input for empty macros
+                if self.current_frame is None:
+                    self.finish_macro(state)
+                    return
+
+                self.macro_timer_length = self.current_frame.duration
                 self.macro_timer_start = perf_counter()
 
-            self.set_macro_input(self.current_macro_commands)
+            self.set_macro_input(self.current_frame)
 
-            # Check if we're done inputting the current command
+            # Check if we're done inputting the current frame
             time_delta = perf_counter() - self.macro_timer_start
             if time_delta > self.macro_timer_length:
-                self.current_macro_commands = None
+                self.current_frame = None
                 # Check if we're done the current macro
-                if not self.current_macro and state:
-                    finished = state["finished_macros"]
-                    finished.append(self.current_macro_id)
-                    state["finished_macros"] = finished
+                if self.current_macro and self.current_macro.finished:
+                    self.finish_macro(state)
+
+    def finish_macro(self, state=None):
+        """Ends the current macro and adds it to the finished macros.
+
+        :param state: The controller's shared state, defaults to None
+        :type state: dict, optional
+        """
+
+        self.report_finished(self.current_macro_id, state)
+
+        self.current_macro = None
+        self.current_macro_id = None
+
+    def report_finished(self, macro_id, state=None):
+        """Reports a macro as finished through the shared state
+        and the finished callback.
+
+        :param macro_id: The ID of the finished macro
+        :type macro_id: str
+        :param state: The controller's shared state, defaults to None
+        :type state: dict, optional
+        """
+
+        self.finished_macros.add(macro_id)
+
+        # Publish the bounded list without reading it back
+        if state:
+            state["finished_macros"] = self.finished_macros.to_list()
+
+        if self.finished_callback:
+            self.finished_callback(macro_id)
 
     def parse_controller_input(self, controller_input):
 
         # Check for input validity
-        if type(controller_input) != dict:
+        if type(controller_input) == dict:
+            controller_input = encode_direct_input(controller_input)
+        elif type(controller_input) != DirectInput:
             return
 
+        buttons = controller_input.buttons
+
         # Check if the Grip/Order menu would be closed
-        if not self.exited_grip_order_menu and (
-                controller_input["A"] or controller_input["B"] or controller_input["HOME"]):
+        if (not self.exited_grip_order_menu and
+                buttons & GRIP_ORDER_EXIT_BUTTONS):
             self.exited_grip_order_menu = True
 
-        # Arrays representing the 3 button bytes in the
-        # standard input report as binary.
-        upper = ['0'] * 8
-        shared = ['0'] * 8
-        lower = ['0'] * 8
-        # Upper Byte
-        if controller_input["Y"]:
-            upper[7] = '1'
-        if controller_input["X"]:
-            upper[6] = '1'
-        if controller_input["B"]:
-            upper[5] = '1'
-        if controller_input["A"]:
-            upper[4] = '1'
-        if controller_input["JCL_SR"]:
-            upper[3] = '1'
-        if controller_input["JCL_SL"]:
-            upper[2] = '1'
-        if controller_input["R"]:
-            upper[1] = '1'
-        if controller_input["ZR"]:
-            upper[0] = '1'
-
-        # Shared byte
-        if controller_input["MINUS"]:
-            shared[6] = '1'
-        if controller_input["PLUS"]:
-            shared[7] = '1'
-        if controller_input["R_STICK"]["PRESSED"]:
-            shared[5] = '1'
-        if controller_input["L_STICK"]["PRESSED"]:
-            shared[4] = '1'
-        if controller_input["HOME"]:
-            shared[3] = '1'
-        if controller_input["CAPTURE"]:
-            shared[2] = '1'
-
-        # Lower byte
-        if controller_input["DPAD_DOWN"]:
-            lower[7] = '1'
-        if controller_input["DPAD_UP"]:
-            lower[6] = '1'
-        if controller_input["DPAD_RIGHT"]:
-            lower[5] = '1'
-        if controller_input["DPAD_LEFT"]:
-            lower[4] = '1'
-        if controller_input["JCR_SR"]:
-            lower[3] = '1'
-        if controller_input["JCR_SL"]:
-            lower[2] = '1'
-        if controller_input["L"]:
-            lower[1] = '1'
-        if controller_input["ZL"]:
-            lower[0] = '1'
-
         # Analog Stick Positions
-        stick_left = self.stick_ratio_to_calibrated_position(
-            controller_input["L_STICK"]["X_VALUE"] / 100,
-            controller_input["L_STICK"]["Y_VALUE"] / 100,
-            "L_STICK"
-        )
-        stick_right = self.stick_ratio_to_calibrated_position(
-            controller_input["R_STICK"]["X_VALUE"] / 100,
-            controller_input["R_STICK"]["Y_VALUE"] / 100,
-            "R_STICK"
-        )
-
-        # Converting binary strings to ints
-        upper_byte = int("".join(upper), 2)
-        shared_byte = int("".join(shared), 2)
-        lower_byte = int("".join(lower), 2)
-
-        self.protocol.set_button_inputs(upper_byte, shared_byte, lower_byte)
+        stick_left = self.stick_position_to_calibrated_position(
+            controller_input.left_x, controller_input.left_y, "L_STICK")
+        stick_right = self.stick_position_to_calibrated_position(
+            controller_input.right_x, controller_input.right_y, "R_STICK")
+
+        self.protocol.set_button_inputs(
+            buttons >> 16, (buttons >> 8) & 0xFF, buttons & 0xFF)
         self.protocol.set_left_stick_inputs(stick_left)
         self.protocol.set_right_stick_inputs(stick_right)
 
@@ -305,10 +628,23 @@ class InputParser():
 
     def parse_macro(self, macro):
 
+        parsed = self.parse_macro_lines(macro)
+        parsed = self.parse_loops(parsed)
+
+        return parsed
+
+    def parse_macro_lines(self, macro):
+        """Splits a macro into lines, dropping empty lines and comments.
+
+        :param macro: The macro to split
+        :type macro: str
+        :return: The macro lines
+        :rtype: list of str
+        """
+
         parsed = macro.split("\n")
         parsed = list(filter(lambda s: not s.strip() == "", parsed))
         parsed = list(filter(lambda s: not s.strip().startswith("#"), parsed))
-        parsed = self.parse_loops(parsed)
 
         return parsed
 
@@ -318,31 +654,7 @@ class InputParser():
         while i < len(macro):
             line = macro[i]
             if line.startswith("LOOP"):
-                loop_count = int(line.split(" ")[1])
-                loop_buffer = []
-
-                # Detect delimiter and record
-                if macro[i+1].startswith("\t"):
-                    loop_delimiter = "\t"
-                elif macro[i+1].startswith("    "):
-                    loop_delimiter = "    "
-                else:
-                    loop_delimiter = "  "
-
-                # Gather looping commands
-                for j in range(i+1, len(macro)):
-                    loop_line = macro[j]
-                    if loop_line.startswith(loop_delimiter):
-                        # Replace the first instance of the delimiter
-                        loop_line = loop_line.replace(loop_delimiter, "", 1)
-                        loop_buffer.append(loop_line)
-                    # Set the new position if we either encounter the end
-                    # of the loop or we reach the end of the macro
-                    else:
-                        i = j - 1
-                        break
-                    if j+1 >= len(macro):
-                        i = j
+                loop_count, loop_buffer, i = self.gather_loop(macro, i)
 
                 # Recursively gather other loops if present
                 if any(s.startswith("LOOP") for s in loop_buffer):
@@ -355,93 +667,148 @@ class InputParser():
 
         return parsed
 
-    def set_macro_input(self, macro_input):
+    def gather_loop(self, macro, i):
+        """Gathers the body of the LOOP statement at a given line.
 
-        # Checking if this is a wait macro command
-        if len(macro_input) < 2:
-            return
+        :param macro: The macro lines
+        :type macro: list of str
+        :param i: The index of the LOOP line
+        :type i: int
+        :return: The loop count, the loop body lines (with one level of
+        indentation removed) and the index of the last line of the loop
+        :rtype: tuple
+        """
 
-        # Check if the Grip/Order menu would be closed
-        if not self.exited_grip_order_menu and (
-                'A' in macro_input or 'B' in macro_input or 'HOME' in macro_input):
-            self.exited_grip_order_menu = True
+        loop_count = int(macro[i].split(" ")[1])
+        loop_buffer = []
+
+        # A loop at the end of the macro has no body
+        if i+1 >= len(macro):
+            return loop_count, loop_buffer, i
+
+        # Detect delimiter and record
+        if macro[i+1].startswith("\t"):
+            loop_delimiter = "\t"
+        elif macro[i+1].startswith("    "):
+            loop_delimiter = "    "
+        else:
+            loop_delimiter = "  "
+
+        # Gather looping commands
+        for j in range(i+1, len(macro)):
+            loop_line = macro[j]
+            if loop_line.startswith(loop_delimiter):
+                # Replace the first instance of the delimiter
+                loop_line = loop_line.replace(loop_delimiter, "", 1)
+                loop_buffer.append(loop_line)
+            # Set the new position if we either encounter the end
+            # of the loop or we reach the end of the macro
+            else:
+                i = j - 1
+                break
+            if j+1 >= len(macro):
+                i = j
+
+        return loop_count, loop_buffer, i
+
+    def compile_macro(self, macro):
+        """Compiles a macro into frames that can be played back
+        without any further parsing. Loops are kept as MacroLoop
+        blocks rather than being multiplied out, so the size of a
+        compiled macro doesn't depend on its loop counts.
+
+        :param macro: The macro to compile
+        :type macro: str
+        :return: The compiled macro
+        :rtype: list of MacroFrame and MacroLoop
+        """
+
+        return self.compile_macro_block(self.parse_macro_lines(macro))
+
+    def compile_macro_block(self, macro):
+        """Compiles a list of macro lines into frames and loop blocks.
+
+        :param macro: The macro lines
+        :type macro: list of str
+        :return: The compiled block
+        :rtype: list of MacroFrame and MacroLoop
+        """
+
+        compiled = []
+        i = 0
+        while i < len(macro):
+            line = macro[i]
+            if line.startswith("LOOP"):
+                loop_count, loop_buffer, i = self.gather_loop(macro, i)
+                body = self.compile_macro_block(loop_buffer)
+                # Loops that input nothing can be dropped
+                if loop_count > 0 and body:
+                    compiled.append(MacroLoop(loop_count, body))
+            else:
+                compiled.append(self.compile_macro_line(line))
+            i += 1
+
+        return compiled
+
+    def compile_macro_line(self, line):
+        """Compiles a single macro line (a list of buttons/stick
+        positions followed by a duration) into a frame.
+
+        :param line: The macro line, eg: "A B L_STICK@+100+000 0.5s"
+        :type line: str
+        :raises ValueError: On a malformed duration
+        :return: The compiled frame
+        :rtype: MacroFrame
+        """
+
+        commands = line.strip(" ").split(" ")
+
+        # Timing metadata extraction
+        duration = float(commands[-1][0:len(commands[-1])-1])
+
+        # Checking if this is a wait macro command
+        if len(commands) < 2:
+            return MacroFrame(0, None, None, duration, True)
 
-        # Arrays representing the 3 button bytes in the
-        # standard input report as binary.
-        upper = ['0'] * 8
-        shared = ['0'] * 8
-        lower = ['0'] * 8
-        # Analog stick byte placeholders
+        buttons = 0
         stick_left = None
         stick_right = None
-        for i in range(0, len(macro_input)-1):
-            button = macro_input[i]
-            # Upper Byte
-            if button == "Y":
-                upper[7] = '1'
-            elif button == "X":
-                upper[6] = '1'
-            elif button == "B":
-                upper[5] = '1'
-            elif button == "A":
-                upper[4] = '1'
-            elif button == "JCL_SR":
-                upper[3] = '1'
-            elif button == "JCL_SL":
-                upper[2] = '1'
-            elif button == "R":
-                upper[1] = '1'
-            elif button == "ZR":
-                upper[0] = '1'
-
-            # Shared byte
-            elif button == "MINUS":
-                shared[7] = '1'
-            elif button == "PLUS":
-                shared[6] = '1'
-            elif button == "R_STICK_PRESS":
-                shared[5] = '1'
-            elif button == "L_STICK_PRESS":
-                shared[4] = '1'
-            elif button == "HOME":
-                shared[3] = '1'
-            elif button == "CAPTURE":
-                shared[2] = '1'
-
-            # Lower byte
-            elif button == "DPAD_DOWN":
-                lower[7] = '1'
-            elif button == "DPAD_UP":
-                lower[6] = '1'
-            elif button == "DPAD_RIGHT":
-                lower[5] = '1'
-            elif button == "DPAD_LEFT":
-                lower[4] = '1'
-            elif button == "JCR_SR":
-                lower[3] = '1'
-            elif button == "JCR_SL":
-                lower[2] = '1'
-            elif button == "L":
-                lower[1] = '1'
-            elif button == "ZL":
-                lower[0] = '1'
+        for command in commands[:-1]:
+            if command in MACRO_BUTTONS:
+                buttons |= MACRO_BUTTONS[command]
 
             # Analog Stick Positions
-            elif button.startswith("L_STICK@"):
-                stick_left = self.parse_macro_stick_position(button)
-            elif button.startswith("R_STICK@"):
-                stick_right = self.parse_macro_stick_position(button)
+            elif command.startswith("L_STICK@"):
+                stick_left = self.parse_macro_stick_position(command)
+            elif command.startswith("R_STICK@"):
+                stick_right = self.parse_macro_stick_position(command)
 
-        # Converting binary strings to ints
-        upper_byte = int("".join(upper), 2)
-        shared_byte = int("".join(shared), 2)
-        lower_byte = int("".join(lower), 2)
-
-        self.protocol.set_button_inputs(upper_byte, shared_byte, lower_byte)
         if stick_left:
-            self.protocol.set_left_stick_inputs(stick_left)
+            stick_left = tuple(stick_left)
         if stick_right:
-            self.protocol.set_right_stick_inputs(stick_right)
+            stick_right = tuple(stick_right)
+
+        return MacroFrame(buttons, stick_left, stick_right, duration, False)
+
+    def set_macro_input(self, frame):
+
+        # Checking if this is a wait macro command
+        if frame.wait:
+            return
+
+        buttons = frame.buttons
+
+        # Check if the Grip/Order menu would be closed
+        if (not self.exited_grip_order_menu and
+                buttons & GRIP_ORDER_EXIT_BUTTONS):
+            self.exited_grip_order_menu = True
+
+        self.protocol.set_button_inputs(
+            buttons >> 16, (buttons >> 8) & 0xFF, buttons & 0xFF)
+        if frame.left_stick:
+            self.protocol.set_left_stick_inputs(frame.left_stick)
+        if frame.right_stick:
+            self.protocol.set_right_stick_inputs(frame.right_stick)
 
     def parse_macro_stick_position(self, stick_pos):
 
@@ -450,22 +817,97 @@ class InputParser():
         if len(positions) < 8:
             return None
 
-        # Converting macro to proper ratios
+        # Converting macro to stick positions
         sign_x = positions[0]
-        ratio_x = int(positions[1:4]) / 100
+        position_x = int(positions[1:4])
         if sign_x == "-":
-            ratio_x = ratio_x * -1
+            position_x = -position_x
 
         sign_y = positions[4]
-        ratio_y = int(positions[5:8]) / 100
+        position_y = int(positions[5:8])
         if sign_y == "-":
-            ratio_y = ratio_y * -1
+            position_y = -position_y
 
-        calibrated_position = self.stick_ratio_to_calibrated_position(
-            ratio_x, ratio_y, stick_type)
+        calibrated_position = self.stick_position_to_calibrated_position(
+            position_x, position_y, stick_type)
 
         return calibrated_position
 
+    def stick_position_to_calibrated_position(self, x, y, stick_type):
+        """Converts a stick position to a packed 3-byte stick payload.
+        Integer positions are looked up in precomputed tables, anything
+        else is calculated.
+
+        :param x: The X-Axis of the stick on a -100 to 100 scale
+        :type x: int or float
+        :param y: The Y-Axis of the stick on a -100 to 100 scale
+        :type y: int or float
+        :param stick_type: "L_STICK" or "R_STICK"
+        :type stick_type: str
+        :return: The stick payload
+        :rtype: tuple or list
+        """
+
+        index_x = int(x) + STICK_TABLE_RANGE
+        index_y = int(y) + STICK_TABLE_RANGE
+        if (index_x - STICK_TABLE_RANGE == x and
+                index_y - STICK_TABLE_RANGE == y and
+                0 <= index_x <= 2 * STICK_TABLE_RANGE and
+                0 <= index_y <= 2 * STICK_TABLE_RANGE):
+            if stick_type == "L_STICK":
+                x_table, y_table = self.left_stick_tables
+            else:
+                x_table, y_table = self.right_stick_tables
+            x_low, x_high = x_table[index_x]
+            y_low, y_high = y_table[index_y]
+            return (x_low, x_high + y_low, y_high)
+
+        return self.stick_ratio_to_calibrated_position(
+            x / 100, y / 100, stick_type)
+
+    def stick_positions_to_calibrated_positions(self, x, y, stick_type):
+        """Converts a whole series of stick positions (eg: a recorded
+        stick trajectory) to packed 3-byte stick payloads in one call.
+        Requires NumPy.
+
+        :param x: The X-Axis positions on a -100 to 100 scale
+        :type x: list or numpy.ndarray
+        :param y: The Y-Axis positions on a -100 to 100 scale
+        :type y: list or numpy.ndarray
+        :param stick_type: "L_STICK" or "R_STICK"
+        :type stick_type: str
+        :raises ImportError: If NumPy isn't installed
+        :return: An (N, 3) array of stick payloads
+        :rtype: numpy.ndarray
+        """
+
+        if numpy is None:
+            raise ImportError(
+                "NumPy is required for batch stick conversion")
+
+        if stick_type == "L_STICK":
+            cal = self.LEFT_STICK_CALIBRATION
+        else:
+            cal = self.RIGHT_STICK_CALIBRATION
+
+        def calibrate_axis(positions, minimum, maximum, centre):
+            ratios = numpy.asarray(positions, dtype=numpy.float64) / 100
+            magnitudes = numpy.abs(ratios)
+            converted = numpy.where(
+                ratios < 0, magnitudes * minimum, magnitudes * maximum)
+            # rint rounds half to even, the same as round()
+            return numpy.rint(converted + centre).astype(numpy.int64)
+
+        data_x = calibrate_axis(x, cal["min_x"], cal["max_x"], cal["center_x"])
+        data_y = calibrate_axis(y, cal["min_y"], cal["max_y"], cal["center_y"])
+
+        payloads = numpy.empty((len(data_x), 3), dtype=numpy.uint8)
+        payloads[:, 0] = data_x & 0xFF
+        payloads[:, 1] = ((data_y & 0xF) << 4) + (data_x >> 8)
+        payloads[:, 2] = data_y >> 4
+
+        return payloads
+
     def stick_ratio_to_calibrated_position(self, ratio_x, ratio_y, stick_type):
 
         # Using the appropriate calibration values for the stick type
@@ -475,21 +917,10 @@ class InputParser():
             cal = self.RIGHT_STICK_CALIBRATION
 
         # Converting ratios to uint16 values
-        if ratio_x < 0:
-            data_x_converted = (
-                abs(ratio_x) * cal["min_x"] + cal["center_x"])
-        else:
-            data_x_converted = (
-                abs(ratio_x) * cal["max_x"] + cal["center_x"])
-        data_x_converted = int(round(data_x_converted))
-
-        if ratio_y < 0:
-            data_y_converted = (
-                abs(ratio_y) * cal["min_y"] + cal["center_y"])
-        else:
-            data_y_converted = (
-                abs(ratio_y) * cal["max_y"] + cal["center_y"])
-        data_y_converted = int(round(data_y_converted))
+        data_x_converted = calibrate_stick_axis(
+            ratio_x, cal["min_x"], cal["max_x"], cal["center_x"])
+        data_y_converted = calibrate_stick_axis(
+            ratio_y, cal["min_y"], cal["max_y"], cal["center_y"])
 
         # Converting the two X/Y uint16 values to 3 uint8 Little Endian values
         # using bitshifting techniques
@@ -0,0 +1,298 @@
+import struct
+
+from .input import MacroFrame, MacroLoop, DirectInput, STICK_TABLE_RANGE
+
+
+# Message types
+INPUT_MACRO = 1
+STOP_MACRO = 2
+CLEAR_MACROS = 3
+# Set on the message type when a latency trace follows the macro ID
+TRACED = 0x80
+
+# The largest message that's sent directly to a controller. Larger
+# messages are relayed through the task queues instead.
+MAX_DIRECT_MESSAGE_SIZE = 65536
+
+# Message type, controller index, sequence number and macro ID length
+HEADER = struct.Struct("<BHIH")
+# The longest macro ID that can be encoded, in UTF-8 bytes
+MAX_MACRO_ID_LENGTH = 0xFFFF
+# Latency trace ID and submission time (see LatencyTracer)
+TRACE = struct.Struct("<Id")
+
+# Compiled macro records. Each record starts with a tag byte.
+TAG = struct.Struct("<B")
+# Frame flags, stored in the tag byte
+FRAME_WAIT = 0x01
+FRAME_LEFT_STICK = 0x02
+FRAME_RIGHT_STICK = 0x04
+# A loop block follows, terminated by a LOOP_END tag
+LOOP_START = 0x40
+LOOP_END = 0x80
+# Button mask, left stick bytes, right stick bytes and duration
+FRAME = struct.Struct("<I3B3Bd")
+# Loop repetition count
+LOOP = struct.Struct("<I")
+
+# A binary direct input frame, as sent by the webapp. Controller index,
+# button mask (see DirectInput) and the left X/Y and right X/Y stick
+# positions on a -100 to 100 scale.
+INPUT_FRAME = struct.Struct("<HI4b")
+# The 24 button bits defined by DirectInput
+INPUT_FRAME_BUTTON_MASK = 0xFFFFFF
+
+_NO_STICK = (0, 0, 0)
+
+
+def encode_message(message_type, controller_index, macro_id=None,
+                   compiled_macro=None, trace=None, sequence=0):
+    """Encodes a controller command as a binary message.
+
+    Messages can reach a controller over its command socket or
+    relayed through the task queues, so the two paths can reorder
+    them. Controllers apply messages with a non-zero sequence number
+    in sequence order. Unsequenced messages are applied on arrival.
+
+    Layout (little endian):
+        uint8   message type (TRACED is set if traced)
+        uint16  controller index
+        uint32  sequence number (0 if unsequenced)
+        uint16  macro ID length
+        bytes   macro ID (UTF-8)
+        uint32  trace ID (traced messages only)
+        double  trace submission time (traced messages only)
+        bytes   compiled macro records (INPUT_MACRO only)
+
+    :param message_type: INPUT_MACRO, STOP_MACRO or CLEAR_MACROS
+    :type message_type: int
+    :param controller_index: The index of the target controller
+    :type controller_index: int
+    :param macro_id: The ID of a macro, defaults to None
+    :type macro_id: str, optional
+    :param compiled_macro: A compiled macro, defaults to None
+    :type compiled_macro: list of MacroFrame and MacroLoop, optional
+    :param trace: A latency trace of the trace ID and submission
+    time, defaults to None
+    :type trace: tuple, optional
+    :param sequence: The message's sequence number on its controller,
+    defaults to 0 (unsequenced)
+    :type sequence: int, optional
+    :raises ValueError: If the macro ID is longer than
+    MAX_MACRO_ID_LENGTH bytes
+    :return: The encoded message
+    :rtype: bytes
+    """
+
+    macro_id = macro_id.encode("utf-8") if macro_id else b""
+    if len(macro_id) > MAX_MACRO_ID_LENGTH:
+        raise ValueError(
+            f"Macro IDs can't be longer than {MAX_MACRO_ID_LENGTH} bytes")
+    if trace:
+        message_type |= TRACED
+    parts = [HEADER.pack(
+        message_type, controller_index, sequence, len(macro_id)), macro_id]
+    if trace:
+        parts.append(TRACE.pack(*trace))
+    if compiled_macro:
+        _encode_block(compiled_macro, parts)
+
+    return b"".join(parts)
+
+
+def _encode_block(block, parts):
+
+    for item in block:
+        if type(item) is MacroLoop:
+            parts.append(TAG.pack(LOOP_START))
+            parts.append(LOOP.pack(item.count))
+            _encode_block(item.body, parts)
+            parts.append(TAG.pack(LOOP_END))
+            continue
+
+        flags = 0
+        if item.wait:
+            flags |= FRAME_WAIT
+        left_stick = item.left_stick
+        if left_stick:
+            flags |= FRAME_LEFT_STICK
+        else:
+            left_stick = _NO_STICK
+        right_stick = item.right_stick
+        if right_stick:
+            flags |= FRAME_RIGHT_STICK
+        else:
+            right_stick = _NO_STICK
+
+        parts.append(TAG.pack(flags))
+        parts.append(FRAME.pack(
+            item.buttons, *left_stick, *right_stick, item.duration))
+
+
+def decode_header(message):
+    """Decodes the header of a binary message.
+
+    :param message: The encoded message
+    :type message: bytes
+    :return: The message type, controller index, macro ID (or None)
+    and the offset of the payload
+    :rtype: tuple
+    """
+
+    message_type, controller_index, _, id_length = HEADER.unpack_from(
+        message, 0)
+    offset = HEADER.size + id_length
+    macro_id = None
+    if id_length:
+        macro_id = bytes(message[HEADER.size:offset]).decode("utf-8")
+    if message_type & TRACED:
+        message_type &= ~TRACED
+        offset += TRACE.size
+
+    return message_type, controller_index, macro_id, offset
+
+
+def decode_trace(message):
+    """Decodes the latency trace of a binary message.
+
+    :param message: The encoded message
+    :type message: bytes
+    :return: The trace ID and submission time, or None if untraced
+    :rtype: tuple or None
+    """
+
+    message_type, _, _, id_length = HEADER.unpack_from(message, 0)
+    if not message_type & TRACED:
+        return None
+
+    return TRACE.unpack_from(message, HEADER.size + id_length)
+
+
+def decode_sequence(message):
+    """Decodes the sequence number of a binary message.
+
+    :param message: The encoded message
+    :type message: bytes
+    :return: The sequence number, or 0 if unsequenced
+    :rtype: int
+    """
+
+    return HEADER.unpack_from(message, 0)[2]
+
+
+def next_sequence(sequence):
+    """Gets the sequence number that follows a given one.
+    Sequence numbers wrap within 32 bits, skipping zero.
+
+    :param sequence: The sequence number
+    :type sequence: int
+    :return: The next sequence number
+    :rtype: int
+    """
+
+    return sequence % 0xFFFFFFFF + 1
+
+
+def decode_macro(message, offset):
+    """Decodes the compiled macro payload of an INPUT_MACRO message.
+
+    :param message: The encoded message
+    :type message: bytes
+    :param offset: The offset of the payload
+    :type offset: int
+    :raises ValueError: On a malformed payload
+    :return: The compiled macro
+    :rtype: list of MacroFrame and MacroLoop
+    """
+
+    # Each entry is the block being filled and its loop count
+    stack = [([], None)]
+    end = len(message)
+    while offset < end:
+        tag = message[offset]
+        offset += 1
+
+        if tag == LOOP_START:
+            count = LOOP.unpack_from(message, offset)[0]
+            offset += LOOP.size
+            stack.append(([], count))
+        elif tag == LOOP_END:
+            if len(stack) < 2:
+                raise ValueError("Unmatched loop end in macro message")
+            body, count = stack.pop()
+            stack[-1][0].append(MacroLoop(count, body))
+        else:
+            values = FRAME.unpack_from(message, offset)
+            offset += FRAME.size
+            left_stick = None
+            if tag & FRAME_LEFT_STICK:
+                left_stick = values[1:4]
+            right_stick = None
+            if tag & FRAME_RIGHT_STICK:
+                right_stick = values[4:7]
+            stack[-1][0].append(MacroFrame(
+                values[0], left_stick, right_stick, values[7],
+                bool(tag & FRAME_WAIT)))
+
+    if len(stack) != 1:
+        raise ValueError("Unterminated loop in macro message")
+
+    return stack[0][0]
+
+
+def encode_input_frame(controller_index, direct_input):
+    """Encodes direct input as a binary input frame.
+
+    Layout (little endian):
+        uint16  controller index
+        uint32  button mask (see DirectInput)
+        int8    left stick X
+        int8    left stick Y
+        int8    right stick X
+        int8    right stick Y
+
+    :param controller_index: The index of the target controller
+    :type controller_index: int
+    :param direct_input: The direct input
+    :type direct_input: DirectInput
+    :return: The encoded frame
+    :rtype: bytes
+    """
+
+    return INPUT_FRAME.pack(
+        controller_index, direct_input.buttons,
+        *(max(-100, min(100, round(axis))) for axis in direct_input[1:]))
+
+
+def decode_input_frame(frame):
+    """Decodes a binary input frame.
+
+    Frames come from untrusted clients, so undefined button bits are
+    dropped and stick positions are clamped to the -100 to 100 scale.
+
+    :param frame: The encoded frame
+    :type frame: bytes
+    :raises struct.error: On a frame of the wrong size
+    :return: The controller index and its direct input
+    :rtype: tuple
+    """
+
+    values = INPUT_FRAME.unpack(frame)
+    return values[0], sanitize_direct_input(DirectInput(*values[1:]))
+
+
+def sanitize_direct_input(direct_input):
+    """Drops undefined button bits from direct input and clamps its
+    stick positions to the -100 to 100 scale.
+
+    :param direct_input: The direct input
+    :type direct_input: DirectInput
+    :raises TypeError: If a field isn't a number
+    :return: The sanitized direct input
+    :rtype: DirectInput
+    """
+
+    return DirectInput(
+        direct_input.buttons & INPUT_FRAME_BUTTON_MASK,
+        *(max(-STICK_TABLE_RANGE, min(STICK_TABLE_RANGE, axis))
+          for axis in direct_input[1:]))
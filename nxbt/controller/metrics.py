@@ -0,0 +1,358 @@
+import time
+from bisect import bisect_left
+
+
+# Upper bounds (in seconds) of the tick interval histogram buckets.
+# Ticks are due every ~7.58ms at 132Hz. An extra, final bucket
+# counts everything slower than the last bound.
+TICK_INTERVAL_BUCKETS = (
+    0.005, 0.007, 0.0075, 0.008, 0.009, 0.0115, 0.015, 0.025, 0.05)
+
+# A tick is counted as an overrun when its interval
+# exceeds the tick period by this ratio.
+OVERRUN_RATIO = 1.5
+
+
+def empty_metrics():
+    """Creates a metrics snapshot for a controller that
+    hasn't published any metrics yet.
+
+    :return: A metrics snapshot (see ControllerMetrics.snapshot)
+    :rtype: dict
+    """
+
+    return ControllerMetrics().snapshot(0)
+
+
+class ControllerMetrics():
+    """Collects runtime metrics for a single controller.
+
+    Recording is limited to counter increments and a histogram bucket
+    lookup, so it's cheap enough to run on every tick. Snapshots are
+    only built when published, at a low rate, to the controller's
+    shared state.
+    """
+
+    def __init__(self, rate=132, publish_interval=1.0):
+        """Initializes the metrics.
+
+        :param rate: The controller's tick rate in Hz, defaults to 132
+        :type rate: int or float, optional
+        :param publish_interval: The time between published snapshots
+        in seconds, defaults to 1.0
+        :type publish_interval: float, optional
+        """
+
+        self.period = 1 / rate
+        self.overrun_interval = self.period * OVERRUN_RATIO
+        self.publish_interval = publish_interval
+
+        self.tick_intervals = [0] * (len(TICK_INTERVAL_BUCKETS) + 1)
+        self.tick_interval_max = 0
+        self.tick_interval_total = 0
+        self.ticks = 0
+        self.overruns = 0
+
+        self.reports_sent = 0
+        self.bytes_sent = 0
+        self.reports_received = 0
+        self.bytes_received = 0
+
+        # Reports that couldn't be sent without blocking
+        self.blocking_errors = 0
+        # Connection errors (lost connections)
+        self.os_errors = 0
+        self.reconnects = 0
+
+        # The time of the last published snapshot
+        self.last_publish = None
+        self.last_publish_ticks = 0
+
+    def record_tick(self, interval):
+        """Records the interval between two ticks.
+
+        :param interval: The tick interval in seconds
+        :type interval: float
+        """
+
+        self.ticks += 1
+        self.tick_intervals[bisect_left(TICK_INTERVAL_BUCKETS, interval)] += 1
+        self.tick_interval_total += interval
+        if interval > self.tick_interval_max:
+            self.tick_interval_max = interval
+        if interval > self.overrun_interval:
+            self.overruns += 1
+
+    def record_sent(self, size):
+        """Records a report sent to the Switch.
+
+        :param size: The size of the report in bytes
+        :type size: int
+        """
+
+        self.reports_sent += 1
+        self.bytes_sent += size
+
+    def record_received(self, size):
+        """Records a report received from the Switch.
+
+        :param size: The size of the report in bytes
+        :type size: int
+        """
+
+        self.reports_received += 1
+        self.bytes_received += size
+
+    def publish_due(self, now):
+        """Checks if a snapshot is due to be published.
+
+        :param now: The current perf_counter time
+        :type now: float
+        :return: True if a snapshot should be published
+        :rtype: bool
+        """
+
+        if self.last_publish is None:
+            self.last_publish = now
+            return False
+
+        return now - self.last_publish >= self.publish_interval
+
+    def snapshot(self, now, macro_queue_depth=0, scheduler_stats=None,
+                 latency=None):
+        """Builds a snapshot of the metrics and starts a new
+        publishing interval.
+
+        :param now: The current perf_counter time
+        :type now: float
+        :param macro_queue_depth: The number of queued and running
+        macros, defaults to 0
+        :type macro_queue_depth: int, optional
+        :param scheduler_stats: The controller's TickScheduler stats,
+        defaults to None
+        :type scheduler_stats: dict, optional
+        :param latency: The controller's latency histograms
+        (see LatencyTracer.snapshot), defaults to None
+        :type latency: dict, optional
+        :return: A dict of the metrics. Times are in seconds.
+        :rtype: dict
+        """
+
+        tick_rate = 0
+        if self.last_publish is not None and now > self.last_publish:
+            tick_rate = ((self.ticks - self.last_publish_ticks) /
+                         (now - self.last_publish))
+        self.last_publish = now
+        self.last_publish_ticks = self.ticks
+
+        metrics = {
+            "ticks": self.ticks,
+            "tick_rate": tick_rate,
+            "tick_interval_buckets": list(TICK_INTERVAL_BUCKETS),
+            "tick_intervals": list(self.tick_intervals),
+            "tick_interval_max": self.tick_interval_max,
+            "tick_interval_total": self.tick_interval_total,
+            "overruns": self.overruns,
+            "reports_sent": self.reports_sent,
+            "bytes_sent": self.bytes_sent,
+            "reports_received": self.reports_received,
+            "bytes_received": self.bytes_received,
+            "blocking_errors": self.blocking_errors,
+            "os_errors": self.os_errors,
+            "reconnects": self.reconnects,
+            "macro_queue_depth": macro_queue_depth,
+            "jitter": 0,
+            "missed_ticks": 0,
+            "latency": latency or {},
+        }
+        if scheduler_stats:
+            metrics["jitter"] = scheduler_stats["jitter"]
+            metrics["missed_ticks"] = scheduler_stats["missed_ticks"]
+
+        return metrics
+
+
+# Upper bounds (in seconds) of the latency histogram buckets.
+# As with tick intervals, an extra, final bucket counts
+# everything slower than the last bound.
+LATENCY_BUCKETS = (
+    0.0005, 0.001, 0.002, 0.005, 0.0075, 0.01, 0.02, 0.05, 0.1, 0.25, 1.0)
+
+# Traced direct input stages:
+# input_queue: From the input's origin (eg: the webapp receiving it)
+# until it's written to the controller's input channel
+# input_delivery: From the write until the controller reads it
+# input_send: From the read until the next report is sent
+# input_total: From the input's origin until the report is sent
+INPUT_STAGES = ("input_queue", "input_delivery", "input_send", "input_total")
+# Traced macro stages:
+# macro_delivery: From submission until the controller receives it
+# macro_start: From receipt until the first report of the macro is sent
+# macro_total: From submission until the first report is sent
+MACRO_STAGES = ("macro_delivery", "macro_start", "macro_total")
+
+# The most traced macros that are kept waiting to start. Macros that
+# are stopped or cleared before starting are dropped, oldest first.
+MAX_PENDING_MACRO_TRACES = 64
+
+
+class LatencyHistogram():
+    """A histogram of latencies, in seconds.
+    """
+
+    def __init__(self):
+
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def record(self, latency):
+        """Records a latency.
+
+        :param latency: The latency in seconds
+        :type latency: float
+        """
+
+        self.counts[bisect_left(LATENCY_BUCKETS, latency)] += 1
+        self.count += 1
+        self.total += latency
+        if latency > self.max:
+            self.max = latency
+
+    def snapshot(self):
+        """Gets the histogram as a dict.
+
+        :return: The bucket bounds and counts, and the
+        count, sum and max of all latencies
+        :rtype: dict
+        """
+
+        return {
+            "buckets": list(LATENCY_BUCKETS),
+            "counts": list(self.counts),
+            "count": self.count,
+            "sum": self.total,
+            "max": self.max,
+        }
+
+
+class LatencyTracer():
+    """Measures how long traced direct input and macros take to
+    reach the Switch, per stage.
+
+    Traces carry a non-zero ID and timestamps taken on the
+    time.perf_counter clock. On Linux this is the system-wide
+    monotonic clock, so timestamps can be compared across processes.
+    Each trace is recorded once, when its input first goes out
+    in a sent report.
+    """
+
+    def __init__(self, clock=time.perf_counter):
+        """Initializes the tracer.
+
+        :param clock: The clock traces are timestamped with,
+        defaults to time.perf_counter
+        :type clock: function, optional
+        """
+
+        self.clock = clock
+        self.histograms = {}
+
+        # The ID of the last direct input trace that was read
+        self.input_trace_id = 0
+        # The direct input trace waiting to be sent as
+        # (origin time, read time)
+        self.pending_input = None
+        # Macro IDs mapped to (submission time, receipt time)
+        self.pending_macros = {}
+        # Whether any trace is waiting to be sent
+        self.pending = False
+
+    def record(self, stage, latency):
+        """Records the latency of a stage.
+
+        :param stage: The stage name (see INPUT_STAGES and MACRO_STAGES)
+        :type stage: str
+        :param latency: The latency in seconds
+        :type latency: float
+        """
+
+        histogram = self.histograms.get(stage)
+        if histogram is None:
+            histogram = LatencyHistogram()
+            self.histograms[stage] = histogram
+        histogram.record(max(latency, 0))
+
+    def input_read(self, trace):
+        """Records the controller reading traced direct input.
+        Traces that were already read are ignored.
+
+        :param trace: The trace ID, origin time and write time
+        :type trace: tuple
+        """
+
+        trace_id, origin_time, write_time = trace
+        if trace_id == self.input_trace_id:
+            return
+        self.input_trace_id = trace_id
+
+        now = self.clock()
+        self.record("input_queue", write_time - origin_time)
+        self.record("input_delivery", now - write_time)
+        self.pending_input = (origin_time, now)
+        self.pending = True
+
+    def macro_received(self, macro_id, trace):
+        """Records the controller receiving a traced macro.
+
+        :param macro_id: The ID of the macro
+        :type macro_id: str
+        :param trace: The trace ID and submission time
+        :type trace: tuple
+        """
+
+        now = self.clock()
+        submit_time = trace[1]
+        self.record("macro_delivery", now - submit_time)
+
+        if len(self.pending_macros) >= MAX_PENDING_MACRO_TRACES:
+            del self.pending_macros[next(iter(self.pending_macros))]
+        self.pending_macros[macro_id] = (submit_time, now)
+        self.pending = True
+
+    def report_sent(self, macro_id=None):
+        """Records a report being sent to the Switch, completing
+        the traces of any input it carries.
+
+        :param macro_id: The ID of the macro being input,
+        defaults to None
+        :type macro_id: str, optional
+        """
+
+        now = self.clock()
+        if self.pending_input:
+            origin_time, read_time = self.pending_input
+            self.record("input_send", now - read_time)
+            self.record("input_total", now - origin_time)
+            self.pending_input = None
+
+        if macro_id is not None:
+            times = self.pending_macros.pop(macro_id, None)
+            if times:
+                submit_time, receive_time = times
+                self.record("macro_start", now - receive_time)
+                self.record("macro_total", now - submit_time)
+
+        self.pending = bool(self.pending_macros)
+
+    def snapshot(self):
+        """Gets the histograms of all traced stages.
+
+        :return: Stage names mapped to their histogram
+        (see LatencyHistogram.snapshot)
+        :rtype: dict
+        """
+
+        return {stage: histogram.snapshot()
+                for stage, histogram in self.histograms.items()}
@@ -4,6 +4,7 @@ from time import perf_counter
 
 from .controller import ControllerTypes
 from .utils import replace_subarray
+from .spi import get_spi_flash, SPI_READ_MAX_LENGTH
 
 
 class SwitchResponses(Enum):
@@ -41,6 +42,28 @@ class ControllerProtocol():
         }
     }
     VIBRATOR_BYTES = [0xA0, 0xB0, 0xC0, 0x90]
+    # The length of a Switch report carrying a subcommand
+    SWITCH_REPORT_LENGTH = 50
+    # Default subcommand handlers, by method name, and whether the
+    # report is set up as a subcommand reply before they're called
+    SUBCOMMAND_HANDLERS = {
+        0x02: ("request_device_info", False),
+        0x08: ("set_shipment", True),
+        0x10: ("spi_read", True),
+        0x03: ("set_mode", True),
+        0x04: ("set_trigger_buttons", True),
+        0x40: ("toggle_imu", True),
+        0x48: ("enable_vibration", True),
+        0x30: ("set_player_lights", True),
+        0x22: ("set_nfc_ir_state", True),
+        0x21: ("set_nfc_ir_config", True),
+    }
+    # Static six-axis sensor data reported when the IMU is enabled
+    IMU_DATA = bytes([
+        0x75, 0xFD, 0xFD, 0xFF, 0x09, 0x10, 0x21, 0x00, 0xD5, 0xFF,
+        0xE0, 0xFF, 0x72, 0xFD, 0xF9, 0xFF, 0x0A, 0x10, 0x22, 0x00,
+        0xD5, 0xFF, 0xE0, 0xFF, 0x76, 0xFD, 0xFC, 0xFF, 0x09, 0x10,
+        0x23, 0x00, 0xD5, 0xFF, 0xE0, 0xFF])
 
     def __init__(self, controller_type, bt_address, report_size=50,
                  colour_body=None, colour_buttons=None):
@@ -69,9 +92,16 @@ class ControllerProtocol():
         else:
             raise ValueError("Unknown controller type specified")
 
-        self.report = None
         self.report_size = report_size
-        self.set_empty_report()
+
+        # Reports are written in place into one of two preallocated
+        # buffers. The other buffer holds the report last returned by
+        # get_report, so it stays unchanged while it's being sent.
+        self.empty_report = bytes([0xA1] + [0x00] * (report_size - 1))
+        self.report = bytearray(self.empty_report)
+        self.report_view = memoryview(self.report)
+        self.sent_report = bytearray(self.empty_report)
+        self.sent_report_view = memoryview(self.sent_report)
 
         # Input report mode
         self.mode = None
@@ -128,83 +158,109 @@ class ControllerProtocol():
         else:
             self.colour_buttons = colour_buttons
 
-    def get_report(self):
-
-        report = bytes(self.report)
-        # Clear report
-        self.set_empty_report()
-        return report
-
-    def process_commands(self, data):
-
-        # Parsing the Switch's message
-        message = SwitchReportParser(data)
+        # Subcommand handlers, keyed by subcommand byte
+        self.subcommand_handlers = {}
+        for subcommand_id, (name, reply) in self.SUBCOMMAND_HANDLERS.items():
+            self.register_subcommand_handler(
+                subcommand_id, getattr(self, name), reply=reply)
 
-        # Responding to the parsed message
-        if message.response == SwitchResponses.REQUEST_DEVICE_INFO:
-            self.device_info_queried = True
-            self.set_subcommand_reply()
-            self.set_device_info()
+        # The controller's SPI flash, shared between
+        # controllers of the same type and colours.
+        self.spi_flash = get_spi_flash(
+            self.controller_type, self.colour_body, self.colour_buttons)
 
-        elif message.response == SwitchResponses.SET_SHIPMENT:
-            self.set_subcommand_reply()
-            self.set_shipment()
+    def get_report(self):
+        """Gets the current report and swaps in a cleared buffer
+        for the next report.
 
-        elif message.response == SwitchResponses.SPI_READ:
-            self.set_subcommand_reply()
-            self.spi_read(message)
+        :return: A view of the report. The view is only valid until
+        the next call to get_report.
+        :rtype: memoryview
+        """
 
-        elif message.response == SwitchResponses.SET_MODE:
-            self.set_subcommand_reply()
-            self.set_mode(message)
+        report = self.report_view
 
-        elif message.response == SwitchResponses.TRIGGER_BUTTONS:
-            self.set_subcommand_reply()
-            self.set_trigger_buttons()
+        # Swap the report buffers
+        self.report, self.sent_report = self.sent_report, self.report
+        self.report_view, self.sent_report_view = (
+            self.sent_report_view, self.report_view)
 
-        elif message.response == SwitchResponses.TOGGLE_IMU:
-            self.set_subcommand_reply()
-            self.toggle_imu(message)
-
-        elif message.response == SwitchResponses.ENABLE_VIBRATION:
-            self.set_subcommand_reply()
-            self.enable_vibration()
+        # Clear report
+        self.set_empty_report()
+        return report
 
-        elif message.response == SwitchResponses.SET_PLAYER:
-            self.set_subcommand_reply()
-            self.set_player_lights(message)
+    def process_commands(self, data):
+        """Responds to a report from the Switch.
 
-        elif message.response == SwitchResponses.SET_NFC_IR_STATE:
-            self.set_subcommand_reply()
-            self.set_nfc_ir_state()
+        :param data: The Switch's report or None
+        :type data: bytes or None
+        """
 
-        elif message.response == SwitchResponses.SET_NFC_IR_CONFIG:
-            self.set_subcommand_reply()
-            self.set_nfc_ir_config()
+        # Empty, short (rumble only) and malformed reports are
+        # answered with a full input report. Nearly every tick takes
+        # this path, so it's checked before anything else.
+        if (not data or len(data) < self.SWITCH_REPORT_LENGTH or
+                data[0] != 0xA2):
+            self.set_full_input_report()
+            return
 
-        # Bad Packet handling statements
-        elif message.response == SwitchResponses.UNKNOWN_SUBCOMMAND:
+        subcommand = memoryview(data)[11:]
+        handler = self.subcommand_handlers.get(subcommand[0])
+        if handler is None:
             # Currently set so that the controller ignores any unknown
             # subcommands. This is better than sending a NACK response
             # since we'd just get stuck in an infinite loop arguing
             # with the Switch.
             self.set_full_input_report()
+            return
 
-        elif message.response == SwitchResponses.NO_DATA:
-            self.set_full_input_report()
+        reply, handler = handler
+        if reply:
+            self.set_subcommand_reply()
+        handler(subcommand)
 
-        elif message.response == SwitchResponses.TOO_SHORT:
-            self.set_full_input_report()
+    @classmethod
+    def is_subcommand(cls, data):
+        """Checks if a report from the Switch carries a subcommand
+        (rather than being empty, rumble only or malformed).
 
-        elif message.response == SwitchResponses.MALFORMED:
-            self.set_full_input_report()
+        :param data: The Switch's report or None
+        :type data: bytes or None
+        :return: True if the report carries a subcommand
+        :rtype: bool
+        """
 
-    def set_empty_report(self):
+        return bool(data and len(data) >= cls.SWITCH_REPORT_LENGTH and
+                    data[0] == 0xA2)
+
+    def register_subcommand_handler(self, subcommand_id, handler, reply=True):
+        """Registers a handler for a given subcommand, replacing
+        any existing handler.
+
+        :param subcommand_id: The subcommand byte
+        :type subcommand_id: int
+        :param handler: A function called with a memoryview of the
+        subcommand (the Switch's report from byte 11 onward). The view
+        is only valid during the call.
+        :type handler: function
+        :param reply: Whether the report is set up as a subcommand reply
+        before the handler is called, defaults to True
+        :type reply: bool, optional
+        """
+
+        self.subcommand_handlers[subcommand_id] = (reply, handler)
 
-        empty_report = [0] * self.report_size
-        empty_report[0] = 0xA1
+    def request_device_info(self, subcommand=None):
 
-        self.report = empty_report
+        # Registered without a reply, since the reply's input
+        # report depends on the device info having been queried.
+        self.device_info_queried = True
+        self.set_subcommand_reply()
+        self.set_device_info()
+
+    def set_empty_report(self):
+
+        self.report[:] = self.empty_report
 
     def set_subcommand_reply(self):
 
@@ -294,7 +350,7 @@ class ControllerProtocol():
         self.report[11] = right[1]
         self.report[12] = right[2]
 
-    def set_device_info(self):
+    def set_device_info(self, subcommand=None):
 
         # ACK Reply
         self.report[14] = 0x82
@@ -328,7 +384,7 @@ class ControllerProtocol():
         # Controller colours location (read from SPI)
         self.report[27] = 0x01
 
-    def set_shipment(self):
+    def set_shipment(self, subcommand=None):
 
         # ACK Reply
         self.report[14] = 0x80
@@ -336,9 +392,9 @@ class ControllerProtocol():
         # Subcommand reply
         self.report[15] = 0x08
 
-    def toggle_imu(self, message):
+    def toggle_imu(self, subcommand):
 
-        if message.subcommand[1] == 0x01:
+        if subcommand[1] == 0x01:
             self.imu_enabled = True
         else:
             self.imu_enabled = False
@@ -354,17 +410,9 @@ class ControllerProtocol():
         if not self.imu_enabled:
             return
 
-        imu_data = [0x75, 0xFD, 0xFD, 0xFF, 0x09, 0x10, 0x21, 0x00, 0xD5, 0xFF,
-                    0xE0, 0xFF, 0x72, 0xFD, 0xF9, 0xFF, 0x0A, 0x10, 0x22, 0x00,
-                    0xD5, 0xFF, 0xE0, 0xFF, 0x76, 0xFD, 0xFC, 0xFF, 0x09, 0x10,
-                    0x23, 0x00, 0xD5, 0xFF, 0xE0, 0xFF]
-        replace_subarray(self.report, 14, 49, replace_arr=imu_data)
-
-    def spi_read(self, message):
+        self.report[14:50] = self.IMU_DATA
 
-        addr_top = message.subcommand[2]
-        addr_bottom = message.subcommand[1]
-        read_length = message.subcommand[5]
+    def spi_read(self, subcommand):
 
         # ACK byte
         self.report[14] = 0x90
@@ -372,134 +420,18 @@ class ControllerProtocol():
         # Subcommand reply
         self.report[15] = 0x10
 
-        # Read address
-        self.report[16] = addr_bottom
-        self.report[17] = addr_top
-
-        # Read length
+        # Read address (uint32 little endian) and length
+        self.report[16:20] = subcommand[1:5]
+        address = int.from_bytes(subcommand[1:5], "little")
+        read_length = subcommand[5]
         self.report[20] = read_length
 
-        # Stick Parameters
-        # Params are generally the same for all sticks
-        # Notable difference is the deadzone (10% Joy-Con vs 15% Pro Con)
-        params = [0x0F, 0x30, 0x61,  # Unused
-                  0x96, 0x30, 0xF3,  # Dead Zone/Range Ratio
-                  0xD4, 0x14, 0x54,  # X/Y ?
-                  0x41, 0x15, 0x54,  # X/Y ?
-                  0xC7, 0x79, 0x9C,  # X/Y ?
-                  0x33, 0x36, 0x63]  # X/Y ?
-        # Adjusting deadzone for Joy-Cons
-        if not self.controller_type == ControllerTypes.PRO_CONTROLLER:
-            params[3] = 0xAE
-
-        # Serial Number read
-        if addr_top == 0x60 and addr_bottom == 0x00:
-            # Switch will take this as no serial number
-            replace_subarray(self.report, 21, 16, 0xFF)
-
-        # Colours
-        elif addr_top == 0x60 and addr_bottom == 0x50:
-            # Body colour
-            replace_subarray(
-                self.report, 21, 3,
-                replace_arr=self.colour_body)
-            # Buttons colour
-            replace_subarray(
-                self.report, 24, 3,
-                replace_arr=self.colour_buttons)
-            # Left/right grip colours (Pro controller)
-            replace_subarray(self.report, 27, 7, 0xFF)
-
-        # Factory sensor/stick device parameters
-        elif addr_top == 0x60 and addr_bottom == 0x80:
-
-            # Six-Axis factory parameters
-            if self.controller_type == ControllerTypes.PRO_CONTROLLER:
-                self.report[21] = 0x50
-                self.report[22] = 0xFD
-                self.report[23] = 0x00
-                self.report[24] = 0x00
-                self.report[25] = 0xC6
-                self.report[26] = 0x0F
-            else:
-                self.report[21] = 0x5E
-                self.report[22] = 0x01
-                self.report[23] = 0x00
-                self.report[24] = 0x00
-                if self.controller_type == ControllerTypes.JOYCON_L:
-                    self.report[25] = 0xF1
-                    self.report[26] = 0x0F
-                else:
-                    self.report[25] = 0x0F
-                    self.report[26] = 0xF0
-
-            replace_subarray(self.report, 27, 18, replace_arr=params)
-
-        # Stick device parameters 2
-        elif addr_top == 0x60 and addr_bottom == 0x98:
-
-            # Setting same params since controllers always
-            # have duplicates of stick params 1 for stick params 2
-            replace_subarray(self.report, 21, 18, replace_arr=params)
-
-        # User analog stick calibration
-        elif addr_top == 0x80 and addr_bottom == 0x10:
-
-            # Fill report with null user calibration info
-            replace_subarray(self.report, 21, 24, 0xFF)
-
-        # Factory analog stick calibration
-        elif addr_top == 0x60 and addr_bottom == 0x3D:
-
-            # Left/right stick calibration
-            l_calibration = [0xBA, 0xF5, 0x62,
-                             0x6F, 0xC8, 0x77,
-                             0xED, 0x95, 0x5B]
-            r_calibration = [0x16, 0xD8, 0x7D,
-                             0xF2, 0xB5, 0x5F,
-                             0x86, 0x65, 0x5E]
-
-            # Left stick calibration
-            # If null, fill with 0xFF
-            if not self.controller_type == ControllerTypes.JOYCON_R:
-                replace_subarray(self.report, 21, 9, replace_arr=l_calibration)
-            else:
-                replace_subarray(self.report, 21, 9, value=0xFF)
-
-            # Right stick calibration
-            # If null, fill with 0xFF
-            if not self.controller_type == ControllerTypes.JOYCON_L:
-                replace_subarray(self.report, 30, 9, replace_arr=r_calibration)
-            else:
-                replace_subarray(self.report, 30, 9, value=0xFF)
-
-            # Spacer byte
-            self.report[39] = 0xFF
-
-            # Body colour
-            replace_subarray(
-                self.report, 40, 3,
-                replace_arr=self.colour_body)
-            # Buttons colour
-            replace_subarray(
-                self.report, 43, 3,
-                replace_arr=self.colour_buttons)
-
-        # Six-Axis motion sensor factor calibration
-        elif addr_top == 0x60 and addr_bottom == 0x20:
-
-            # 1: Acceleration origin position
-            # 2: Acceleration sensitivity coefficient
-            # 3: Gyro origin when still
-            # 4: Gyro sensitivity coefficient
-            sa_calibration = [0xD3, 0xFF, 0xD5, 0xFF, 0x55, 0x01,  # 1
-                              0x00, 0x40, 0x00, 0x40, 0x00, 0x40,  # 2
-                              0x19, 0x00, 0xDD, 0xFF, 0xDC, 0xFF,  # 3
-                              0x3B, 0x34, 0x3B, 0x34, 0x3B, 0x34]  # 4
-
-            replace_subarray(self.report, 21, 24, replace_arr=sa_calibration)
-
-    def set_mode(self, message):
+        # Only as much data as fits in the reply can be read
+        read_length = min(read_length, SPI_READ_MAX_LENGTH)
+        self.report[21:21 + read_length] = self.spi_flash.read(
+            address, read_length)
+
+    def set_mode(self, subcommand):
 
         # ACK byte
         self.report[14] = 0x80
@@ -507,14 +439,14 @@ class ControllerProtocol():
         # Subcommand reply
         self.report[15] = 0x03
 
-        if message.subcommand[1] == 0x30:
+        if subcommand[1] == 0x30:
             self.mode = "standard"
-        elif message.subcommand[1] == 0x31:
+        elif subcommand[1] == 0x31:
             self.mode = "nfc/ir"
-        elif message.subcommand[1] == 0x3F:
+        elif subcommand[1] == 0x3F:
             self.mode = "simpleHID"
 
-    def set_trigger_buttons(self):
+    def set_trigger_buttons(self, subcommand=None):
 
         # ACK byte
         self.report[14] = 0x83
@@ -522,7 +454,7 @@ class ControllerProtocol():
         # Subcommand reply
         self.report[15] = 0x04
 
-    def enable_vibration(self):
+    def enable_vibration(self, subcommand=None):
 
         # ACK Reply
         self.report[14] = 0x82
@@ -533,7 +465,7 @@ class ControllerProtocol():
         # Set class property
         self.vibration_enabled = True
 
-    def set_player_lights(self, message):
+    def set_player_lights(self, subcommand):
 
         # ACK byte
         self.report[14] = 0x80
@@ -541,7 +473,7 @@ class ControllerProtocol():
         # Subcommand reply
         self.report[15] = 0x30
 
-        bitfield = message.subcommand[1]
+        bitfield = subcommand[1]
 
         if bitfield == 0x01 or bitfield == 0x10:
             self.player_number = 1
@@ -552,7 +484,7 @@ class ControllerProtocol():
         elif bitfield == 0x0F or bitfield == 0xF0:
             self.player_number = 4
 
-    def set_nfc_ir_state(self):
+    def set_nfc_ir_state(self, subcommand=None):
 
         # ACK byte
         self.report[14] = 0x80
@@ -560,7 +492,7 @@ class ControllerProtocol():
         # Subcommand reply
         self.report[15] = 0x22
 
-    def set_nfc_ir_config(self):
+    def set_nfc_ir_config(self, subcommand=None):
 
         # ACK byte
         self.report[14] = 0xA0
@@ -0,0 +1,191 @@
+import time
+
+
+class TickScheduler():
+    """Schedules fixed-rate ticks against absolute deadlines.
+
+    Rather than sleeping for the remainder of each tick, the scheduler
+    keeps a running deadline on the monotonic perf_counter clock. Sleep
+    overshoot and slow ticks therefore don't accumulate into drift.
+    Waiting is done with a sleep, optionally followed by a short spin
+    to land closer to the deadline.
+
+    Spinning trades CPU for precision. A spin threshold of 1ms keeps
+    each process busy for about 1ms of every ~7.6ms tick at 132Hz
+    (about 13% of a core per controller), for sub-millisecond tick
+    lateness. Without spinning, ticks are released within the OS's
+    sleep overshoot (typically well under a millisecond on Linux),
+    which the Switch tolerates, so spinning is off by default.
+    """
+
+    # Missed tick policies
+    # Drop any missed ticks and resume on the next deadline
+    SKIP = "skip"
+    # Run missed ticks back-to-back until the schedule is caught up
+    CATCH_UP = "catch_up"
+
+    def __init__(self, rate=132, policy=SKIP, spin_threshold=0,
+                 max_catch_up=4, clock=time.perf_counter, sleep=time.sleep):
+        """Initializes the tick scheduler.
+
+        :param rate: The tick rate in Hz, defaults to 132
+        :type rate: int or float, optional
+        :param policy: The missed tick policy (TickScheduler.SKIP or
+        TickScheduler.CATCH_UP), defaults to TickScheduler.SKIP
+        :type policy: str, optional
+        :param spin_threshold: The time in seconds before a deadline
+        where the scheduler stops sleeping and spins instead, costing
+        up to that much CPU time every tick. Setting this to 0 disables
+        spinning, defaults to 0
+        :type spin_threshold: float, optional
+        :param max_catch_up: The maximum number of missed ticks that are
+        caught up on under the CATCH_UP policy. Falling further behind
+        resets the schedule, defaults to 4
+        :type max_catch_up: int, optional
+        :param clock: A monotonic clock function returning seconds,
+        defaults to time.perf_counter
+        :type clock: function, optional
+        :param sleep: A sleep function taking seconds,
+        defaults to time.sleep
+        :type sleep: function, optional
+        :raises ValueError: On a non-positive rate or unknown policy
+        """
+
+        if rate <= 0:
+            raise ValueError("Tick rate must be greater than zero")
+        if policy not in (self.SKIP, self.CATCH_UP):
+            raise ValueError("Unknown missed tick policy specified")
+
+        self.rate = rate
+        self.period = 1 / rate
+        self.policy = policy
+        self.spin_threshold = spin_threshold
+        self.max_catch_up = max_catch_up
+        self.clock = clock
+        self.sleep = sleep
+
+        self.next_deadline = None
+        self.last_tick = None
+        # The interval between the last two ticks in seconds
+        self.last_interval = 0
+
+        self.reset_stats()
+
+    def start(self):
+        """(Re)anchors the schedule so that the next tick is due
+        one period from now.
+        """
+
+        now = self.clock()
+        self.next_deadline = now + self.period
+        self.last_tick = now
+
+    def time_until_deadline(self):
+        """Gets the time remaining until the next tick deadline.
+
+        :return: The time in seconds, negative if the deadline has passed
+        :rtype: float
+        """
+
+        if self.next_deadline is None:
+            self.start()
+
+        return self.next_deadline - self.clock()
+
+    def wait(self):
+        """Blocks until the next tick deadline and advances the schedule.
+
+        :return: How late the tick was released, in seconds
+        :rtype: float
+        """
+
+        if self.next_deadline is None:
+            self.start()
+
+        deadline = self.next_deadline
+        clock = self.clock
+
+        remaining = deadline - clock()
+        if remaining > self.spin_threshold:
+            self.sleep(remaining - self.spin_threshold)
+
+        # Spin out any remainder of the tick
+        now = clock()
+        while now < deadline:
+            now = clock()
+
+        lateness = now - deadline
+        self._advance(deadline, now)
+
+        self.last_interval = now - self.last_tick
+        self.last_tick = now
+        self._record(lateness)
+
+        return lateness
+
+    def _advance(self, deadline, now):
+
+        period = self.period
+        next_deadline = deadline + period
+        if next_deadline > now:
+            self.next_deadline = next_deadline
+            return
+
+        # We're at least one full tick behind schedule
+        missed = int((now - deadline) / period)
+
+        if self.policy == self.CATCH_UP and missed <= self.max_catch_up:
+            # Keep the old deadlines so subsequent waits return
+            # immediately until the schedule is caught up.
+            # Only the next tick is counted, since the remaining
+            # overdue ticks are counted as they're released.
+            self.missed_ticks += 1
+            self.next_deadline = next_deadline
+        else:
+            # Jump ahead to the next deadline on the original grid
+            self.missed_ticks += missed
+            self.next_deadline = deadline + period * (missed + 1)
+
+    def _record(self, lateness):
+
+        self.ticks += 1
+        self.lateness_total += lateness
+        self.lateness_squared_total += lateness * lateness
+        if lateness > self.lateness_max:
+            self.lateness_max = lateness
+
+    def reset_stats(self):
+        """Clears all collected jitter statistics.
+        """
+
+        self.ticks = 0
+        self.missed_ticks = 0
+        self.lateness_total = 0
+        self.lateness_squared_total = 0
+        self.lateness_max = 0
+
+    def stats(self):
+        """Gets jitter statistics for all ticks since the
+        statistics were last reset.
+
+        :return: A dict with the tick count, missed tick count,
+        and the mean, standard deviation and maximum of the tick
+        release lateness in seconds.
+        :rtype: dict
+        """
+
+        if self.ticks:
+            mean = self.lateness_total / self.ticks
+            variance = self.lateness_squared_total / self.ticks - mean * mean
+            jitter = max(variance, 0) ** 0.5
+        else:
+            mean = 0
+            jitter = 0
+
+        return {
+            "ticks": self.ticks,
+            "missed_ticks": self.missed_ticks,
+            "mean_lateness": mean,
+            "jitter": jitter,
+            "max_lateness": self.lateness_max,
+        }
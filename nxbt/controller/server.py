@@ -1,4 +1,5 @@
 import socket
+import selectors
 import fcntl
 import os
 import time
@@ -7,12 +8,18 @@ import logging
 import traceback
 import atexit
 from threading import Thread
-import statistics as stat
 
 from .controller import Controller, ControllerTypes
 from ..bluez import BlueZ, find_devices_by_alias
 from .protocol import ControllerProtocol
-from .input import InputParser
+from .input import InputParser, FINISHED_MACRO_RETENTION
+from .scheduler import TickScheduler
+from .metrics import ControllerMetrics, LatencyTracer
+from .channel import DirectInputChannel
+from .messages import decode_header, decode_macro, decode_trace
+from .messages import decode_sequence, next_sequence
+from .messages import INPUT_MACRO, STOP_MACRO, CLEAR_MACROS
+from .messages import MAX_DIRECT_MESSAGE_SIZE
 from .utils import format_msg_controller, format_msg_switch
 
 
@@ -20,7 +27,10 @@ class ControllerServer():
 
     def __init__(self, controller_type, adapter_path="/org/bluez/hci0",
                  state=None, task_queue=None, lock=None, colour_body=None,
-                 colour_buttons=None):
+                 colour_buttons=None, scheduler=None, input_channel=None,
+                 event_queue=None, index=None,
+                 finished_retention=FINISHED_MACRO_RETENTION,
+                 command_address=None, bluetooth=None):
 
         self.logger = logging.getLogger('nxbt')
         # Cache logging level to increase performance on checks
@@ -40,6 +50,27 @@ class ControllerServer():
 
         self.task_queue = task_queue
 
+        # Events (such as finished macros) are published to the
+        # event queue, tagged with the controller's index.
+        self.event_queue = event_queue
+        self.index = index
+
+        # Commands sent directly by clients arrive as binary messages
+        # on an abstract Unix datagram socket, skipping the command
+        # manager. The socket is bound here so that it's ready as soon
+        # as the controller is registered.
+        self.command_socket = None
+        if command_address:
+            self.command_socket = socket.socket(
+                socket.AF_UNIX, socket.SOCK_DGRAM)
+            self.command_socket.bind("\0" + command_address)
+            self.command_socket.setblocking(False)
+
+        # The name of a shared memory direct input channel.
+        # Attached to once the server is running.
+        self.input_channel_name = input_channel
+        self.input_channel = None
+
         self.controller_type = controller_type
         self.colour_body = colour_body
         self.colour_buttons = colour_buttons
@@ -50,7 +81,12 @@ class ControllerServer():
         self.reconnect_counter = 0
 
         # Intializing Bluetooth
-        self.bt = BlueZ(adapter_path=adapter_path)
+        # A stand-in can be passed for Bluetooth, eg: when
+        # the controller is served to a simulated Switch.
+        if bluetooth:
+            self.bt = bluetooth
+        else:
+            self.bt = BlueZ(adapter_path=adapter_path)
 
         self.controller = Controller(self.bt, self.controller_type)
         self.protocol = ControllerProtocol(
@@ -59,14 +95,36 @@ class ControllerServer():
             colour_body=self.colour_body,
             colour_buttons=self.colour_buttons)
 
-        self.input = InputParser(self.protocol)
+        self.input = InputParser(
+            self.protocol, finished_callback=self._on_macro_finished,
+            finished_retention=finished_retention)
+
+        # Paces the mainloop at the controller's report rate
+        if scheduler:
+            self.scheduler = scheduler
+        else:
+            self.scheduler = TickScheduler(rate=132)
+
+        # Waits on the interrupt socket for reports from the Switch
+        self.selector = selectors.DefaultSelector()
+        self.watched_socket = None
 
-        # Debug timekeeping storage array
-        self.times = []
+        # Runtime metrics, published to the state about once a second
+        self.metrics = ControllerMetrics(rate=self.scheduler.rate)
+        # Latency of traced input and macros, published with the metrics
+        self.latency = LatencyTracer()
+
+        # Sequenced command messages can arrive out of order over the
+        # command socket and the task queue. Messages that overtake an
+        # earlier one are held until it arrives.
+        self.next_sequence = 1
+        self.held_messages = {}
 
         # Initial reconnection overload protection
         self.tick = 1
-        self.cached_msg = ''
+        # Copy of the last sent report (minus the header/timer bytes).
+        # Reports are compared/copied in place to avoid allocations.
+        self.cached_msg = bytearray()
 
     def run(self, reconnect_address=None):
         """Runs the mainloop of the controller server.
@@ -76,125 +134,274 @@ class ControllerServer():
         :type reconnect_address: string or list, optional
         """
 
-        self.state["state"] = "initializing"
+        try:
+            itr, ctrl = self.establish_connection(reconnect_address)
+            self.mainloop(itr, ctrl)
+        except KeyboardInterrupt:
+            pass
+        except Exception:
+            return self.report_crash()
+
+    def establish_connection(self, reconnect_address=None):
+        """Sets up the controller and connects (or reconnects)
+        to a Nintendo Switch.
+
+        :param reconnect_address: The Bluetooth MAC address of a
+        previously connected to Nintendo Switch, defaults to None
+        :type reconnect_address: string or list, optional
+        :return: The interrupt and control sockets
+        :rtype: tuple
+        """
+
+        self.set_state("initializing")
+
+        if self.input_channel_name:
+            self.input_channel = DirectInputChannel.attach(
+                self.input_channel_name)
 
+        # If we have a lock, prevent other controllers
+        # from initializing at the same time and saturating the DBus,
+        # potentially causing a kernel panic.
+        if self.lock:
+            self.lock.acquire()
         try:
-            # If we have a lock, prevent other controllers
-            # from initializing at the same time and saturating the DBus,
-            # potentially causing a kernel panic.
-            if self.lock:
-                self.lock.acquire()
-            try:
-                self.controller.setup()
-
-                if reconnect_address:
-                    try:
-                        itr, ctrl = self.reconnect(reconnect_address)
-                    except OSError:
-                        itr, ctrl = self.connect()
-                else:
+            self.controller.setup()
+
+            if reconnect_address:
+                try:
+                    itr, ctrl = self.reconnect(reconnect_address)
+                except OSError:
                     itr, ctrl = self.connect()
-            finally:
-                if self.lock:
-                    self.lock.release()
+            else:
+                itr, ctrl = self.connect()
+        finally:
+            if self.lock:
+                self.lock.release()
 
-            self.switch_address = itr.getpeername()[0]
-            self.state["last_connection"] = self.switch_address
+        self.switch_address = itr.getpeername()[0]
+        self.state["last_connection"] = self.switch_address
 
-            self.state["state"] = "connected"
+        self.set_state("connected")
 
-            self.mainloop(itr, ctrl)
+        return itr, ctrl
 
-        except KeyboardInterrupt:
-            pass
-        except Exception:
-            try:
-                self.state["state"] = "crashed"
-                self.state["errors"] = traceback.format_exc()
-                return self.state
-            except Exception as e:
-                self.logger.debug("Error during graceful shutdown:")
-                self.logger.debug(traceback.format_exc())
+    def report_crash(self):
+        """Records the current exception as the controller's
+        error and marks the controller as crashed. Must be
+        called from an exception handler.
+
+        :return: The controller's state
+        :rtype: dict
+        """
+
+        try:
+            self.state["errors"] = traceback.format_exc()
+            self.set_state("crashed")
+            return self.state
+        except Exception as e:
+            self.logger.debug("Error during graceful shutdown:")
+            self.logger.debug(traceback.format_exc())
 
     def mainloop(self, itr, ctrl):
 
-        duration_start = time.perf_counter()
+        self.watch(itr)
+        self.scheduler.start()
         while True:
-            # Start timing command processing
-            timer_start = time.perf_counter()
+            try:
+                if not self.step(itr, self.receive(itr)):
+                    continue
 
-            # Attempt to get output from Switch
+                self.wait_for_tick(itr)
+            except OSError as e:
+                self.metrics.os_errors += 1
+                # Attempt to reconnect to the Switch
+                itr, ctrl = self.save_connection(e)
+                self.watch(itr)
+                # Don't count the reconnection time as missed ticks
+                self.scheduler.start()
+                continue
+
+            self.tick += 1
+
+            self.metrics.record_tick(self.scheduler.last_interval)
+            self.publish_metrics()
+
+    def publish_metrics(self, scheduler=None):
+        """Publishes the controller's metrics to its state
+        if a snapshot is due (about once a second).
+
+        :param scheduler: The scheduler pacing the controller's ticks,
+        eg: a ControllerEngine's. Defaults to the server's own scheduler.
+        :type scheduler: TickScheduler, optional
+        """
+
+        if scheduler is None:
+            scheduler = self.scheduler
+
+        # The last tick time stands in for the current time
+        now = scheduler.last_tick
+        if now is None or not self.metrics.publish_due(now):
+            return
+
+        macro_queue_depth = len(self.input.macro_buffer)
+        if self.input.current_macro:
+            macro_queue_depth += 1
+
+        metrics = self.metrics.snapshot(
+            now, macro_queue_depth, scheduler.stats(),
+            self.latency.snapshot())
+        self.state["metrics"] = metrics
+
+        if self.logger_level <= logging.DEBUG:
+            self.logger.debug(
+                f"Tick rate: {metrics['tick_rate']:.1f}Hz, "
+                f"Overruns: {metrics['overruns']}")
+
+    def watch(self, itr):
+        """Sets the interrupt socket that's waited on for
+        reports from the Switch.
+
+        :param itr: The interrupt socket
+        :type itr: socket.socket
+        """
+
+        if self.watched_socket is not None:
             try:
-                reply = itr.recv(50)
-                if len(reply) > 40:
-                    self.logger.debug(format_msg_switch(reply))
-            except BlockingIOError:
-                reply = None
+                self.selector.unregister(self.watched_socket)
+            except (KeyError, ValueError):
+                pass
 
-            # Getting any inputs from the task queue
-            if self.task_queue:
-                try:
-                    while True:
-                        msg = self.task_queue.get_nowait()
-                        if msg and msg["type"] == "macro":
-                            self.input.buffer_macro(
-                                msg["macro"], msg["macro_id"])
-                        elif msg and msg["type"] == "stop":
-                            self.input.stop_macro(
-                                msg["macro_id"], state=self.state)
-                        elif msg and msg["type"] == "clear":
-                            self.input.clear_macros()
-                except queue.Empty:
-                    pass
+        self.selector.register(itr, selectors.EVENT_READ)
+        self.watched_socket = itr
 
-            # Set Direct Input
-            if self.state["direct_input"]:
-                self.input.set_controller_input(self.state["direct_input"])
+    def wait_for_report(self, timeout):
+        """Waits until the Switch sends a report or the timeout passes.
 
-            self.protocol.process_commands(reply)
-            self.input.set_protocol_input(state=self.state)
+        :param timeout: The maximum time to wait in seconds
+        :type timeout: float
+        :return: True if a report is waiting to be received
+        :rtype: bool
+        """
 
-            msg = self.protocol.get_report()
+        return bool(self.selector.select(timeout))
 
-            if self.logger_level <= logging.DEBUG and reply and len(reply) > 45:
-                self.logger.debug(format_msg_controller(msg))
+    def wait_for_tick(self, itr):
+        """Waits until the next tick deadline. Subcommands received
+        from the Switch in the meantime are answered immediately rather
+        than on the next tick. Any other reports (eg: rumble only) are
+        answered by the next tick's report.
 
+        :param itr: The non-blocking interrupt socket
+        :type itr: socket.socket
+        :raises OSError: If the connection to the Switch is lost
+        """
+
+        scheduler = self.scheduler
+        while True:
+            # Leave any final stretch to the scheduler's spin
+            timeout = scheduler.time_until_deadline() - scheduler.spin_threshold
+            if timeout <= 0 or not self.wait_for_report(timeout):
+                break
+
+            reply = self.receive(itr)
+            if reply == b"":
+                raise ConnectionResetError("The Switch closed the connection")
+            if self.protocol.is_subcommand(reply):
+                self.step(itr, reply)
+
+        scheduler.wait()
+
+    def receive(self, itr):
+        """Receives a report from the Switch, if one is waiting.
+
+        :param itr: The non-blocking interrupt socket
+        :type itr: socket.socket
+        :raises OSError: If the connection to the Switch is lost
+        :return: The report or None
+        :rtype: bytes or None
+        """
+
+        try:
+            reply = itr.recv(50)
+            self.metrics.record_received(len(reply))
+            if len(reply) > 40:
+                self.logger.debug(format_msg_switch(reply))
+        except BlockingIOError:
+            reply = None
+
+        return reply
+
+    def step(self, itr, reply):
+        """Runs a single tick of the controller. Any pending commands
+        and input are applied, the Switch's last report is answered
+        and the controller's input report is sent.
+
+        :param itr: The non-blocking interrupt socket
+        :type itr: socket.socket
+        :param reply: The last report received from the Switch or None
+        :type reply: bytes or None
+        :raises OSError: If the connection to the Switch is lost
+        :return: False if the report couldn't be sent without blocking
+        :rtype: bool
+        """
+
+        # Getting any commands relayed through the task queue.
+        # These are drained first since they can predate the
+        # controller's command socket being bound.
+        if self.task_queue:
             try:
-                # Cache the last packet to prevent overloading the switch
-                # with packets on the "Change Grip/Order" menu.
-                if msg[3:] != self.cached_msg:
-                    itr.sendall(msg)
-                    self.cached_msg = msg[3:]
-                # Send a blank packet every so often to keep the Switch
-                # from disconnecting from the controller.
-                elif self.tick >= 132:
-                    itr.sendall(msg)
-                    self.tick = 0
+                while True:
+                    self.handle_message(self.task_queue.get_nowait())
+            except queue.Empty:
+                pass
+
+        # Getting any commands sent directly by clients
+        if self.command_socket:
+            try:
+                while True:
+                    self.handle_message(self.command_socket.recv(
+                        MAX_DIRECT_MESSAGE_SIZE))
             except BlockingIOError:
-                continue
-            except OSError as e:
-                # Attempt to reconnect to the Switch
-                itr, ctrl = self.save_connection(e)
+                pass
 
-            # Figure out how long it took to process commands
-            duration_end = time.perf_counter()
-            duration_elapsed = duration_end - duration_start
-            duration_start = duration_end
-            
-            sleep_time = 1/132 - duration_elapsed
-            if sleep_time >= 0:
-                time.sleep(sleep_time)
-            self.tick += 1
+        # Set Direct Input
+        if self.input_channel:
+            self.input.set_controller_input(self.input_channel.read())
+            if self.input_channel.last_trace:
+                self.latency.input_read(self.input_channel.last_trace)
+        elif self.state["direct_input"]:
+            self.input.set_controller_input(self.state["direct_input"])
 
-            if self.logger_level <= logging.DEBUG:
-                self.times.append(duration_elapsed)
-                if len(self.times) > 100:
-                    self.times.pop()
-                mean_time = stat.mean(self.times)
+        self.protocol.process_commands(reply)
+        self.input.set_protocol_input(state=self.state)
 
-                self.logger.debug(
-                    f"Tick: {self.tick}, Mean Time: {str(1/mean_time)}")
+        msg = self.protocol.get_report()
 
+        if self.logger_level <= logging.DEBUG and reply and len(reply) > 45:
+            self.logger.debug(format_msg_controller(msg))
+
+        try:
+            # Cache the last packet to prevent overloading the switch
+            # with packets on the "Change Grip/Order" menu.
+            if msg[3:] != self.cached_msg:
+                itr.sendall(msg)
+                self.cached_msg[:] = msg[3:]
+                self.metrics.record_sent(len(msg))
+                if self.latency.pending:
+                    self.latency.report_sent(self.input.current_macro_id)
+            # Send a blank packet every so often to keep the Switch
+            # from disconnecting from the controller.
+            elif self.tick >= 132:
+                itr.sendall(msg)
+                self.tick = 0
+                self.metrics.record_sent(len(msg))
+                if self.latency.pending:
+                    self.latency.report_sent(self.input.current_macro_id)
+        except BlockingIOError:
+            self.metrics.blocking_errors += 1
+            return False
+
+        return True
 
     def save_connection(self, error, state=None):
 
@@ -213,44 +420,11 @@ class ControllerServer():
                 try:
                     itr, ctrl = self.reconnect(self.switch_address)
 
-                    received_first_message = False
-                    while True:
-                        # Attempt to get output from Switch
-                        try:
-                            reply = itr.recv(50)
-                            if self.logger_level <= logging.DEBUG and len(reply) > 40:
-                                self.logger.debug(format_msg_switch(reply))
-                        except BlockingIOError:
-                            reply = None
-
-                        if reply:
-                            received_first_message = True
-
-                        self.protocol.process_commands(reply)
-                        msg = self.protocol.get_report()
-
-                        if self.logger_level <= logging.DEBUG and reply:
-                            self.logger.debug(format_msg_controller(msg))
-
-                        try:
-                            itr.sendall(msg)
-                        except BlockingIOError:
-                            continue
-
-                        # Exit pairing loop when player lights have been set and
-                        # vibration has been enabled
-                        if (reply and len(reply) > 45 and
-                                self.protocol.vibration_enabled and self.protocol.player_number):
-                            break
-
-                        # Switch responds to packets slower during pairing
-                        # Pairing cycle responds optimally on a 15Hz loop
-                        if not received_first_message:
-                            time.sleep(1)
-                        else:
-                            time.sleep(1/15)
-
-                    self.state["state"] = "connected"
+                    self.watch(itr)
+                    self.pair(itr)
+
+                    self.set_state("connected")
+                    self.metrics.reconnects += 1
                     return itr, ctrl
                 finally:
                     if self.lock:
@@ -280,11 +454,11 @@ class ControllerServer():
         # we need to press the L/SL and R/SR buttons before
         # we can proceed with any input.
         if self.controller_type == ControllerTypes.PRO_CONTROLLER:
-            self.input.current_macro_commands = "L R 0.0s".strip(" ").split(" ")
+            self.input.current_frame = self.input.compile_macro_line("L R 0.0s")
         elif self.controller_type == ControllerTypes.JOYCON_L:
-            self.input.current_macro_commands = "JCL_SL JCL_SR 0.0s".strip(" ").split(" ")
+            self.input.current_frame = self.input.compile_macro_line("JCL_SL JCL_SR 0.0s")
         elif self.controller_type == ControllerTypes.JOYCON_R:
-            self.input.current_macro_commands = "JCR_SL JCR_SR 0.0s".strip(" ").split(" ")
+            self.input.current_frame = self.input.compile_macro_line("JCR_SL JCR_SR 0.0s")
 
         if self.lock:
             self.lock.acquire()
@@ -294,12 +468,57 @@ class ControllerServer():
             if self.lock:
                 self.lock.release()
 
-        self.state["state"] = "connected"
+        self.set_state("connected")
+        self.metrics.reconnects += 1
 
         self.switch_address = itr.getsockname()[0]
 
         return itr, ctrl
 
+    def pair(self, itr):
+        """Exchanges reports with the Switch until it has set the
+        player lights and enabled vibration.
+
+        Reports from the Switch are answered as soon as they arrive.
+        Otherwise the Switch is prompted once a second until it first
+        responds and at 15Hz afterwards, since it responds to packets
+        slower during pairing.
+
+        :param itr: The non-blocking interrupt socket
+        :type itr: socket.socket
+        :raises OSError: If the connection to the Switch is lost
+        """
+
+        received_first_message = False
+        while True:
+            # Attempt to get output from Switch
+            reply = self.receive(itr)
+
+            if reply:
+                received_first_message = True
+
+            self.protocol.process_commands(reply)
+            msg = self.protocol.get_report()
+
+            if self.logger_level <= logging.DEBUG and reply:
+                self.logger.debug(format_msg_controller(msg))
+
+            try:
+                itr.sendall(msg)
+            except BlockingIOError:
+                continue
+
+            # Exit pairing loop when player lights have been set and
+            # vibration has been enabled
+            if (reply and len(reply) > 45 and
+                    self.protocol.vibration_enabled and self.protocol.player_number):
+                break
+
+            if not received_first_message:
+                self.wait_for_report(1)
+            else:
+                self.wait_for_report(1/15)
+
     def connection_reset_watchdog(self):
 
         connected_devices = []
@@ -345,7 +564,7 @@ class ControllerServer():
         # disconnect during a connection.
         while True:
             try:
-                self.state["state"] = "connecting"
+                self.set_state("connecting")
 
                 # Creating control and interrupt sockets
                 s_ctrl = socket.socket(
@@ -395,44 +614,9 @@ class ControllerServer():
                 # for sending and receiving, instead of blocking.
                 fcntl.fcntl(itr, fcntl.F_SETFL, os.O_NONBLOCK)
 
-                # Mainloop
-                received_first_message = False
-                while True:
-                    # Attempt to get output from Switch
-                    try:
-                        reply = itr.recv(50)
-                        if self.logger_level <= logging.DEBUG and len(reply) > 40:
-                            self.logger.debug(format_msg_switch(reply))
-                    except BlockingIOError:
-                        reply = None
-
-                    if reply:
-                        received_first_message = True
-
-                    self.protocol.process_commands(reply)
-                    msg = self.protocol.get_report()
-
-                    if self.logger_level <= logging.DEBUG and reply:
-                        self.logger.debug(format_msg_controller(msg))
-
-                    try:
-                        itr.sendall(msg)
-                    except BlockingIOError:
-                        continue
-
-                    # Exit pairing loop when player lights have been set and
-                    # vibration has been enabled
-                    if (reply and len(reply) > 45 and
-                            self.protocol.vibration_enabled and self.protocol.player_number):
-                        break
-
-                    # Switch responds to packets slower during pairing
-                    # Pairing cycle responds optimally on a 15Hz loop
-                    if not received_first_message:
-                        time.sleep(1)
-                    else:
-                        time.sleep(1/15)
-                
+                self.watch(itr)
+                self.pair(itr)
+
                 break
             except OSError as e:
                 self.logger.debug(e)
@@ -461,7 +645,7 @@ class ControllerServer():
 
             return itr, ctrl
 
-        self.state["state"] = "reconnecting"
+        self.set_state("reconnecting")
 
         itr = None
         ctrl = None
@@ -507,5 +691,69 @@ class ControllerServer():
 
         return itr, ctrl
 
+    def handle_message(self, message):
+        """Acts on a binary command message
+        (see nxbt.controller.messages).
+
+        :param message: The encoded message
+        :type message: bytes
+        """
+
+        sequence = decode_sequence(message)
+        if sequence == 0:
+            self.apply_message(message)
+            return
+
+        self.held_messages[sequence] = message
+        while self.next_sequence in self.held_messages:
+            self.apply_message(self.held_messages.pop(self.next_sequence))
+            self.next_sequence = next_sequence(self.next_sequence)
+
+    def apply_message(self, message):
+        """Applies a binary command message, regardless of its
+        sequence number.
+
+        :param message: The encoded message
+        :type message: bytes
+        """
+
+        message_type, _, macro_id, offset = decode_header(message)
+        if message_type == INPUT_MACRO:
+            self.input.buffer_compiled_macro(
+                decode_macro(message, offset), macro_id)
+            trace = decode_trace(message)
+            if trace:
+                self.latency.macro_received(macro_id, trace)
+        elif message_type == STOP_MACRO:
+            self.input.stop_macro(macro_id, state=self.state)
+        elif message_type == CLEAR_MACROS:
+            self.input.clear_macros()
+
+    def set_state(self, state):
+        """Sets the controller's state and publishes the change
+        to the event queue.
+
+        :param state: The new state (eg: "connecting", "connected")
+        :type state: str
+        """
+
+        self.state["state"] = state
+
+        if self.event_queue:
+            self.event_queue.put({
+                "type": "state",
+                "index": self.index,
+                "state": state,
+            })
+
+    def _on_macro_finished(self, macro_id):
+
+        if self.event_queue:
+            self.event_queue.put({
+                "type": "macro_finished",
+                "index": self.index,
+                "macro_id": macro_id,
+            })
+
     def _on_exit(self):
         self.bt.reset_address()
@@ -0,0 +1,415 @@
+"""
+A pure-software Nintendo Switch for exercising controllers without
+Bluetooth hardware.
+
+Controllers are served over a socket.socketpair(AF_UNIX, SOCK_SEQPACKET)
+in place of the L2CAP interrupt channel. The simulated Switch replays
+the pairing handshake and then measures report cadence, subcommand
+response latency and CPU use for each controller.
+"""
+
+import socket
+import select
+import queue
+import statistics as stat
+from multiprocessing import Process
+from threading import Thread
+from time import perf_counter
+
+import psutil
+
+from .controller import ControllerTypes
+from .server import ControllerServer
+from .input import InputParser
+from .messages import encode_message, INPUT_MACRO
+
+
+# The length of a subcommand report sent by the Switch
+REPORT_LENGTH = 50
+
+
+def pad_report(prefix):
+    """Pads a subcommand report with zeros to the full report length.
+
+    :param prefix: The non-zero start of the report
+    :type prefix: bytes
+    :return: The full report
+    :rtype: bytes
+    """
+
+    return prefix.ljust(REPORT_LENGTH, b'\x00')
+
+
+# Switch subcommand reports (as sent during pairing)
+REQUEST_INFO = pad_report(
+    b'\xA2\x01\x02\x00\x00\x00\x00\x00\x00\x00\x00\x02')
+SET_SHIPMENT = pad_report(
+    b'\xA2\x01\x07\x00\x00\x00\x00\x00\x00\x00\x00\x08')
+SERIAL_NUMBER = pad_report(
+    b'\xA2\x01\x08\x00\x00\x00\x00\x00\x00\x00\x00\x10\x00\x60\x00\x00\x10')
+COLOURS = pad_report(
+    b'\xA2\x01\x09\x00\x00\x00\x00\x00\x00\x00\x00\x10\x50\x60\x00\x00\x0D')
+INPUT_MODE = pad_report(
+    b'\xA2\x01\x0A\x00\x01\x40\x40\x00\x01\x40\x40\x03\x30')
+TRIGGER_BUTTONS = pad_report(
+    b'\xA2\x01\x0D\x00\x00\x00\x00\x00\x00\x00\x00\x04')
+FACTORY_PARAMS = pad_report(
+    b'\xA2\x01\x0F\x00\x00\x00\x00\x00\x00\x00\x00\x10\x80\x60\x00\x00\x18')
+FACTORY_PARAMS_2 = pad_report(
+    b'\xA2\x01\x01\x00\x00\x00\x00\x00\x00\x00\x00\x10\x98\x60\x00\x00\x12')
+USER_CAL = pad_report(
+    b'\xA2\x01\x02\x00\x00\x00\x00\x00\x00\x00\x00\x10\x10\x80\x00\x00\x18')
+FACTORY_CAL = pad_report(
+    b'\xA2\x01\x04\x00\x00\x00\x00\x00\x00\x00\x00\x10\x3D\x60\x00\x00\x19')
+SIX_AXIS_CAL = pad_report(
+    b'\xA2\x01\x05\x00\x00\x00\x00\x00\x00\x00\x00\x10\x20\x60\x00\x00\x18')
+ENABLE_IMU = pad_report(
+    b'\xA2\x01\x07\x00\x01\x40\x40\x00\x01\x40\x40\x40\x01')
+ENABLE_VIBRATION = pad_report(
+    b'\xA2\x01\x09\x00\x00\x00\x00\x00\x00\x00\x00\x48\x01')
+SET_NFC_IR = pad_report(
+    b'\xA2\x01\x0C\x00\x01\x40\x40\x00\x01\x40\x40\x21\x21')
+SET_PLAYER_LIGHTS = pad_report(
+    b'\xA2\x01\x0D\x00\x00\x00\x00\x00\x00\x00\x00\x30\x01')
+
+FLASH_PLAYER_LIGHTS = pad_report(
+    b'\xA2\x01\x0D\x00\x00\x00\x00\x00\x00\x00\x00\x30\x10')
+
+COMMANDS = [
+    REQUEST_INFO,
+    SET_SHIPMENT,
+    SERIAL_NUMBER,
+    COLOURS,
+    INPUT_MODE,
+    TRIGGER_BUTTONS,
+    FACTORY_PARAMS,
+    FACTORY_PARAMS_2,
+    USER_CAL,
+    FACTORY_CAL,
+    SIX_AXIS_CAL,
+    ENABLE_IMU,
+    ENABLE_VIBRATION,
+    SET_NFC_IR,
+]
+
+# A rumble-only output report, sent by the Switch between subcommands
+RUMBLE_ONLY = b'\xA2\x10\x00\x01\x40\x40\x00\x01\x40\x40'
+
+# Wiggles the left stick every tick so that a report is
+# sent every tick (unchanged reports are only sent once a second).
+DEFAULT_INPUT_MACRO = """
+LOOP 10000000
+    L_STICK@+100+000 0.0s
+    L_STICK@-100+000 0.0s
+"""
+
+# The macro ID of the simulated input
+SIMULATED_MACRO_ID = "simulated"
+
+
+class SimulatedBluetooth():
+    """Stands in for BlueZ on controllers served by the simulator.
+    """
+
+    def __init__(self, address="7C:BB:8A:00:00:01"):
+
+        self.address = address
+
+    def reset_address(self):
+
+        pass
+
+
+def serve_controller(controller_type, itr, input_macro=None,
+                     colour_body=None, colour_buttons=None):
+    """Serves a controller to a simulated Switch on a given socket.
+    This follows the same path as a Bluetooth connection: an empty
+    report prompts the Switch, the controller pairs and then runs
+    its mainloop until it's terminated.
+
+    :param controller_type: The type of controller to serve
+    :type controller_type: ControllerTypes
+    :param itr: The controller's end of the socket pair
+    :type itr: socket.socket
+    :param input_macro: A macro to input once connected,
+    defaults to None
+    :type input_macro: str, optional
+    :param colour_body: The body colour of the controller,
+    defaults to None
+    :type colour_body: list, optional
+    :param colour_buttons: The button colour of the controller,
+    defaults to None
+    :type colour_buttons: list, optional
+    """
+
+    server = ControllerServer(
+        controller_type, bluetooth=SimulatedBluetooth(),
+        task_queue=queue.Queue(), colour_body=colour_body,
+        colour_buttons=colour_buttons)
+
+    itr.setblocking(False)
+
+    if input_macro:
+        compiled = InputParser(None).compile_macro(input_macro)
+        server.handle_message(encode_message(
+            INPUT_MACRO, 0, SIMULATED_MACRO_ID, compiled))
+
+    # Send an empty input report to the Switch to prompt a reply
+    server.protocol.process_commands(None)
+    itr.sendall(server.protocol.get_report())
+
+    server.watch(itr)
+    server.pair(itr)
+    server.set_state("connected")
+    server.mainloop(itr, None)
+
+
+class SwitchSimulator():
+    """Plays the Switch's side of a controller connection.
+    """
+
+    def __init__(self, sock, timeout=2, clock=perf_counter):
+        """Initializes the simulator.
+
+        :param sock: The Switch's end of the socket pair
+        :type sock: socket.socket
+        :param timeout: The time in seconds to wait for a subcommand
+        reply, defaults to 2
+        :type timeout: float, optional
+        :param clock: A monotonic clock function returning seconds,
+        defaults to time.perf_counter
+        :type clock: function, optional
+        """
+
+        self.sock = sock
+        self.timeout = timeout
+        self.clock = clock
+
+        # Pairing handshake timings
+        self.handshake_time = None
+        self.handshake_latencies = []
+
+        # Steady state timings
+        self.report_times = []
+        self.subcommand_latencies = []
+
+    def receive(self, timeout):
+        """Receives a report from the controller.
+
+        :param timeout: The time in seconds to wait for a report
+        :type timeout: float
+        :raises ConnectionResetError: If the controller disconnects
+        :return: The report or None on timeout
+        :rtype: bytes or None
+        """
+
+        readable, _, _ = select.select([self.sock], [], [], max(timeout, 0))
+        if not readable:
+            return None
+
+        report = self.sock.recv(350)
+        if not report:
+            raise ConnectionResetError("The controller closed the connection")
+
+        return report
+
+    def send_subcommand(self, command):
+        """Sends a subcommand and waits for the controller to reply.
+
+        :param command: The subcommand report
+        :type command: bytes
+        :raises TimeoutError: If the controller doesn't reply in time
+        :return: The time taken for the reply in seconds
+        :rtype: float
+        """
+
+        sent = self.clock()
+        self.sock.sendall(command)
+
+        deadline = sent + self.timeout
+        while True:
+            report = self.receive(deadline - self.clock())
+            if report is None:
+                raise TimeoutError(
+                    f"No reply to subcommand 0x{command[11]:02X}")
+            if is_reply(report, command):
+                return self.clock() - sent
+
+    def handshake(self, commands=None):
+        """Replays the pairing handshake with the controller.
+
+        :param commands: The subcommands to send before the player
+        lights are set, defaults to COMMANDS
+        :type commands: list, optional
+        :raises TimeoutError: If the controller doesn't reply in time
+        :return: The total handshake time in seconds
+        :rtype: float
+        """
+
+        if commands is None:
+            commands = COMMANDS
+
+        start = self.clock()
+
+        # The controller prompts the Switch with an empty report
+        if self.receive(self.timeout) is None:
+            raise TimeoutError("No initial report from the controller")
+
+        self.handshake_latencies = []
+        for command in commands + [SET_PLAYER_LIGHTS]:
+            self.handshake_latencies.append(self.send_subcommand(command))
+
+        self.handshake_time = self.clock() - start
+        return self.handshake_time
+
+    def run(self, duration, rumble_rate=60, subcommand_interval=0.25,
+            subcommand=SET_PLAYER_LIGHTS):
+        """Exchanges reports with a connected controller for a given
+        duration, recording when reports arrive and how long
+        subcommands take to be answered.
+
+        :param duration: The time to run for in seconds
+        :type duration: float
+        :param rumble_rate: The rate in Hz that rumble-only reports
+        are sent at, defaults to 60
+        :type rumble_rate: int, optional
+        :param subcommand_interval: The time in seconds between
+        subcommands, defaults to 0.25
+        :type subcommand_interval: float, optional
+        :param subcommand: The subcommand to send,
+        defaults to SET_PLAYER_LIGHTS
+        :type subcommand: bytes, optional
+        """
+
+        clock = self.clock
+        rumble_period = 1 / rumble_rate
+        now = clock()
+        end = now + duration
+        next_rumble = now
+        next_subcommand = now + subcommand_interval
+        pending_since = None
+
+        while now < end:
+            if now >= next_rumble:
+                self.sock.sendall(RUMBLE_ONLY)
+                next_rumble += rumble_period
+            if now >= next_subcommand and pending_since is None:
+                self.sock.sendall(subcommand)
+                pending_since = clock()
+                next_subcommand += subcommand_interval
+
+            report = self.receive(min(next_rumble, next_subcommand, end) - now)
+            now = clock()
+            if report is None:
+                continue
+
+            self.report_times.append(now)
+            if pending_since is not None and is_reply(report, subcommand):
+                self.subcommand_latencies.append(now - pending_since)
+                pending_since = None
+
+    def results(self):
+        """Summarizes the timings recorded by the simulator.
+
+        :return: A dict of handshake, report cadence and subcommand
+        latency statistics (times in seconds)
+        :rtype: dict
+        """
+
+        intervals = [b - a for a, b in
+                     zip(self.report_times, self.report_times[1:])]
+        span = 0
+        if len(self.report_times) > 1:
+            span = self.report_times[-1] - self.report_times[0]
+
+        return {
+            "handshake_time": self.handshake_time,
+            "handshake_latency_max": max(self.handshake_latencies, default=0),
+            "reports": len(self.report_times),
+            "report_rate": len(intervals) / span if span else 0,
+            "report_interval_mean": stat.mean(intervals) if intervals else 0,
+            "report_interval_jitter": (
+                stat.pstdev(intervals) if intervals else 0),
+            "report_interval_max": max(intervals, default=0),
+            "subcommand_latency_mean": (
+                stat.mean(self.subcommand_latencies)
+                if self.subcommand_latencies else 0),
+            "subcommand_latency_max": max(
+                self.subcommand_latencies, default=0),
+        }
+
+
+def is_reply(report, command):
+    """Checks if a controller report is the reply to a subcommand.
+
+    :param report: The controller's report
+    :type report: bytes
+    :param command: The subcommand report sent by the Switch
+    :type command: bytes
+    :return: True if the report replies to the subcommand
+    :rtype: bool
+    """
+
+    return len(report) > 15 and report[1] == 0x21 and report[15] == command[11]
+
+
+def simulate(controller_type=ControllerTypes.PRO_CONTROLLER, count=1,
+             duration=5, input_macro=DEFAULT_INPUT_MACRO, **run_options):
+    """Pairs a number of controllers with simulated Switches and
+    exchanges reports with them for a given duration. Each controller
+    runs in its own process, as with Nxbt.
+
+    :param controller_type: The type of controller to simulate,
+    defaults to ControllerTypes.PRO_CONTROLLER
+    :type controller_type: ControllerTypes, optional
+    :param count: The number of controllers, defaults to 1
+    :type count: int, optional
+    :param duration: The time to run for after pairing in seconds,
+    defaults to 5
+    :type duration: float, optional
+    :param input_macro: A macro for the controllers to input,
+    defaults to DEFAULT_INPUT_MACRO
+    :type input_macro: str, optional
+    :return: The results of each controller (see
+    SwitchSimulator.results) with their CPU use as a percentage
+    of one core
+    :rtype: list of dict
+    """
+
+    controllers = []
+    try:
+        for _ in range(count):
+            switch_sock, controller_sock = socket.socketpair(
+                socket.AF_UNIX, socket.SOCK_SEQPACKET)
+            process = Process(
+                target=serve_controller,
+                args=(controller_type, controller_sock, input_macro),
+                daemon=True)
+            process.start()
+            controller_sock.close()
+            controllers.append((SwitchSimulator(switch_sock), process, {}))
+
+        def run_simulator(simulator, process, results):
+            simulator.handshake()
+            cpu = psutil.Process(process.pid)
+            cpu_start = sum(cpu.cpu_times()[:2])
+            start = perf_counter()
+            simulator.run(duration, **run_options)
+            elapsed = perf_counter() - start
+            cpu_used = sum(cpu.cpu_times()[:2]) - cpu_start
+
+            results.update(simulator.results())
+            results["cpu_percent"] = 100 * cpu_used / elapsed
+
+        threads = [Thread(target=run_simulator, args=controller)
+                   for controller in controllers]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        for simulator, process, _ in controllers:
+            process.terminate()
+            simulator.sock.close()
+
+    return [results for _, _, results in controllers]
@@ -0,0 +1,191 @@
+from .controller import ControllerTypes
+
+
+# Erased flash reads back as 0xFF
+SPI_FLASH_ERASED = 0xFF
+# The emulated sections of the SPI flash as (base address, size)
+SPI_FLASH_SECTIONS = (
+    # Factory configuration and calibration
+    (0x6000, 0x1000),
+    # User calibration
+    (0x8000, 0x1000),
+)
+# The most data that fits in an SPI read subcommand reply
+SPI_READ_MAX_LENGTH = 0x1D
+
+# Stick Parameters
+# Params are generally the same for all sticks
+# Notable difference is the deadzone (10% Joy-Con vs 15% Pro Con)
+STICK_PARAMETERS = (
+    0x0F, 0x30, 0x61,  # Unused
+    0x96, 0x30, 0xF3,  # Dead Zone/Range Ratio
+    0xD4, 0x14, 0x54,  # X/Y ?
+    0x41, 0x15, 0x54,  # X/Y ?
+    0xC7, 0x79, 0x9C,  # X/Y ?
+    0x33, 0x36, 0x63)  # X/Y ?
+JOYCON_DEAD_ZONE = 0xAE
+
+# Factory analog stick calibration
+LEFT_STICK_CALIBRATION = (
+    0xBA, 0xF5, 0x62,
+    0x6F, 0xC8, 0x77,
+    0xED, 0x95, 0x5B)
+RIGHT_STICK_CALIBRATION = (
+    0x16, 0xD8, 0x7D,
+    0xF2, 0xB5, 0x5F,
+    0x86, 0x65, 0x5E)
+
+# Six-Axis motion sensor factory calibration
+# 1: Acceleration origin position
+# 2: Acceleration sensitivity coefficient
+# 3: Gyro origin when still
+# 4: Gyro sensitivity coefficient
+SIX_AXIS_CALIBRATION = (
+    0xD3, 0xFF, 0xD5, 0xFF, 0x55, 0x01,  # 1
+    0x00, 0x40, 0x00, 0x40, 0x00, 0x40,  # 2
+    0x19, 0x00, 0xDD, 0xFF, 0xDC, 0xFF,  # 3
+    0x3B, 0x34, 0x3B, 0x34, 0x3B, 0x34)  # 4
+
+# Six-Axis horizontal offsets for each controller type
+SIX_AXIS_PARAMETERS = {
+    ControllerTypes.PRO_CONTROLLER: (0x50, 0xFD, 0x00, 0x00, 0xC6, 0x0F),
+    ControllerTypes.JOYCON_L: (0x5E, 0x01, 0x00, 0x00, 0xF1, 0x0F),
+    ControllerTypes.JOYCON_R: (0x5E, 0x01, 0x00, 0x00, 0x0F, 0xF0),
+}
+
+# SPI flash images, keyed by controller type and colours
+_spi_flash_cache = {}
+
+
+class SPIFlash():
+    """A read-only image of a controller's SPI flash.
+
+    Only the sections the Switch reads from are stored. Everything
+    else reads back as erased flash.
+    """
+
+    def __init__(self, sections):
+        """Initializes the flash image.
+
+        :param sections: A list of (base address, data) tuples
+        :type sections: list
+        """
+
+        self.sections = [(base, bytes(data)) for base, data in sections]
+
+    def read(self, address, length):
+        """Reads a range of the flash.
+
+        :param address: The address to start reading from
+        :type address: int
+        :param length: The number of bytes to read
+        :type length: int
+        :return: The read bytes
+        :rtype: bytes
+        """
+
+        for base, data in self.sections:
+            offset = address - base
+            if 0 <= offset and offset + length <= len(data):
+                return data[offset:offset + length]
+
+        # Reads outside of or across sections are assembled bytewise
+        return bytes(self.read_byte(a) for a in range(address, address + length))
+
+    def read_byte(self, address):
+        """Reads a single byte of the flash.
+
+        :param address: The address of the byte
+        :type address: int
+        :return: The byte's value
+        :rtype: int
+        """
+
+        for base, data in self.sections:
+            offset = address - base
+            if 0 <= offset < len(data):
+                return data[offset]
+
+        return SPI_FLASH_ERASED
+
+
+def get_spi_flash(controller_type, colour_body, colour_buttons):
+    """Gets the SPI flash image of a given controller type and colour.
+    Images are built once and shared between controllers.
+
+    :param controller_type: The type of controller
+    :type controller_type: ControllerTypes
+    :param colour_body: The body colour as a list of three ints
+    :type colour_body: list
+    :param colour_buttons: The button colour as a list of three ints
+    :type colour_buttons: list
+    :return: The SPI flash image
+    :rtype: SPIFlash
+    """
+
+    key = (controller_type, tuple(colour_body), tuple(colour_buttons))
+    flash = _spi_flash_cache.get(key)
+    if flash is None:
+        flash = build_spi_flash(controller_type, colour_body, colour_buttons)
+        _spi_flash_cache[key] = flash
+
+    return flash
+
+
+def build_spi_flash(controller_type, colour_body, colour_buttons):
+    """Builds the SPI flash image of a given controller type and colour.
+
+    :param controller_type: The type of controller
+    :type controller_type: ControllerTypes
+    :param colour_body: The body colour as a list of three ints
+    :type colour_body: list
+    :param colour_buttons: The button colour as a list of three ints
+    :type colour_buttons: list
+    :return: The SPI flash image
+    :rtype: SPIFlash
+    """
+
+    sections = {}
+    for base, size in SPI_FLASH_SECTIONS:
+        sections[base] = bytearray([SPI_FLASH_ERASED]) * size
+
+    def write(address, data):
+        for base, section in sections.items():
+            offset = address - base
+            if 0 <= offset < len(section):
+                section[offset:offset + len(data)] = bytes(data)
+                return
+
+    stick_parameters = list(STICK_PARAMETERS)
+    if not controller_type == ControllerTypes.PRO_CONTROLLER:
+        stick_parameters[3] = JOYCON_DEAD_ZONE
+
+    # The serial number (0x6000) is left erased,
+    # which the Switch takes as no serial number.
+
+    # Six-Axis motion sensor factory calibration
+    write(0x6020, SIX_AXIS_CALIBRATION)
+
+    # Factory analog stick calibration.
+    # Sticks a controller doesn't have are left erased.
+    if not controller_type == ControllerTypes.JOYCON_R:
+        write(0x603D, LEFT_STICK_CALIBRATION)
+    if not controller_type == ControllerTypes.JOYCON_L:
+        write(0x6046, RIGHT_STICK_CALIBRATION)
+
+    # Body and button colours. The left/right grip
+    # colours (Pro Controller) that follow are left erased.
+    write(0x6050, colour_body)
+    write(0x6053, colour_buttons)
+
+    # Factory sensor/stick device parameters
+    write(0x6080, SIX_AXIS_PARAMETERS[controller_type])
+    write(0x6086, stick_parameters)
+    # Controllers always have duplicates of stick
+    # params 1 for stick params 2
+    write(0x6098, stick_parameters)
+
+    # User analog stick and Six-Axis calibration (0x8010)
+    # is left erased, meaning no user calibration.
+
+    return SPIFlash(sections.items())
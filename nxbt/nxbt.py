@@ -1,17 +1,28 @@
 from multiprocessing import Process, Lock, Queue, Manager
+from concurrent.futures import Future
+import threading
 import queue
 from enum import Enum
 import atexit
 import signal
 import os
 import sys
+import socket
 import time
 import json
+import itertools
 
 import dbus
 
 from .controller import ControllerServer
 from .controller import ControllerTypes
+from .controller.engine import ControllerEngine
+from .controller.input import DirectInput, encode_direct_input
+from .controller.input import FinishedMacros, FINISHED_MACRO_RETENTION
+from .controller.input import InputParser
+from .controller import messages
+from .controller.channel import DirectInputChannel, shared_memory_available
+from .controller.metrics import empty_metrics
 from .bluez import BlueZ, find_objects, toggle_clean_bluez
 from .bluez import replace_mac_addresses
 from .bluez import find_devices_by_alias
@@ -110,6 +121,54 @@ class Sticks():
     LEFT_STICK = "L_STICK"
 
 
+def _button_press_macro(buttons, down, up):
+    """Creates a macro that presses and releases a set of buttons.
+
+    :param buttons: A list of nxbt.Buttons
+    :type buttons: list
+    :param down: How long to hold the buttons down for in seconds
+    :type down: float
+    :param up: How long to release the buttons for in seconds
+    :type up: float
+    :return: The macro
+    :rtype: str
+    """
+
+    macro_buttons = " ".join(buttons)
+    macro_times = f"{down}s \n{up}s"
+    return macro_buttons + " " + macro_times
+
+
+def _stick_tilt_macro(stick, x, y, tilted, released):
+    """Creates a macro that tilts and releases a stick.
+
+    :param stick: The right or left nxbt.Stick
+    :type stick: nxbt.Stick
+    :param x: The X-Axis of the stick on a -100 to 100 scale
+    :type x: int
+    :param y: The Y-Axis of the stick on a -100 to 100 scale
+    :type y: int
+    :param tilted: How long the stick remains tilted in seconds
+    :type tilted: float
+    :param released: How long the stick remains released in seconds
+    :type released: float
+    :return: The macro
+    :rtype: str
+    """
+
+    if x >= 0:
+        x_parsed = f'+{x:03}'
+    else:
+        x_parsed = f'{x:04}'
+
+    if y >= 0:
+        y_parsed = f'+{y:03}'
+    else:
+        y_parsed = f'{y:04}'
+
+    return f'{stick}@{x_parsed}{y_parsed} {tilted}s\n{released}s'
+
+
 class NxbtCommands(Enum):
     """An enumeration containing the nxbt message
     commands.
@@ -137,7 +196,9 @@ class Nxbt():
     This allows for thread-safe control of emulated controllers.
     """
 
-    def __init__(self, debug=False, log_to_file=False, disable_logging=False):
+    def __init__(self, debug=False, log_to_file=False, disable_logging=False,
+                 macro_retention=FINISHED_MACRO_RETENTION, single_process=False,
+                 trace_latency=False):
         """Initializes the necessary multiprocessing resources and starts
         the multiprocessing processes.
 
@@ -149,8 +210,26 @@ class Nxbt():
         :type log_to_file: bool, optional
         :param disable_logging: Routes all logging calls to a null log handler.
         :type disable_logging: bool, optional, defaults to False.
+        :param macro_retention: The number of finished macro IDs kept
+        for each controller, defaults to FINISHED_MACRO_RETENTION
+        :type macro_retention: int, optional
+        :param single_process: Runs all controllers on a single thread
+        in the manager process rather than spawning a process for each
+        controller, defaults to False
+        :type single_process: bool, optional
+        :param trace_latency: Traces direct input and macros through to
+        the reports that carry them to the Switch. The latency of each
+        stage is published under each controller's metrics,
+        defaults to False
+        :type trace_latency: bool, optional
+        :raises ValueError: If the macro retention is less than 1
         """
 
+        # Checked up front, since finished macro records are
+        # only created once a controller finishes a macro.
+        if macro_retention is not None and macro_retention < 1:
+            raise ValueError("Finished macro retention must be at least 1")
+
         self.debug = debug
         self.logger = create_logger(
             debug=self.debug, log_to_file=log_to_file, disable_logging=disable_logging)
@@ -158,6 +237,29 @@ class Nxbt():
         # Main queue for nbxt tasks
         self.task_queue = Queue()
 
+        # Queue for events published by the controllers,
+        # such as macro completions.
+        self.event_queue = Queue()
+        # Futures for blocking/waiting callers, keyed by macro ID
+        self._macro_futures = {}
+        self._macro_futures_lock = threading.Lock()
+        # Recently finished macros for each controller
+        self.macro_retention = macro_retention
+        self._finished_macros = {}
+        self.single_process = single_process
+        # Latency trace IDs. Zero marks untraced input.
+        self.trace_latency = trace_latency
+        self._trace_ids = itertools.count(1)
+        # The last sequence number of the messages sent to each
+        # controller (see messages.encode_message)
+        self._sequences = {}
+        self._sequences_lock = threading.Lock()
+        # The last state reported by each controller and futures
+        # waiting for controllers to reach given states.
+        self._controller_states = {}
+        self._state_waiters = []
+        self._state_lock = threading.Lock()
+
         # Sychronizes bluetooth actions
         self._bluetooth_lock = Lock()
 
@@ -175,6 +277,20 @@ class Nxbt():
         self._controller_counter = 0
         self._adapters_in_use = {}
         self._controller_adapter_lookup = {}
+        # Shared memory direct input channels for each controller
+        self._input_channels = {}
+        # The abstract socket addresses controllers receive
+        # command messages on. Also serves as a local lookup
+        # of the controllers created by this instance.
+        self._command_addresses = {}
+        self._command_socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        # Controllers don't read their command socket while connecting,
+        # so a full socket raises (and the message is relayed) rather
+        # than blocking the caller.
+        self._command_socket.setblocking(False)
+        # Macros are compiled before submission so that
+        # controllers only have to play them back.
+        self._macro_compiler = InputParser(None)
 
         # Disable the BlueZ input plugin so we can use the
         # HID control/interrupt Bluetooth ports
@@ -186,13 +302,18 @@ class Nxbt():
         # Starting the nxbt worker process
         self.controllers = Process(
             target=self._command_manager,
-            args=((self.task_queue), (self.manager_state)))
+            args=((self.task_queue), (self.manager_state), (self.event_queue)))
         # Disabling daemonization since we need to spawn
         # other controller processes, however, this means
         # we need to cleanup on exit.
         self.controllers.daemon = False
         self.controllers.start()
 
+        # Listens for controller events and wakes any waiting callers
+        self._event_listener = threading.Thread(
+            target=self._listen_for_events, daemon=True)
+        self._event_listener.start()
+
     def _on_exit(self):
         """The exit handler function used with the atexit module.
         This function attempts to gracefully exit by terminating
@@ -205,38 +326,161 @@ class Nxbt():
         if hasattr(self, "controllers") and self.controllers.is_alive():
             self.controllers.terminate()
 
+        # Stop the event listener
+        self.event_queue.put(None)
+
         self.resource_manager.shutdown()
 
+        for channel in self._input_channels.values():
+            channel.close()
+        self._input_channels = {}
+        self._command_socket.close()
+
         # Re-enable the BlueZ plugins, if we have permission
         toggle_clean_bluez(False)
 
-    def _command_manager(self, task_queue, state):
+    def _listen_for_events(self):
+        """Consumes events published by the controllers and resolves
+        any futures waiting on them. Runs as a daemon thread in the
+        process that created the Nxbt object.
+        """
+
+        while True:
+            event = self.event_queue.get()
+            if event is None:
+                break
+
+            if event["type"] == "macro_finished":
+                with self._macro_futures_lock:
+                    finished = self._finished_macros.get(event["index"])
+                    if finished is None:
+                        finished = FinishedMacros(self.macro_retention)
+                        self._finished_macros[event["index"]] = finished
+                    finished.add(event["macro_id"])
+                    future = self._macro_futures.pop(event["macro_id"], None)
+                if future and not future.done():
+                    future.set_result(event["macro_id"])
+
+            elif event["type"] == "state":
+                self._update_controller_state(event["index"], event["state"])
+
+    def _update_controller_state(self, controller_index, state):
+        """Records a controller's new state and resolves any
+        futures waiting for it.
+
+        :param controller_index: The index of the controller
+        :type controller_index: int
+        :param state: The controller's new state
+        :type state: str
+        """
+
+        with self._state_lock:
+            self._controller_states[controller_index] = state
+            resolved = []
+            waiting = []
+            for waiter in self._state_waiters:
+                if waiter[0] == controller_index and state in waiter[1]:
+                    resolved.append(waiter[2])
+                else:
+                    waiting.append(waiter)
+            self._state_waiters = waiting
+
+        for future in resolved:
+            if not future.done():
+                future.set_result(state)
+
+    def _state_future(self, controller_index, states):
+        """Creates a future that resolves once a given controller
+        reports one of the given states.
+
+        :param controller_index: The index of the controller
+        :type controller_index: int
+        :param states: The states to wait for
+        :type states: tuple
+        :return: A future resolving to the reached state
+        :rtype: concurrent.futures.Future
+        """
+
+        future = Future()
+        with self._state_lock:
+            state = self._controller_states.get(controller_index)
+            if state in states:
+                future.set_result(state)
+            else:
+                self._state_waiters.append((controller_index, states, future))
+
+        return future
+
+    def _macro_future(self, macro_id):
+        """Gets or creates the future that resolves when a
+        given macro finishes.
+
+        :param macro_id: The ID of the macro
+        :type macro_id: str
+        :return: The macro's future
+        :rtype: concurrent.futures.Future
+        """
+
+        with self._macro_futures_lock:
+            future = self._macro_futures.get(macro_id)
+            if future is None:
+                future = Future()
+                self._macro_futures[macro_id] = future
+
+        return future
+
+    def macro_finished(self, controller_index, macro_id):
+        """Checks if a given macro has finished (or was stopped).
+        Only the most recent macros of each controller are
+        remembered, as set by the macro_retention option.
+
+        :param controller_index: The index of a given controller
+        :type controller_index: int
+        :param macro_id: The ID of a given macro
+        :type macro_id: str
+        :return: True if the macro recently finished
+        :rtype: bool
+        """
+
+        with self._macro_futures_lock:
+            finished = self._finished_macros.get(controller_index)
+            return finished is not None and macro_id in finished
+
+    def _command_manager(self, task_queue, state, event_queue):
         """Used as the main multiprocessing Process that is launched
         on startup to handle the message passing and instantiation of
         the controllers. Messages are pulled out of a Queue and passed
         as appropriately phrased function calls to the ControllerManager.
 
+        Controller creation and removal are dict messages. Binary
+        command messages (see nxbt.controller.messages) are relayed
+        as-is to the controller they're addressed to.
+
         :param task_queue: A multiprocessing Queue used as the source
         of messages
         :type task_queue: multiprocessing.Queue
         :param state: A dict used to store the shared state of the
         emulated controllers.
         :type state: multiprocessing.Manager().dict
+        :param event_queue: A multiprocessing Queue that controllers
+        publish events to
+        :type event_queue: multiprocessing.Queue
         """
 
-        cm = _ControllerManager(state, self._bluetooth_lock)
+        cm = _ControllerManager(
+            state, self._bluetooth_lock, event_queue, self.macro_retention,
+            self.single_process)
         # Ensure a SystemExit exception is raised on SIGTERM
         # so that we can gracefully shutdown.
         signal.signal(signal.SIGTERM, lambda sigterm_handler: sys.exit(0))
 
         try:
             while True:
-                try:
-                    msg = task_queue.get(timeout=5)
-                except queue.Empty:
-                    msg = None
+                msg = task_queue.get()
 
-                if msg:
+                if type(msg) is bytes:
+                    cm.relay_message(msg)
+                elif msg:
                     if msg["command"] == NxbtCommands.CREATE_CONTROLLER:
                         cm.create_controller(
                             msg["arguments"]["controller_index"],
@@ -244,19 +488,9 @@ class Nxbt():
                             msg["arguments"]["adapter_path"],
                             msg["arguments"]["colour_body"],
                             msg["arguments"]["colour_buttons"],
-                            msg["arguments"]["reconnect_address"])
-                    elif msg["command"] == NxbtCommands.INPUT_MACRO:
-                        cm.input_macro(
-                            msg["arguments"]["controller_index"],
-                            msg["arguments"]["macro"],
-                            msg["arguments"]["macro_id"])
-                    elif msg["command"] == NxbtCommands.STOP_MACRO:
-                        cm.stop_macro(
-                            msg["arguments"]["controller_index"],
-                            msg["arguments"]["macro_id"])
-                    elif msg["command"] == NxbtCommands.CLEAR_MACROS:
-                        cm.clear_macros(
-                            msg["arguments"]["controller_index"])
+                            msg["arguments"]["reconnect_address"],
+                            msg["arguments"]["input_channel"],
+                            msg["arguments"]["command_address"])
                     elif msg["command"] == NxbtCommands.REMOVE_CONTROLLER:
                         index = msg["arguments"]["controller_index"]
                         cm.clear_macros(index)
@@ -272,9 +506,8 @@ class Nxbt():
         message into the task queue with the given macro.
 
         If block is set to True, this function waits until the
-        macro_id (generated on the submission of the macro)
-        shows up under the "finished_macros" list communicated
-        under the controllers shared state.
+        controller reports the macro_id (generated on the submission
+        of the macro) as finished.
 
         :param controller_index: The index of a given controller
         :type controller_index: int
@@ -291,32 +524,110 @@ class Nxbt():
         :rtype: str
         """
 
-        if controller_index not in self.manager_state.keys():
-            raise ValueError("Specified controller does not exist")
+        if block:
+            return self.submit_macro(controller_index, macro).result()
+
+        return self._submit_macro(controller_index, macro)
+
+    def submit_macro(self, controller_index, macro, macro_id=None):
+        """Inputs a given macro on a specified controller without
+        blocking. The returned future resolves with the macro's ID as
+        soon as the controller finishes (or stops) the macro.
+
+        The future can be waited on with future.result(timeout) or
+        awaited in asyncio code with asyncio.wrap_future(future).
+
+        :param controller_index: The index of a given controller
+        :type controller_index: int
+        :param macro: The series of button presses and timings
+        to be passed to the controller
+        :type macro: string
+        :param macro_id: A unique ID to submit the macro under, for
+        callers that need the ID before the macro finishes. If not
+        specified, an ID is generated, defaults to None
+        :type macro_id: str, optional
+        :raises ValueError: If the controller_index does not exist
+        :return: A future resolving to the macro's ID
+        :rtype: concurrent.futures.Future
+        """
 
         # Get a unique ID to identify the macro
         # so we can check when the controller is done inputting it
-        macro_id = os.urandom(24).hex()
-        self.task_queue.put({
-            "command": NxbtCommands.INPUT_MACRO,
-            "arguments": {
-                "controller_index": controller_index,
-                "macro": macro,
-                "macro_id": macro_id,
-            }
-        })
+        if macro_id is None:
+            macro_id = os.urandom(24).hex()
+        # Register the future before submitting so that
+        # the completion can't be missed.
+        future = self._macro_future(macro_id)
+        try:
+            self._submit_macro(controller_index, macro, macro_id)
+        except Exception:
+            with self._macro_futures_lock:
+                self._macro_futures.pop(macro_id, None)
+            raise
 
-        if block:
-            while True:
-                finished = (self.manager_state
-                            [controller_index]["finished_macros"])
-                if macro_id in finished:
-                    break
+        return future
+
+    def _submit_macro(self, controller_index, macro, macro_id=None):
+
+        if controller_index not in self._command_addresses:
+            raise ValueError("Specified controller does not exist")
+
+        if macro_id is None:
+            macro_id = os.urandom(24).hex()
+
+        # Macros too short to hold any input are submitted empty
+        compiled = []
+        if len(macro) >= 4:
+            compiled = self._macro_compiler.compile_macro(macro)
 
-                time.sleep(1/120)  # Wait one Pro Controller cycle
+        trace = None
+        if self.trace_latency:
+            trace = (self._next_trace_id(), time.perf_counter())
+
+        self._send_message(controller_index, messages.encode_message(
+            messages.INPUT_MACRO, controller_index, macro_id, compiled,
+            trace=trace, sequence=self._next_sequence(controller_index)))
 
         return macro_id
 
+    def _next_trace_id(self):
+
+        # Trace IDs wrap within 32 bits, skipping zero
+        return next(self._trace_ids) % 0xFFFFFFFF + 1
+
+    def _next_sequence(self, controller_index):
+
+        with self._sequences_lock:
+            sequence = messages.next_sequence(
+                self._sequences.get(controller_index, 0))
+            self._sequences[controller_index] = sequence
+
+        return sequence
+
+    def _send_message(self, controller_index, message):
+        """Sends a binary command message to a controller. Messages
+        are sent straight to the controller's command socket where
+        possible, otherwise they're relayed through the task queue
+        (eg: while the controller is still starting up or if the
+        message is too large for a single datagram). Sequenced messages
+        are put back in order by the controller.
+
+        :param controller_index: The index of the controller
+        :type controller_index: int
+        :param message: The encoded message
+        :type message: bytes
+        """
+
+        address = self._command_addresses.get(controller_index)
+        if address and len(message) <= messages.MAX_DIRECT_MESSAGE_SIZE:
+            try:
+                self._command_socket.sendto(message, "\0" + address)
+                return
+            except OSError:
+                pass
+
+        self.task_queue.put(message)
+
     def press_buttons(self, controller_index, buttons, down=0.1, up=0.1, block=True):
         """Used to press a given set of buttons on the controller for a
         specified up and down duration. This is done by inputting a macro
@@ -341,9 +652,7 @@ class Nxbt():
         :rtype: str
         """
 
-        macro_buttons = " ".join(buttons)
-        macro_times = f"{down}s \n{up}s"
-        macro = macro_buttons + " " + macro_times
+        macro = _button_press_macro(buttons, down, up)
 
         macro_id = self.macro(controller_index, macro, block=block)
 
@@ -379,20 +688,10 @@ class Nxbt():
         :rtype: str
         """
 
-        if controller_index not in self.manager_state.keys():
+        if controller_index not in self._command_addresses:
             raise ValueError("Specified controller does not exist")
 
-        if x >= 0:
-            x_parsed = f'+{x:03}'
-        else:
-            x_parsed = f'{x:04}'
-
-        if y >= 0:
-            y_parsed = f'+{y:03}'
-        else:
-            y_parsed = f'{y:04}'
-
-        macro = f'{stick}@{x_parsed}{y_parsed} {tilted}s\n{released}s'
+        macro = _stick_tilt_macro(stick, x, y, tilted, released)
 
         macro_id = self.macro(controller_index, macro, block=block)
 
@@ -414,25 +713,35 @@ class Nxbt():
         :raises ValueError: If the controller_index does not exist
         """
 
-        if controller_index not in self.manager_state.keys():
+        future = self.submit_stop_macro(controller_index, macro_id)
+
+        if block:
+            future.result()
+
+    def submit_stop_macro(self, controller_index, macro_id):
+        """Stops a given macro by its macro ID without blocking.
+        The returned future resolves with the macro's ID once the
+        controller has stopped the macro.
+
+        :param controller_index: The index of a given controller
+        :type controller_index: int
+        :param macro_id: The ID of a given macro (queued or running)
+        :type macro_id: str
+        :raises ValueError: If the controller_index does not exist
+        :return: A future resolving to the macro's ID
+        :rtype: concurrent.futures.Future
+        """
+
+        if controller_index not in self._command_addresses:
             raise ValueError("Specified controller does not exist")
 
-        self.task_queue.put({
-            "command": NxbtCommands.STOP_MACRO,
-            "arguments": {
-                "controller_index": controller_index,
-                "macro_id": macro_id,
-            }
-        })
+        future = self._macro_future(macro_id)
 
-        if block:
-            while True:
-                finished = (self.manager_state
-                            [controller_index]["finished_macros"])
-                if macro_id in finished:
-                    break
+        self._send_message(controller_index, messages.encode_message(
+            messages.STOP_MACRO, controller_index, macro_id,
+            sequence=self._next_sequence(controller_index)))
 
-                time.sleep(1/120)
+        return future
 
     def clear_macros(self, controller_index):
         """Clears all running and queued macros on a specified
@@ -446,25 +755,23 @@ class Nxbt():
         :raises ValueError: If the controller_index does not exist
         """
 
-        if controller_index not in self.manager_state.keys():
+        if controller_index not in self._command_addresses:
             raise ValueError("Specified controller does not exist")
 
-        self.task_queue.put({
-            "command": NxbtCommands.CLEAR_MACROS,
-            "arguments": {
-                "controller_index": controller_index,
-            }
-        })
+        self._send_message(controller_index, messages.encode_message(
+            messages.CLEAR_MACROS, controller_index,
+            sequence=self._next_sequence(controller_index)))
 
     def clear_all_macros(self):
         """Clears all running and queued macros on all
         controllers.
         """
 
-        for controller in self.manager_state.keys():
+        for controller in list(self._command_addresses.keys()):
             self.clear_macros(controller)
 
-    def set_controller_input(self, controller_index, input_packet):
+    def set_controller_input(self, controller_index, input_packet,
+                             origin_time=None):
         """Sets the controllers buttons and analog sticks for 1 cycle.
         This means that exactly 1 packet will be sent to the Switch with
         input specified with this method. To keep a continuous input
@@ -475,15 +782,38 @@ class Nxbt():
         :param controller_index: The index of the emulated controller
         :type controller_index: int
         :param input_packet: The input packet with the desired input. This
-        *must* be an instance of the create_input_packet method.
-        :type input_packet: dict
+        *must* be an instance of the create_input_packet method or an
+        already encoded DirectInput.
+        :type input_packet: dict or DirectInput
+        :param origin_time: When the input originated (eg: was received
+        from a client), as a time.perf_counter time. Only used when
+        tracing latency. Defaults to the time of this call.
+        :type origin_time: float, optional
         :raises ValueError: On bad controller index
         """
 
-        if controller_index not in self.manager_state.keys():
-            raise ValueError("Specified controller does not exist")
-
-        self.manager_state[controller_index]["direct_input"] = input_packet
+        # Write directly to the controller's shared memory if available
+        channel = self._input_channels.get(controller_index)
+        if channel:
+            if type(input_packet) != DirectInput:
+                input_packet = encode_direct_input(input_packet)
+            trace = None
+            if self.trace_latency:
+                now = time.perf_counter()
+                trace = (self._next_trace_id(), origin_time or now, now)
+            channel.write(input_packet, trace)
+            return
+
+        # Controllers are only registered in the state once started
+        controller_state = None
+        if controller_index in self._command_addresses:
+            controller_state = self.manager_state.get(controller_index)
+        if controller_state is None:
+            raise ValueError(
+                f"Controller {controller_index} does not exist "
+                "or hasn't started yet")
+
+        controller_state["direct_input"] = input_packet
 
     def create_input_packet(self):
         """Creates an input packet that is used to specify the input
@@ -534,6 +864,38 @@ class Nxbt():
         :return: The index of the created controller
         :rtype: int
         """
+        adapter_path = self._select_adapter(adapter_path)
+
+        controller_index = None
+        try:
+            self._controller_lock.acquire()
+            controller_index, ready = self._request_controller(
+                controller_type, adapter_path, colour_body,
+                colour_buttons, reconnect_address)
+
+            # Block until the controller is ready
+            # This needs to be done to prevent race conditions
+            # on Bluetooth resources.
+            ready.result()
+        finally:
+            self._controller_lock.release()
+
+        return controller_index
+
+    def _select_adapter(self, adapter_path=None):
+        """Validates a requested Bluetooth adapter or picks the
+        first available one.
+
+        :param adapter_path: The DBus path to a given Bluetooth
+        adapter, defaults to None
+        :type adapter_path: str, optional
+        :raises ValueError: If specified adapter is unavailable
+        :raises ValueError: If specified adapter is in use
+        :raises ValueError: If no adapters are available
+        :return: The adapter path
+        :rtype: str
+        """
+
         if adapter_path:
             if adapter_path not in self.get_available_adapters():
                 raise ValueError("Specified adapter is unavailable")
@@ -550,42 +912,51 @@ class Nxbt():
             else:
                 raise ValueError("No adapters available")
 
-        controller_index = None
-        try:
-            self._controller_lock.acquire()
-            self.task_queue.put({
-                "command": NxbtCommands.CREATE_CONTROLLER,
-                "arguments": {
-                    "controller_index": self._controller_counter,
-                    "controller_type": controller_type,
-                    "adapter_path": adapter_path,
-                    "colour_body": colour_body,
-                    "colour_buttons": colour_buttons,
-                    "reconnect_address": reconnect_address,
-                }
-            })
-            controller_index = self._controller_counter
-            self._controller_counter += 1
-            self._adapters_in_use[adapter_path] = controller_index
-            self._controller_adapter_lookup[controller_index] = adapter_path
+        return adapter_path
 
-            # Block until the controller is ready
-            # This needs to be done to prevent race conditions
-            # on Bluetooth resources.
-            if type(controller_index) == int:
-                while True:
-                    if controller_index in self.manager_state.keys():
-                        state = self.manager_state[controller_index]
-                        if (state["state"] == "connecting" or
-                                state["state"] == "reconnecting" or
-                                state["state"] == "crashed"):
-                            break
-
-                    time.sleep(1/30)
-        finally:
-            self._controller_lock.release()
+    def _request_controller(self, controller_type, adapter_path,
+                            colour_body, colour_buttons, reconnect_address):
+        """Submits the creation of a controller. This must be called
+        with the controller lock held.
 
-        return controller_index
+        :return: The index of the controller and a future that resolves
+        once the controller is connecting, reconnecting or has crashed
+        :rtype: tuple
+        """
+
+        # Direct input is passed through shared memory where possible
+        # to avoid a Manager round trip on every input.
+        input_channel = None
+        if shared_memory_available():
+            input_channel = DirectInputChannel.create()
+
+        command_address = "nxbt_cmd_" + os.urandom(8).hex()
+
+        controller_index = self._controller_counter
+        ready = self._state_future(
+            controller_index, ("connecting", "reconnecting", "crashed"))
+
+        self.task_queue.put({
+            "command": NxbtCommands.CREATE_CONTROLLER,
+            "arguments": {
+                "controller_index": controller_index,
+                "controller_type": controller_type,
+                "adapter_path": adapter_path,
+                "colour_body": colour_body,
+                "colour_buttons": colour_buttons,
+                "reconnect_address": reconnect_address,
+                "input_channel": input_channel.name if input_channel else None,
+                "command_address": command_address,
+            }
+        })
+        if input_channel:
+            self._input_channels[controller_index] = input_channel
+        self._command_addresses[controller_index] = command_address
+        self._controller_counter += 1
+        self._adapters_in_use[adapter_path] = controller_index
+        self._controller_adapter_lookup[controller_index] = adapter_path
+
+        return controller_index, ready
 
     def remove_controller(self, controller_index):
         """Terminates and removes a given controller.
@@ -609,9 +980,20 @@ class Nxbt():
         try:
             adapter_path = self._controller_adapter_lookup.pop(controller_index, None)
             self._adapters_in_use.pop(adapter_path, None)
+            channel = self._input_channels.pop(controller_index, None)
+            if channel:
+                channel.close()
+            self._command_addresses.pop(controller_index, None)
+            with self._sequences_lock:
+                self._sequences.pop(controller_index, None)
         finally:
             self._controller_lock.release()
 
+        with self._macro_futures_lock:
+            self._finished_macros.pop(controller_index, None)
+        with self._state_lock:
+            self._controller_states.pop(controller_index, None)
+
         self.task_queue.put({
             "command": NxbtCommands.REMOVE_CONTROLLER,
             "arguments": {
@@ -625,13 +1007,30 @@ class Nxbt():
 
         :param controller_index: The index of a given controller
         :type controller_index: int
+        :raises ValueError: If the controller_index does not exist
+        :raises OSError: If the controller crashes
         """
 
-        while not self.state[controller_index]["state"] == "connected":
-            if self.state[controller_index]["state"] == "crashed":
-                raise OSError("The watched controller has crashe with error",
-                              self.state[controller_index]["errors"])
-            pass
+        state = self.submit_wait_for_connection(controller_index).result()
+        if state == "crashed":
+            raise OSError("The watched controller has crashed with error",
+                          self.state[controller_index]["errors"])
+
+    def submit_wait_for_connection(self, controller_index):
+        """Creates a future that resolves once a given controller
+        is connected to a Nintendo Switch or has crashed.
+
+        :param controller_index: The index of a given controller
+        :type controller_index: int
+        :raises ValueError: If the controller_index does not exist
+        :return: A future resolving to "connected" or "crashed"
+        :rtype: concurrent.futures.Future
+        """
+
+        if controller_index not in self._command_addresses:
+            raise ValueError("Specified controller does not exist")
+
+        return self._state_future(controller_index, ("connected", "crashed"))
 
     def get_available_adapters(self):
         """Gets the DBus paths of all available Bluetooth
@@ -673,12 +1072,26 @@ class Nxbt():
                         "connected" or
                         "crashed"
                     "finished_macros":
-                        A list of UUIDs
+                        A list of the most recently finished
+                        macro UUIDs (see Nxbt.macro_finished)
                     "errors":
                         A string with the crash error
                     "direct_input":
                         A dictionary that represents all inputs
                         being directly input into the controller.
+                        Where shared memory is available, direct input
+                        bypasses this dict and it stays idle.
+                    "metrics":
+                        A dict of runtime metrics, updated about
+                        once a second: tick rate, a tick interval
+                        histogram, overruns, scheduler jitter, reports
+                        and bytes sent/received, blocking send and
+                        connection error counts, reconnects and the
+                        macro queue depth (see ControllerMetrics).
+                        With trace_latency set, "latency" holds
+                        histograms of each input and macro stage
+                        (see LatencyTracer). Direct input is only
+                        traced over shared memory.
                 }
         }
 
@@ -692,24 +1105,35 @@ class Nxbt():
 class _ControllerManager():
     """Used as the manager for all controllers. Each controller is
     a daemon multiprocessing Process that the ControllerManager
-    object creates and manages.
+    object creates and manages. Alternatively, all controllers can
+    be run on a single thread by a ControllerEngine.
 
     The ControllerManager object submits messages to the respective
     queues of each controller process for tasks such as macro submission
     or macro clearing/stopping.
     """
 
-    def __init__(self, state, lock):
+    def __init__(self, state, lock, event_queue=None,
+                 macro_retention=FINISHED_MACRO_RETENTION,
+                 single_process=False):
 
         self.state = state
         self.lock = lock
+        self.event_queue = event_queue
+        self.macro_retention = macro_retention
         self.controller_resources = Manager()
         self._controller_queues = {}
         self._children = {}
 
+        self.engine = None
+        if single_process:
+            self.engine = ControllerEngine()
+            self.engine.start()
+
     def create_controller(self, index, controller_type, adapter_path,
                           colour_body=None, colour_buttons=None,
-                          reconnect_address=None):
+                          reconnect_address=None, input_channel=None,
+                          command_address=None):
         """Instantiates a given controller as a multiprocessing
         Process with a shared state dict and a task queue.
 
@@ -731,9 +1155,18 @@ class _ControllerManager():
         :param reconnect_address: The address of a Nintendo Switch
         to reconnect to, defaults to None
         :type reconnect_address: str, optional
+        :param input_channel: The name of a shared memory direct input
+        channel, defaults to None
+        :type input_channel: str, optional
+        :param command_address: The abstract socket address the
+        controller receives command messages on, defaults to None
+        :type command_address: str, optional
         """
 
-        controller_queue = Queue()
+        if self.engine:
+            controller_queue = queue.Queue()
+        else:
+            controller_queue = Queue()
 
         controller_state = self.controller_resources.dict()
         controller_state["state"] = "initializing"
@@ -745,54 +1178,65 @@ class _ControllerManager():
         controller_state["type"] = str(controller_type)
         controller_state["adapter_path"] = adapter_path
         controller_state["last_connection"] = None
+        controller_state["metrics"] = empty_metrics()
 
         self._controller_queues[index] = controller_queue
 
-        self.state[index] = controller_state
-
         server = ControllerServer(controller_type,
                                   adapter_path=adapter_path,
                                   lock=self.lock,
                                   state=controller_state,
                                   task_queue=controller_queue,
                                   colour_body=colour_body,
-                                  colour_buttons=colour_buttons)
-        controller = Process(target=server.run, args=(reconnect_address,))
-        controller.daemon = True
-        self._children[index] = controller
-        controller.start()
-
-    def input_macro(self, index, macro, macro_id):
-
-        self._controller_queues[index].put({
-            "type": "macro",
-            "macro": macro,
-            "macro_id": macro_id
-        })
+                                  colour_buttons=colour_buttons,
+                                  input_channel=input_channel,
+                                  event_queue=self.event_queue,
+                                  index=index,
+                                  finished_retention=self.macro_retention,
+                                  command_address=command_address)
+        if self.engine:
+            self._children[index] = server
+            self.engine.add(server, reconnect_address)
+        else:
+            controller = Process(target=server.run, args=(reconnect_address,))
+            controller.daemon = True
+            self._children[index] = controller
+            controller.start()
 
-    def stop_macro(self, index, macro_id):
+            # The controller process holds its own copy of the command socket
+            if server.command_socket:
+                server.command_socket.close()
 
-        self._controller_queues[index].put({
-            "type": "stop",
-            "macro_id": macro_id,
-        })
+        # Only register the controller once its command socket is bound
+        self.state[index] = controller_state
+
+    def relay_message(self, message):
+
+        index = messages.decode_header(message)[1]
+        if index in self._controller_queues:
+            self._controller_queues[index].put(message)
 
     def clear_macros(self, index):
 
-        self._controller_queues[index].put({
-            "type": "clear",
-        })
+        self._controller_queues[index].put(
+            messages.encode_message(messages.CLEAR_MACROS, index))
 
     def remove_controller(self, index):
-        
-        self._children[index].terminate()
+
+        if self.engine:
+            self.engine.remove(self._children.pop(index))
+        else:
+            self._children[index].terminate()
         self.state.pop(index, None)
 
     def shutdown(self):
 
-        # Loop over children and kill all
-        for index in self._children.keys():
-            child = self._children[index]
-            child.terminate()
+        if self.engine:
+            self.engine.stop()
+        else:
+            # Loop over children and kill all
+            for index in self._children.keys():
+                child = self._children[index]
+                child.terminate()
 
         self.controller_resources.shutdown()
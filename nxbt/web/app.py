@@ -1,15 +1,23 @@
+import atexit
 import json
 import os
-from threading import RLock
+import struct
+from threading import RLock, Lock
+from collections import deque
 import time
 from socket import gethostname
 from datetime import datetime
 
 from .cert import generate_cert
+from .metrics import render_metrics
+from .store import Store, MACROS, SWITCH_MACS
 from ..nxbt import Nxbt, PRO_CONTROLLER
-from flask import Flask, render_template, request
-from flask_socketio import SocketIO, emit
+from ..controller.messages import decode_input_frame, sanitize_direct_input
+from ..controller.input import encode_direct_input
+from flask import Flask, Response, render_template, request
+from flask_socketio import SocketIO, emit, join_room, leave_room
 import eventlet
+from eventlet.hubs import trampoline
 
 
 app = Flask(__name__,
@@ -21,6 +29,7 @@ nxbt = Nxbt()
 DATA_DIR = os.path.join(os.path.dirname(__file__), "data")
 SWITCH_MAC_FILE = os.path.join(DATA_DIR, "switch_macs.json")
 MACROS_FILE = os.path.join(DATA_DIR, "macros.json")
+STORE_FILE = os.path.join(DATA_DIR, "store.db")
 
 # Ensure data directory exists
 if not os.path.exists(DATA_DIR):
@@ -48,32 +57,220 @@ USER_INFO = {}
 RUNNING_MACROS = {}  # Track running macros: {session_id: {'macro_id': str, 'controller_index': int}}
 ACTIVE_CONTROLLERS = {}  # Track active controllers: {controller_index: {'clients': set(), 'mac_address': str, 'created_at': str}}
 SESSION_TO_CONTROLLER = {}  # Map session_id to controller_index for quick lookup
+# Macro throughput: {controller_index: {'started': int, 'completed': int, 'stopped': int}}
+MACRO_COUNTS = {}
+# Completed macro IDs waiting to be fanned out: {controller_index: CompletionQueue}
+MACRO_WATCHERS = {}
+
+# Direct input from all clients is coalesced per controller and
+# written once a controller tick, keeping only the latest input.
+INPUT_FLUSH_INTERVAL = 1 / 132
+# Latest unwritten input: {controller_index: (DirectInput, received time)}
+PENDING_INPUT = {}
+INPUT_FLUSHER = {'running': False}
+
+# Controller state is snapshotted from the Manager proxies in the
+# background and changes are pushed to all clients in the state room,
+# rather than each client polling for a fresh copy.
+STATE_ROOM = 'state'
+STATE_BROADCAST_INTERVAL = 0.5
+STATE_SNAPSHOT = {'state': {}}
+
+# The /metrics page is rendered from the state snapshot
+# in the background and served from a cache.
+METRICS_REFRESH_INTERVAL = 5
+METRICS_SNAPSHOT = {'text': None}
+
+
+# Saved macros and Switch MAC addresses are served from memory and
+# written to SQLite a row at a time on the store's writer thread, so
+# the hub never waits on a commit. Every change is pushed to all
+# clients as a single entry, rather than the whole collection.
+STORE = Store(STORE_FILE, legacy_paths={
+    MACROS: MACROS_FILE,
+    SWITCH_MACS: SWITCH_MAC_FILE,
+})
+# Commit any queued writes on exit
+atexit.register(STORE.close)
+
+
+def on_store_changed(collection, key, value):
+    """Push a changed (or deleted, if value is None) entry to all clients"""
+    if collection == MACROS:
+        sio.emit('macro_changed', {'name': key, 'macro': value})
+    elif collection == SWITCH_MACS:
+        sio.emit('switch_mac_changed', {'mac_address': key, 'switch': value})
+
+
+STORE.subscribe(on_store_changed)
+
+
+def controller_room(controller_index):
+    """Get the Socket.IO room of the sessions using a controller"""
+    return f"controller_{controller_index}"
+
+
+class CompletionQueue():
+    """A queue of completed macro IDs, filled from Nxbt's event listener
+    thread and waited on by a green thread. The waiter is woken through
+    a pipe, so waiting doesn't hold one of eventlet's pool threads."""
+
+    def __init__(self):
+        self.items = deque()
+        self.lock = Lock()
+        self.closed = False
+        self.reader, self.writer = os.pipe()
+        os.set_blocking(self.reader, False)
+        os.set_blocking(self.writer, False)
+
+    def put(self, item):
+        """Queue an item. Safe to call from any thread."""
+        with self.lock:
+            if self.closed:
+                return
+            self.items.append(item)
+            try:
+                os.write(self.writer, b"\0")
+            except BlockingIOError:
+                # The waiter already has a pending wakeup
+                pass
+
+    def get(self):
+        """Wait for and get the next item. Must be called from a green thread."""
+        while not self.items:
+            trampoline(self.reader, read=True)
+            try:
+                os.read(self.reader, 4096)
+            except BlockingIOError:
+                pass
+        return self.items.popleft()
+
+    def close(self):
+        """Close the wakeup pipe. Later items are dropped."""
+        with self.lock:
+            self.closed = True
+            os.close(self.reader)
+            os.close(self.writer)
+
+
+def get_macro_watcher(controller_index):
+    """Get the completion queue of a controller's macro watcher, starting the watcher if needed"""
+    with user_info_lock:
+        completions = MACRO_WATCHERS.get(controller_index)
+        if completions is None:
+            completions = CompletionQueue()
+            MACRO_WATCHERS[controller_index] = completions
+            sio.start_background_task(watch_macros, controller_index, completions)
+    return completions
+
+
+def stop_macro_watcher(controller_index):
+    """Stop the macro watcher of a removed controller"""
+    with user_info_lock:
+        completions = MACRO_WATCHERS.pop(controller_index, None)
+    if completions is not None:
+        completions.put(None)
+
+
+def watch_macros(controller_index, completions):
+    """Background task to fan out macro completions on a controller to all of its sessions"""
+    while True:
+        macro_id = completions.get()
+        if macro_id is None:
+            completions.close()
+            break
+
+        with user_info_lock:
+            sessions = [
+                session_id for session_id, macro_info in RUNNING_MACROS.items()
+                if macro_info['macro_id'] == macro_id]
+            for session_id in sessions:
+                del RUNNING_MACROS[session_id]
+        # Stopped macros complete too, but were already counted as stopped
+        if sessions:
+            count_macro(controller_index, 'completed')
+
+        sio.emit('macro_completed', {
+            'macro_id': macro_id,
+            'controller_index': controller_index
+        }, room=controller_room(controller_index))
+
+
+def count_macro(controller_index, key):
+    """Count a started, completed or stopped macro for the metrics"""
+    with user_info_lock:
+        counts = MACRO_COUNTS.setdefault(
+            controller_index, {'started': 0, 'completed': 0, 'stopped': 0})
+        counts[key] += 1
+
+
+def snapshot_state():
+    """Copy the state of all controllers out of the Manager proxies"""
+    state_proxy = nxbt.state.copy()
+    state = {}
+    for controller in state_proxy.keys():
+        state[controller] = state_proxy[controller].copy()
+    return state
+
+
+def diff_state(old, new):
+    """Get the changes between two state snapshots as
+    {controller_index: {field: value}}, where removed controllers are None"""
+    diff = {}
+    for controller, controller_state in new.items():
+        old_state = old.get(controller)
+        if old_state is None:
+            diff[controller] = controller_state
+            continue
+        changed = {
+            field: value for field, value in controller_state.items()
+            if old_state.get(field) != value}
+        if changed:
+            diff[controller] = changed
+    for controller in old.keys():
+        if controller not in new:
+            diff[controller] = None
+    return diff
+
+
+def broadcast_state():
+    """Background task to snapshot the controller state and push changes to the state room"""
+    while True:
+        try:
+            state = snapshot_state()
+            diff = diff_state(STATE_SNAPSHOT['state'], state)
+            STATE_SNAPSHOT['state'] = state
+            if diff:
+                sio.emit('state_diff', diff, room=STATE_ROOM)
+        except Exception as e:
+            print(f"Error broadcasting state: {e}")
+        sio.sleep(STATE_BROADCAST_INTERVAL)
 
 
-# Helper functions for data management
-def load_switch_macs():
-    """Load saved Switch MAC addresses from file"""
-    if os.path.exists(SWITCH_MAC_FILE):
-        with open(SWITCH_MAC_FILE, 'r') as f:
-            return json.load(f)
-    return {}
+def build_metrics_snapshot():
+    """Render the metrics of all controllers from the latest state snapshot"""
+    controller_states = STATE_SNAPSHOT['state']
 
-def save_switch_macs(macs):
-    """Save Switch MAC addresses to file"""
-    with open(SWITCH_MAC_FILE, 'w') as f:
-        json.dump(macs, f, indent=2)
+    with user_info_lock:
+        active_controllers = {
+            index: len(info['clients'])
+            for index, info in ACTIVE_CONTROLLERS.items()}
+        client_count = len(USER_INFO)
+        macro_counts = {
+            index: dict(counts) for index, counts in MACRO_COUNTS.items()}
 
-def load_macros():
-    """Load saved macros from file"""
-    if os.path.exists(MACROS_FILE):
-        with open(MACROS_FILE, 'r') as f:
-            return json.load(f)
-    return {}
+    METRICS_SNAPSHOT['text'] = render_metrics(
+        controller_states, active_controllers, client_count, macro_counts)
 
-def save_macros(macros):
-    """Save macros to file"""
-    with open(MACROS_FILE, 'w') as f:
-        json.dump(macros, f, indent=2)
+
+def refresh_metrics():
+    """Background task to keep the metrics snapshot up to date"""
+    while True:
+        try:
+            build_metrics_snapshot()
+        except Exception as e:
+            print(f"Error refreshing metrics: {e}")
+        sio.sleep(METRICS_REFRESH_INTERVAL)
 
 
 @app.route('/')
@@ -81,22 +278,30 @@ def index():
     return render_template('index.html')
 
 
+@app.route('/metrics')
+def metrics():
+    if METRICS_SNAPSHOT['text'] is None:
+        build_metrics_snapshot()
+    return Response(METRICS_SNAPSHOT['text'],
+                    mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+
 @sio.on('connect')
 def on_connect():
     with user_info_lock:
         USER_INFO[request.sid] = {}
     
+    # Subscribe the new client to state changes, starting from the latest snapshot
+    join_room(STATE_ROOM)
+    emit('state', STATE_SNAPSHOT['state'])
+
     # Send list of active controllers to the new client
     emit('active_controllers', get_active_controllers_info())
 
 
 @sio.on('state')
 def on_state():
-    state_proxy = nxbt.state.copy()
-    state = {}
-    for controller in state_proxy.keys():
-        state[controller] = state_proxy[controller].copy()
-    emit('state', state)
+    emit('state', STATE_SNAPSHOT['state'])
 
 
 @sio.on('disconnect')
@@ -112,6 +317,7 @@ def on_disconnect():
                     macro_info['macro_id'],
                     block=False
                 )
+                count_macro(macro_info['controller_index'], 'stopped')
                 del RUNNING_MACROS[request.sid]
             
             # Check if this session was controlling a controller
@@ -125,6 +331,7 @@ def on_disconnect():
                     # Only remove controller if no clients are left
                     if not ACTIVE_CONTROLLERS[controller_index]['clients']:
                         nxbt.remove_controller(controller_index)
+                        stop_macro_watcher(controller_index)
                         del ACTIVE_CONTROLLERS[controller_index]
                         print(f"Removed controller {controller_index} - no clients left")
                     else:
@@ -143,6 +350,7 @@ def on_disconnect():
 @sio.on('shutdown')
 def on_shutdown(index):
     nxbt.remove_controller(index)
+    stop_macro_watcher(index)
 
 
 @sio.on('web_create_pro_controller')
@@ -170,6 +378,7 @@ def on_create_controller(mac_address=None):
                 'controller_type': 'Pro Controller'
             }
             SESSION_TO_CONTROLLER[request.sid] = index
+        join_room(controller_room(index))
 
         emit('create_pro_controller', index)
         
@@ -187,20 +396,20 @@ def on_controller_connected(data):
         name = data.get('name', 'Unnamed Switch')
         
         if mac_address:
-            macs = load_switch_macs()
+            now = datetime.now().isoformat()
+            switch = STORE.get(SWITCH_MACS, mac_address)
             
             # Add or update MAC address
-            if mac_address not in macs:
-                macs[mac_address] = {
+            if switch is None:
+                switch = {
                     'name': name,
-                    'first_connected': datetime.now().isoformat(),
-                    'last_connected': datetime.now().isoformat()
+                    'first_connected': now,
+                    'last_connected': now
                 }
             else:
-                macs[mac_address]['last_connected'] = datetime.now().isoformat()
+                switch['last_connected'] = now
             
-            save_switch_macs(macs)
-            emit('switch_macs_updated', macs)
+            STORE.put(SWITCH_MACS, mac_address, switch)
     except Exception as e:
         print(f"Error saving MAC address: {e}")
         emit('error', str(e))
@@ -210,8 +419,7 @@ def on_controller_connected(data):
 def on_get_switch_macs():
     """Get all saved Switch MAC addresses"""
     try:
-        macs = load_switch_macs()
-        emit('switch_macs', macs)
+        emit('switch_macs', STORE.all(SWITCH_MACS))
     except Exception as e:
         emit('error', str(e))
 
@@ -220,11 +428,7 @@ def on_get_switch_macs():
 def on_delete_switch_mac(mac_address):
     """Delete a saved Switch MAC address"""
     try:
-        macs = load_switch_macs()
-        if mac_address in macs:
-            del macs[mac_address]
-            save_switch_macs(macs)
-            emit('switch_macs_updated', macs)
+        STORE.delete(SWITCH_MACS, mac_address)
     except Exception as e:
         emit('error', str(e))
 
@@ -237,11 +441,10 @@ def on_update_switch_name(data):
         new_name = data.get('name')
         
         if mac_address and new_name:
-            macs = load_switch_macs()
-            if mac_address in macs:
-                macs[mac_address]['name'] = new_name
-                save_switch_macs(macs)
-                emit('switch_macs_updated', macs)
+            switch = STORE.get(SWITCH_MACS, mac_address)
+            if switch is not None:
+                switch['name'] = new_name
+                STORE.put(SWITCH_MACS, mac_address, switch)
     except Exception as e:
         emit('error', str(e))
 
@@ -250,8 +453,7 @@ def on_update_switch_name(data):
 def on_get_macros():
     """Get all saved macros"""
     try:
-        macros = load_macros()
-        emit('macros', macros)
+        emit('macros', STORE.all(MACROS))
     except Exception as e:
         emit('error', str(e))
 
@@ -264,14 +466,12 @@ def on_save_macro(data):
         macro_content = data.get('content')
         
         if macro_name and macro_content:
-            macros = load_macros()
-            macros[macro_name] = {
+            now = datetime.now().isoformat()
+            STORE.put(MACROS, macro_name, {
                 'content': macro_content,
-                'created': datetime.now().isoformat(),
-                'modified': datetime.now().isoformat()
-            }
-            save_macros(macros)
-            emit('macros_updated', macros)
+                'created': now,
+                'modified': now
+            })
     except Exception as e:
         emit('error', str(e))
 
@@ -280,11 +480,7 @@ def on_save_macro(data):
 def on_delete_macro(macro_name):
     """Delete a saved macro"""
     try:
-        macros = load_macros()
-        if macro_name in macros:
-            del macros[macro_name]
-            save_macros(macros)
-            emit('macros_updated', macros)
+        STORE.delete(MACROS, macro_name)
     except Exception as e:
         emit('error', str(e))
 
@@ -297,23 +493,16 @@ def on_update_macro(data):
         new_name = data.get('new_name')
         content = data.get('content')
         
-        macros = load_macros()
+        macro = STORE.get(MACROS, old_name)
         
-        if old_name in macros:
-            # If name changed, delete old entry
-            if old_name != new_name:
-                created = macros[old_name].get('created', datetime.now().isoformat())
-                del macros[old_name]
-            else:
-                created = macros[old_name].get('created', datetime.now().isoformat())
-            
-            macros[new_name] = {
+        if macro is not None:
+            now = datetime.now().isoformat()
+            # Renaming replaces the old entry
+            STORE.rename(MACROS, old_name, new_name, {
                 'content': content,
-                'created': created,
-                'modified': datetime.now().isoformat()
-            }
-            save_macros(macros)
-            emit('macros_updated', macros)
+                'created': macro.get('created') or now,
+                'modified': now
+            })
     except Exception as e:
         emit('error', str(e))
 
@@ -323,7 +512,7 @@ def get_active_controllers_info():
     controllers_info = []
     for controller_index, info in ACTIVE_CONTROLLERS.items():
         # Get current controller state
-        controller_state = nxbt.state.get(controller_index, {})
+        controller_state = STATE_SNAPSHOT['state'].get(controller_index, {})
         
         controllers_info.append({
             'index': controller_index,
@@ -355,6 +544,7 @@ def on_join_controller_session(controller_index):
                 # Add this session to the controller's client list
                 ACTIVE_CONTROLLERS[controller_index]['clients'].add(request.sid)
                 SESSION_TO_CONTROLLER[request.sid] = controller_index
+                join_room(controller_room(controller_index))
                 
                 # Update user info
                 USER_INFO[request.sid]["controller_index"] = controller_index
@@ -390,6 +580,7 @@ def on_leave_controller_session():
                     print(f"Session {request.sid} left controller {controller_index}")
                 
                 del SESSION_TO_CONTROLLER[request.sid]
+                leave_room(controller_room(controller_index))
                 
                 # Clear user info controller data
                 if "controller_index" in USER_INFO[request.sid]:
@@ -430,6 +621,8 @@ def on_force_remove_controller(controller_index):
                 
                 # Remove controller
                 nxbt.remove_controller(controller_index)
+                stop_macro_watcher(controller_index)
+                sio.close_room(controller_room(controller_index))
                 del ACTIVE_CONTROLLERS[controller_index]
                 
                 # Broadcast updated active controllers
@@ -442,13 +635,71 @@ def on_force_remove_controller(controller_index):
         emit('error', str(e))
 
 
+def queue_input(controller_index, input_packet, received_at):
+    """Queue a controller's latest input, starting the input flusher if needed"""
+    with user_info_lock:
+        PENDING_INPUT[controller_index] = (input_packet, received_at)
+        if not INPUT_FLUSHER['running']:
+            INPUT_FLUSHER['running'] = True
+            sio.start_background_task(flush_input)
+
+
+def flush_input():
+    """Background task to write queued input, at most once a tick per controller.
+    The task exits once a tick passes without any new input."""
+    running = True
+    try:
+        while True:
+            with user_info_lock:
+                pending = PENDING_INPUT.copy()
+                PENDING_INPUT.clear()
+                if not pending:
+                    INPUT_FLUSHER['running'] = running = False
+                    return
+
+            for controller_index, (input_packet, received_at) in pending.items():
+                try:
+                    nxbt.set_controller_input(
+                        controller_index, input_packet, origin_time=received_at)
+                except ValueError:
+                    # The controller was removed
+                    pass
+
+            sio.sleep(INPUT_FLUSH_INTERVAL)
+    finally:
+        # Let the next input start a new flusher if this one failed
+        if running:
+            with user_info_lock:
+                INPUT_FLUSHER['running'] = False
+
+
 @sio.on('input')
 def handle_input(message):
-    # print("Webapp Input", time.perf_counter())
-    message = json.loads(message)
-    index = message[0]
-    input_packet = message[1]
-    nxbt.set_controller_input(index, input_packet)
+    # The origin of the input's latency trace (see Nxbt trace_latency)
+    received_at = time.perf_counter()
+    if isinstance(message, (bytes, bytearray)):
+        try:
+            index, input_packet = decode_input_frame(message)
+        except struct.error:
+            # Drop malformed frames
+            return
+    else:
+        # JSON input packets: [index, input packet]. Packets are encoded
+        # here so that malformed ones are dropped before they're queued.
+        try:
+            message = json.loads(message)
+            index = message[0]
+            if type(index) is not int:
+                return
+            input_packet = sanitize_direct_input(
+                encode_direct_input(message[1]))
+        except (KeyError, IndexError, TypeError, ValueError):
+            return
+
+    with user_info_lock:
+        if index not in ACTIVE_CONTROLLERS:
+            return
+    queue_input(index, input_packet, received_at)
 
 
 @sio.on('macro')
@@ -456,10 +707,14 @@ def handle_macro(message):
     message = json.loads(message)
     index = message[0]
     macro = message[1]
-    
-    # Start macro without blocking (non-blocking mode)
-    macro_id = nxbt.macro(index, macro, block=False)
-    
+
+    with user_info_lock:
+        if index not in ACTIVE_CONTROLLERS:
+            emit('error', f"Controller {index} does not exist")
+            return
+
+    macro_id = os.urandom(24).hex()
+
     # Track the running macro for this session
     with user_info_lock:
         RUNNING_MACROS[request.sid] = {
@@ -467,15 +722,32 @@ def handle_macro(message):
             'controller_index': index,
             'macro_content': macro
         }
-    
+
+    # Start macro without blocking. The controller's macro watcher
+    # reports its completion to every session using the controller.
+    try:
+        future = nxbt.submit_macro(index, macro, macro_id=macro_id)
+    except Exception:
+        with user_info_lock:
+            RUNNING_MACROS.pop(request.sid, None)
+        raise
+    count_macro(index, 'started')
+    completions = get_macro_watcher(index)
+
+    def on_macro_done(future):
+        # Failed macros are reported as completed too,
+        # so that no session is left waiting on them
+        if future.cancelled() or future.exception() is not None:
+            print(f"Macro {macro_id} on controller {index} failed")
+        completions.put(macro_id)
+
+    future.add_done_callback(on_macro_done)
+
     # Emit macro started event
     emit('macro_started', {
         'macro_id': macro_id,
         'controller_index': index
     })
-    
-    # Start a background task to monitor macro completion
-    sio.start_background_task(monitor_macro_completion, request.sid, index, macro_id)
 
 
 @sio.on('stop_macro')
@@ -490,6 +762,7 @@ def handle_stop_macro():
                 
                 # Stop the macro
                 nxbt.stop_macro(controller_index, macro_id, block=False)
+                count_macro(controller_index, 'stopped')
                 
                 # Clean up tracking
                 del RUNNING_MACROS[request.sid]
@@ -502,32 +775,6 @@ def handle_stop_macro():
         emit('error', str(e))
 
 
-def monitor_macro_completion(session_id, controller_index, macro_id):
-    """Background task to monitor when a macro completes"""
-    try:
-        while True:
-            # Check if macro is finished
-            if controller_index in nxbt.state:
-                finished_macros = nxbt.state[controller_index].get('finished_macros', [])
-                if macro_id in finished_macros:
-                    # Macro completed
-                    with user_info_lock:
-                        if session_id in RUNNING_MACROS:
-                            del RUNNING_MACROS[session_id]
-                    
-                    # Emit completion event to the specific client
-                    sio.emit('macro_completed', {
-                        'macro_id': macro_id,
-                        'controller_index': controller_index
-                    }, room=session_id)
-                    break
-            
-            # Sleep for a short time before checking again
-            sio.sleep(0.1)
-    except Exception as e:
-        print(f"Error monitoring macro completion: {e}")
-
-
 @sio.on('get_macro_status')
 def handle_get_macro_status():
     """Get the current macro status for this session"""
@@ -541,7 +788,12 @@ def handle_get_macro_status():
             emit('macro_status', {'running': False})
 
 
-def start_web_app(ip='0.0.0.0', port=8000, usessl=False, cert_path=None):
+def start_web_app(ip='0.0.0.0', port=8000, usessl=False, cert_path=None,
+                  trace_latency=False):
+    nxbt.trace_latency = trace_latency
+    sio.start_background_task(broadcast_state)
+    sio.start_background_task(refresh_metrics)
+
     if usessl:
         if cert_path is None:
             # Store certs in the package directory
@@ -0,0 +1,229 @@
+"""
+Renders the webapp's controller metrics in the Prometheus text
+exposition format (version 0.0.4), for scraping from /metrics.
+"""
+
+# Every state a controller can report, exported as a set of
+# gauges where only the current state is 1.
+CONTROLLER_STATES = (
+    "initializing", "connecting", "reconnecting", "connected", "crashed")
+
+# Controller metrics exported as counters, mapped to their
+# key in the controller's metrics dict.
+CONTROLLER_COUNTERS = (
+    ("nxbt_controller_ticks_total",
+     "Ticks run by the controller", "ticks"),
+    ("nxbt_controller_overruns_total",
+     "Ticks run over 1.5 tick periods after the last", "overruns"),
+    ("nxbt_controller_missed_ticks_total",
+     "Ticks skipped by the controller's scheduler", "missed_ticks"),
+    ("nxbt_controller_reports_sent_total",
+     "Reports sent to the Switch", "reports_sent"),
+    ("nxbt_controller_sent_bytes_total",
+     "Bytes sent to the Switch", "bytes_sent"),
+    ("nxbt_controller_reports_received_total",
+     "Reports received from the Switch", "reports_received"),
+    ("nxbt_controller_received_bytes_total",
+     "Bytes received from the Switch", "bytes_received"),
+    ("nxbt_controller_blocking_errors_total",
+     "Reports that couldn't be sent without blocking", "blocking_errors"),
+    ("nxbt_controller_connection_errors_total",
+     "Lost connections to the Switch", "os_errors"),
+    ("nxbt_controller_reconnects_total",
+     "Reconnections to the Switch", "reconnects"),
+)
+
+# Controller metrics exported as gauges
+CONTROLLER_GAUGES = (
+    ("nxbt_controller_tick_rate_hertz",
+     "Ticks per second over the last metrics interval", "tick_rate"),
+    ("nxbt_controller_tick_jitter_seconds",
+     "Standard deviation of the tick release lateness", "jitter"),
+    ("nxbt_controller_tick_interval_max_seconds",
+     "The longest interval between two ticks", "tick_interval_max"),
+    ("nxbt_controller_macro_queue_depth",
+     "Queued and running macros", "macro_queue_depth"),
+)
+
+
+def escape_label(value):
+    """Escapes a label value for the text exposition format.
+
+    :param value: The label value
+    :type value: any
+    :return: The escaped value
+    :rtype: str
+    """
+
+    return (str(value).replace("\\", "\\\\")
+            .replace("\"", "\\\"").replace("\n", "\\n"))
+
+
+def format_labels(labels):
+
+    if not labels:
+        return ""
+
+    pairs = ",".join(
+        f"{name}=\"{escape_label(value)}\"" for name, value in labels)
+    return "{" + pairs + "}"
+
+
+class MetricsWriter():
+    """Builds a page of metrics in the text exposition format.
+    """
+
+    def __init__(self):
+
+        self.lines = []
+
+    def family(self, name, help_text, metric_type):
+        """Starts a metric family.
+
+        :param name: The metric name
+        :type name: str
+        :param help_text: A description of the metric
+        :type help_text: str
+        :param metric_type: The metric type (eg: "counter", "gauge")
+        :type metric_type: str
+        """
+
+        self.lines.append(f"# HELP {name} {help_text}")
+        self.lines.append(f"# TYPE {name} {metric_type}")
+
+    def sample(self, name, value, labels=None):
+        """Adds a sample to the current metric family.
+
+        :param name: The sample name
+        :type name: str
+        :param value: The sample value
+        :type value: int or float
+        :param labels: A list of (label name, value) tuples,
+        defaults to None
+        :type labels: list, optional
+        """
+
+        if value is None:
+            return
+        if isinstance(value, bool):
+            value = int(value)
+        self.lines.append(f"{name}{format_labels(labels)} {value}")
+
+    def histogram(self, name, bounds, counts, total, labels):
+        """Adds the samples of a histogram to the current metric family.
+
+        :param name: The histogram name
+        :type name: str
+        :param bounds: The upper bounds of all but the last bucket
+        :type bounds: list
+        :param counts: The (non-cumulative) count of each bucket,
+        including the last, unbounded bucket
+        :type counts: list
+        :param total: The sum of all observed values
+        :type total: float
+        :param labels: A list of (label name, value) tuples
+        :type labels: list
+        """
+
+        count = 0
+        for bound, bucket in zip(list(bounds) + ["+Inf"], counts):
+            count += bucket
+            self.sample(f"{name}_bucket", count, labels + [("le", bound)])
+        self.sample(f"{name}_sum", total, labels)
+        self.sample(f"{name}_count", count, labels)
+
+    def render(self):
+        """Gets the page of metrics.
+
+        :return: The metrics in the text exposition format
+        :rtype: str
+        """
+
+        return "\n".join(self.lines) + "\n"
+
+
+def render_metrics(controller_states, active_controllers, client_count,
+                   macro_counts):
+    """Renders the metrics of all controllers.
+
+    :param controller_states: A copy of Nxbt.state, with each
+    controller's state copied to a plain dict
+    :type controller_states: dict
+    :param active_controllers: Controller indices mapped to the number
+    of Socket.IO clients using them
+    :type active_controllers: dict
+    :param client_count: The number of connected Socket.IO clients
+    :type client_count: int
+    :param macro_counts: Controller indices mapped to a dict of
+    "started", "completed" and "stopped" macro counts
+    :type macro_counts: dict
+    :return: The metrics in the text exposition format
+    :rtype: str
+    """
+
+    writer = MetricsWriter()
+
+    writer.family("nxbt_socketio_clients",
+                  "Connected Socket.IO clients", "gauge")
+    writer.sample("nxbt_socketio_clients", client_count)
+
+    writer.family("nxbt_controllers", "Created controllers", "gauge")
+    writer.sample("nxbt_controllers", len(controller_states))
+
+    writer.family("nxbt_controller_clients",
+                  "Socket.IO clients using the controller", "gauge")
+    for index, clients in active_controllers.items():
+        writer.sample("nxbt_controller_clients", clients,
+                      [("controller", index)])
+
+    writer.family("nxbt_controller_state",
+                  "The controller's connection state", "gauge")
+    for index, state in controller_states.items():
+        current = state.get("state")
+        for name in CONTROLLER_STATES:
+            writer.sample("nxbt_controller_state", int(current == name),
+                          [("controller", index), ("state", name)])
+
+    for name, help_text, key in CONTROLLER_GAUGES:
+        writer.family(name, help_text, "gauge")
+        for index, state in controller_states.items():
+            metrics = state.get("metrics")
+            if metrics:
+                writer.sample(name, metrics.get(key), [("controller", index)])
+
+    for name, help_text, key in CONTROLLER_COUNTERS:
+        writer.family(name, help_text, "counter")
+        for index, state in controller_states.items():
+            metrics = state.get("metrics")
+            if metrics:
+                writer.sample(name, metrics.get(key), [("controller", index)])
+
+    name = "nxbt_controller_tick_interval_seconds"
+    writer.family(name, "Intervals between ticks", "histogram")
+    for index, state in controller_states.items():
+        metrics = state.get("metrics")
+        if not metrics:
+            continue
+        writer.histogram(
+            name, metrics["tick_interval_buckets"], metrics["tick_intervals"],
+            metrics.get("tick_interval_total", 0), [("controller", index)])
+
+    name = "nxbt_controller_latency_seconds"
+    writer.family(
+        name, "Latency of traced input and macros by stage", "histogram")
+    for index, state in controller_states.items():
+        metrics = state.get("metrics")
+        if not metrics:
+            continue
+        for stage, histogram in metrics.get("latency", {}).items():
+            writer.histogram(
+                name, histogram["buckets"], histogram["counts"],
+                histogram["sum"], [("controller", index), ("stage", stage)])
+
+    for key in ("started", "completed", "stopped"):
+        name = f"nxbt_macros_{key}_total"
+        writer.family(name, f"Macros {key} through the webapp", "counter")
+        for index, counts in macro_counts.items():
+            writer.sample(name, counts.get(key, 0), [("controller", index)])
+
+    return writer.render()
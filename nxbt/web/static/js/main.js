@@ -140,7 +140,33 @@ let INPUT_PACKET = {
     "B": false,
     "A": false
 }
-let INPUT_PACKET_OLD = JSON.parse(JSON.stringify(INPUT_PACKET));
+let INPUT_FRAME_OLD = new Uint8Array(0);
+
+// Button bitmasks for binary input frames (see nxbt/controller/input.py)
+const INPUT_FRAME_BUTTONS = [
+    ["Y", 0x010000],
+    ["X", 0x020000],
+    ["B", 0x040000],
+    ["A", 0x080000],
+    ["JCL_SR", 0x100000],
+    ["JCL_SL", 0x200000],
+    ["R", 0x400000],
+    ["ZR", 0x800000],
+    ["PLUS", 0x000100],
+    ["MINUS", 0x000200],
+    ["HOME", 0x001000],
+    ["CAPTURE", 0x002000],
+    ["DPAD_DOWN", 0x000001],
+    ["DPAD_UP", 0x000002],
+    ["DPAD_RIGHT", 0x000004],
+    ["DPAD_LEFT", 0x000008],
+    ["JCR_SR", 0x000010],
+    ["JCR_SL", 0x000020],
+    ["L", 0x000040],
+    ["ZL", 0x000080]
+]
+const INPUT_FRAME_R_STICK_PRESS = 0x000400;
+const INPUT_FRAME_L_STICK_PRESS = 0x000800;
 
 let PRO_CONTROLLER_DISPLAY = {
     // Sticks
@@ -192,16 +218,25 @@ let PRO_CONTROLLER_DISPLAY = {
 
 let socket = io();
 
-// Request to the state at 1Hz
-socket.emit('state');
-let stateInterval = setInterval(function() {
-    socket.emit('state');
-}, 1000);
-
+// The full state is sent on connecting. After that, only
+// the changed controllers and fields are pushed.
 socket.on('state', function(state) {
     STATE = state;
 });
 
+socket.on('state_diff', function(diff) {
+    if (!STATE) {
+        STATE = {};
+    }
+    for (let index in diff) {
+        if (diff[index] === null) {
+            delete STATE[index];
+        } else {
+            STATE[index] = Object.assign(STATE[index] || {}, diff[index]);
+        }
+    }
+});
+
 socket.on('connect', function() {
     console.log("Connected");
     socket.emit('get_switch_macs');
@@ -645,9 +680,10 @@ function eventLoop() {
     // Only send packet if it's not a duplicate of previous.
     // We can do this since NXBT will hold the previously sent value
     // until we send it a new one.
-    if (JSON.stringify(INPUT_PACKET) !== JSON.stringify(INPUT_PACKET_OLD)) {
-        socket.emit('input', JSON.stringify([NXBT_CONTROLLER_INDEX, INPUT_PACKET]));
-        INPUT_PACKET_OLD = JSON.parse(JSON.stringify(INPUT_PACKET));
+    let inputFrame = encodeInputFrame(NXBT_CONTROLLER_INDEX, INPUT_PACKET);
+    if (!inputFramesEqual(inputFrame, INPUT_FRAME_OLD)) {
+        socket.emit('input', inputFrame.buffer);
+        INPUT_FRAME_OLD = inputFrame;
     }
 
     updateGamepadDisplay()
@@ -671,6 +707,50 @@ function eventLoop() {
     }
 }
 
+// Encodes an input packet as a 10 byte binary input frame:
+// controller index (uint16), button mask (uint32) and the
+// left X/Y and right X/Y stick positions (int8), little endian.
+function encodeInputFrame(index, packet) {
+    let buttons = 0;
+    for (let i = 0; i < INPUT_FRAME_BUTTONS.length; i++) {
+        if (packet[INPUT_FRAME_BUTTONS[i][0]]) {
+            buttons |= INPUT_FRAME_BUTTONS[i][1];
+        }
+    }
+    if (packet["L_STICK"]["PRESSED"]) {
+        buttons |= INPUT_FRAME_L_STICK_PRESS;
+    }
+    if (packet["R_STICK"]["PRESSED"]) {
+        buttons |= INPUT_FRAME_R_STICK_PRESS;
+    }
+
+    let frame = new Uint8Array(10);
+    let view = new DataView(frame.buffer);
+    view.setUint16(0, index, true);
+    view.setUint32(2, buttons, true);
+    view.setInt8(6, encodeAxis(packet["L_STICK"]["X_VALUE"]));
+    view.setInt8(7, encodeAxis(packet["L_STICK"]["Y_VALUE"]));
+    view.setInt8(8, encodeAxis(packet["R_STICK"]["X_VALUE"]));
+    view.setInt8(9, encodeAxis(packet["R_STICK"]["Y_VALUE"]));
+    return frame;
+}
+
+function encodeAxis(value) {
+    return Math.max(-100, Math.min(100, Math.round(value)));
+}
+
+function inputFramesEqual(a, b) {
+    if (a.length !== b.length) {
+        return false;
+    }
+    for (let i = 0; i < a.length; i++) {
+        if (a[i] !== b[i]) {
+            return false;
+        }
+    }
+    return true;
+}
+
 function sendMacro() {
     let macro = HTML_MACRO_TEXT.value.toUpperCase();
     if (!macro.trim()) {
@@ -906,8 +986,14 @@ socket.on('switch_macs', function(macs) {
     updateSwitchManagementList();
 });
 
-socket.on('switch_macs_updated', function(macs) {
-    SAVED_SWITCHES = macs;
+// Changes are pushed one Switch at a time.
+// Deleted Switches are sent with a null switch.
+socket.on('switch_mac_changed', function(change) {
+    if (change.switch === null) {
+        delete SAVED_SWITCHES[change.mac_address];
+    } else {
+        SAVED_SWITCHES[change.mac_address] = change.switch;
+    }
     updateSavedSwitchesList();
     updateSwitchManagementList();
 });
@@ -1023,8 +1109,14 @@ socket.on('macros', function(macros) {
     updateMacroDropdown();
 });
 
-socket.on('macros_updated', function(macros) {
-    SAVED_MACROS = macros;
+// Changes are pushed one macro at a time.
+// Deleted macros are sent with a null macro.
+socket.on('macro_changed', function(change) {
+    if (change.macro === null) {
+        delete SAVED_MACROS[change.name];
+    } else {
+        SAVED_MACROS[change.name] = change.macro;
+    }
     updateMacrosList();
     updateMacroDropdown();
 });
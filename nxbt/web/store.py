@@ -0,0 +1,248 @@
+"""
+Storage for the webapp's saved macros and Switch MAC addresses.
+"""
+
+import os
+import json
+import logging
+import sqlite3
+from queue import Queue
+from threading import RLock, Thread
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS macros (
+    name TEXT PRIMARY KEY,
+    content TEXT,
+    created TEXT,
+    modified TEXT
+);
+CREATE TABLE IF NOT EXISTS switch_macs (
+    mac_address TEXT PRIMARY KEY,
+    name TEXT,
+    first_connected TEXT,
+    last_connected TEXT
+);
+"""
+
+# Store collections
+MACROS = "macros"
+SWITCH_MACS = "switch_macs"
+
+# The columns of each collection, with the key column first
+COLUMNS = {
+    MACROS: ("name", "content", "created", "modified"),
+    SWITCH_MACS: ("mac_address", "name", "first_connected", "last_connected"),
+}
+
+
+class Store():
+    """An in-memory index of saved macros and Switch MAC addresses,
+    backed by SQLite.
+
+    Reads and writes are served from memory. Each write is then
+    committed as a single row upsert or delete in its own transaction,
+    so writes are atomic and don't grow with the size of the library.
+    The database runs in WAL mode with synchronous=FULL, so a committed
+    write survives a power loss. Commits wait on an fsync, so they're
+    made in order on a writer thread rather than by the caller. A
+    write that fails to commit is logged. Listeners are notified of
+    every change so that clients can be sent incremental updates.
+    """
+
+    def __init__(self, path, legacy_paths=None):
+        """Opens (or creates) the store.
+
+        :param path: The path of the SQLite database
+        :type path: str
+        :param legacy_paths: Collections (MACROS or SWITCH_MACS) mapped
+        to JSON files to import. Imported files are renamed with a
+        ".migrated" suffix, defaults to None
+        :type legacy_paths: dict, optional
+        """
+
+        self.logger = logging.getLogger('nxbt')
+        self.lock = RLock()
+        self.listeners = []
+
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=FULL")
+        self.db.executescript(SCHEMA)
+
+        if legacy_paths:
+            self._migrate(legacy_paths)
+
+        self.collections = {}
+        for collection, columns in COLUMNS.items():
+            rows = self.db.execute(
+                f"SELECT {', '.join(columns)} FROM {collection}")
+            self.collections[collection] = {
+                row[0]: dict(zip(columns[1:], row[1:])) for row in rows}
+
+        # Writes are queued in the same order as they're made in memory
+        self.writes = Queue()
+        self.writer = Thread(target=self._write_loop, daemon=True)
+        self.writer.start()
+
+    def _write_loop(self):
+
+        while True:
+            write = self.writes.get()
+            if write is None:
+                return
+            try:
+                with self.db:
+                    write()
+            except sqlite3.Error as e:
+                self.logger.error(f"Unable to save to the store: {e}")
+
+    def _delete_row(self, collection, key):
+
+        self.db.execute(
+            f"DELETE FROM {collection} "
+            f"WHERE {COLUMNS[collection][0]} = ?", (key,))
+
+    def _migrate(self, legacy_paths):
+
+        # Each file is imported in its own transaction and only renamed
+        # once imported, so a failed import is retried on the next start.
+        # Existing rows are kept, in case a file was imported but
+        # couldn't be renamed.
+        for collection, json_path in legacy_paths.items():
+            if not os.path.exists(json_path):
+                continue
+            try:
+                with open(json_path, "r") as f:
+                    entries = json.load(f)
+                with self.db:
+                    for key, value in entries.items():
+                        self._write_row(collection, key, value, replace=False)
+                os.replace(json_path, json_path + ".migrated")
+            except Exception as e:
+                self.logger.warning(f"Unable to import {json_path}: {e}")
+
+    def _write_row(self, collection, key, value, replace=True):
+
+        columns = COLUMNS[collection]
+        conflict = "REPLACE" if replace else "IGNORE"
+        self.db.execute(
+            f"INSERT OR {conflict} INTO {collection} ({', '.join(columns)}) "
+            f"VALUES ({', '.join('?' * len(columns))})",
+            [key] + [value.get(column) for column in columns[1:]])
+
+    def subscribe(self, listener):
+        """Adds a listener that's called on every change with
+        the collection, the key and the new value (or None if
+        the entry was deleted).
+
+        :param listener: The listener function
+        :type listener: function
+        """
+
+        self.listeners.append(listener)
+
+    def _notify(self, collection, key, value):
+
+        for listener in self.listeners:
+            listener(collection, key, value)
+
+    def all(self, collection):
+        """Gets a copy of all entries of a collection.
+
+        :param collection: MACROS or SWITCH_MACS
+        :type collection: str
+        :return: Keys mapped to entries
+        :rtype: dict
+        """
+
+        with self.lock:
+            return {key: dict(value) for key, value
+                    in self.collections[collection].items()}
+
+    def get(self, collection, key):
+        """Gets a copy of an entry.
+
+        :param collection: MACROS or SWITCH_MACS
+        :type collection: str
+        :param key: The entry's key (macro name or MAC address)
+        :type key: str
+        :return: The entry or None
+        :rtype: dict or None
+        """
+
+        with self.lock:
+            value = self.collections[collection].get(key)
+            return dict(value) if value is not None else None
+
+    def put(self, collection, key, value):
+        """Creates or replaces an entry.
+
+        :param collection: MACROS or SWITCH_MACS
+        :type collection: str
+        :param key: The entry's key (macro name or MAC address)
+        :type key: str
+        :param value: The entry
+        :type value: dict
+        """
+
+        value = dict(value)
+        with self.lock:
+            self.collections[collection][key] = value
+            self.writes.put(
+                lambda: self._write_row(collection, key, value))
+        self._notify(collection, key, dict(value))
+
+    def delete(self, collection, key):
+        """Deletes an entry, if it exists.
+
+        :param collection: MACROS or SWITCH_MACS
+        :type collection: str
+        :param key: The entry's key (macro name or MAC address)
+        :type key: str
+        :return: True if the entry existed
+        :rtype: bool
+        """
+
+        with self.lock:
+            if key not in self.collections[collection]:
+                return False
+            del self.collections[collection][key]
+            self.writes.put(lambda: self._delete_row(collection, key))
+        self._notify(collection, key, None)
+        return True
+
+    def rename(self, collection, old_key, new_key, value):
+        """Replaces an entry with one under a new key, atomically.
+
+        :param collection: MACROS or SWITCH_MACS
+        :type collection: str
+        :param old_key: The entry's current key
+        :type old_key: str
+        :param new_key: The entry's new key
+        :type new_key: str
+        :param value: The new entry
+        :type value: dict
+        """
+
+        value = dict(value)
+
+        def write():
+            self._delete_row(collection, old_key)
+            self._write_row(collection, new_key, value)
+
+        with self.lock:
+            self.collections[collection].pop(old_key, None)
+            self.collections[collection][new_key] = value
+            self.writes.put(write)
+        if old_key != new_key:
+            self._notify(collection, old_key, None)
+        self._notify(collection, new_key, dict(value))
+
+    def close(self):
+        """Commits any queued writes and closes the database.
+        """
+
+        self.writes.put(None)
+        self.writer.join()
+        self.db.close()
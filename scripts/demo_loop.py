@@ -93,7 +93,7 @@ def demo():
     for i in range(100):
         print(f"Running Demo: Iteration {i}")
         macro_id = nx.macro(controller_idxs[-1], MACRO, block=False)
-        while macro_id not in nx.state[controller_idxs[-1]]["finished_macros"]:
+        while not nx.macro_finished(controller_idxs[-1], macro_id):
             state = nx.state[controller_idxs[-1]]
             if state['state'] == 'crashed':
                 print("An error occurred while running the demo:")
@@ -0,0 +1,41 @@
+"""
+Pairs controllers with simulated Switches (no Bluetooth required) and
+prints their report cadence, subcommand latency and CPU use.
+
+Usage: python3 simulate_switch.py [--type pro|jcl|jcr] [--count N]
+                                  [--duration SECONDS]
+"""
+
+import argparse
+
+from nxbt.controller import ControllerTypes
+from nxbt.controller.simulator import simulate
+
+
+CONTROLLER_TYPES = {
+    "pro": ControllerTypes.PRO_CONTROLLER,
+    "jcl": ControllerTypes.JOYCON_L,
+    "jcr": ControllerTypes.JOYCON_R,
+}
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--type", choices=CONTROLLER_TYPES.keys(), default="pro")
+    parser.add_argument("--count", type=int, default=1)
+    parser.add_argument("--duration", type=float, default=5)
+    args = parser.parse_args()
+
+    results = simulate(
+        CONTROLLER_TYPES[args.type], count=args.count, duration=args.duration)
+
+    for index, result in enumerate(results):
+        print(f"Controller {index}")
+        print(f"  Handshake:          {result['handshake_time'] * 1000:.2f}ms")
+        print(f"  Report rate:        {result['report_rate']:.1f}Hz")
+        print(f"  Report jitter:      {result['report_interval_jitter'] * 1000:.3f}ms")
+        print(f"  Max report gap:     {result['report_interval_max'] * 1000:.3f}ms")
+        print(f"  Subcommand latency: {result['subcommand_latency_mean'] * 1000:.3f}ms "
+              f"(max {result['subcommand_latency_max'] * 1000:.3f}ms)")
+        print(f"  CPU:                {result['cpu_percent']:.1f}%")
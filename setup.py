@@ -20,6 +20,9 @@ setup(
     extra_require={
         "dev": [
             "pytest"
+        ],
+        "numpy": [
+            "numpy"
         ]
     }
 )
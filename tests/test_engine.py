@@ -0,0 +1,76 @@
+import time
+import queue
+import socket
+
+from nxbt.controller import ControllerTypes
+from nxbt.controller.engine import ControllerEngine
+from nxbt.controller.server import ControllerServer
+from nxbt.controller.simulator import SimulatedBluetooth
+
+
+def create_server():
+
+    server = ControllerServer(
+        ControllerTypes.PRO_CONTROLLER, bluetooth=SimulatedBluetooth(),
+        task_queue=queue.Queue())
+    server.metrics.publish_interval = 0.1
+    return server
+
+
+def run_engine(servers, done, timeout=2):
+    """Runs servers in an engine, as if they just connected,
+    until done() is true or the timeout passes.
+    """
+
+    engine = ControllerEngine()
+    switch_sockets = []
+    for server in servers:
+        switch_itr, itr = socket.socketpair(
+            socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        switch_ctrl, ctrl = socket.socketpair(
+            socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        itr.setblocking(False)
+        switch_sockets += [switch_itr, switch_ctrl]
+        engine.connected.append((server, itr, ctrl))
+
+    engine.start()
+    engine._wake()
+    try:
+        deadline = time.perf_counter() + timeout
+        while not done() and time.perf_counter() < deadline:
+            time.sleep(0.05)
+    finally:
+        engine.stop()
+        for sock in switch_sockets:
+            sock.close()
+
+
+def test_engine_publishes_metrics():
+
+    server = create_server()
+    run_engine([server], lambda: "metrics" in server.state)
+
+    # The server's own scheduler never runs in the engine
+    assert server.scheduler.last_tick is None
+    metrics = server.state["metrics"]
+    assert metrics["ticks"] > 0
+    assert metrics["tick_rate"] > 0
+    assert metrics["reports_sent"] > 0
+
+
+def test_engine_isolates_crashed_controllers():
+
+    crashing = create_server()
+    healthy = create_server()
+
+    def step(itr, reply):
+        raise RuntimeError("Controller failure")
+    crashing.step = step
+
+    run_engine([crashing, healthy], lambda: (
+        crashing.state["state"] == "crashed" and
+        "metrics" in healthy.state))
+
+    assert crashing.state["state"] == "crashed"
+    assert "Controller failure" in crashing.state["errors"]
+    assert healthy.state["metrics"]["ticks"] > 0